@@ -0,0 +1,76 @@
+"""
+集計モジュール - ゲーム記録から統計への反映
+"""
+
+def new_player_stats():
+    """プレイヤー統計の初期値"""
+    return {
+        "総合勝ち得点": 0, "1位": 0, "2位": 0, "3位": 0, "4位": 0,
+        "跳ばし": 0, "跳び": 0, "役満": 0, "確定値": 0
+    }
+
+def apply_game(stats, game_record, sign=1):
+    """1ゲーム分の記録を統計に加算（sign=-1で減算）
+    
+    ゲーム記録・統計は読み込み時に現在のスキーマへ移行済みのため、全項目がそろっている前提。
+    """
+    for player, game_data in game_record["results"].items():
+        if player not in stats:
+            # 減算時は統計のないプレイヤーを対象外にする
+            if sign < 0:
+                continue
+            stats[player] = new_player_stats()
+        
+        player_stats = stats[player]
+        
+        # 順位
+        player_stats[f"{game_data['position']}位"] += sign
+        
+        # 得点・確定値
+        player_stats["総合勝ち得点"] += sign * game_data['score_diff']
+        player_stats["確定値"] += sign * game_data['confirmed_value']
+        
+        # 特殊記録
+        special = game_data['special']
+        if special in ("跳ばし", "跳び"):
+            player_stats[special] += sign
+        
+        # 役満記録（+の場合のみカウント）
+        yakuman_count = game_data['yakuman']
+        if yakuman_count > 0:
+            player_stats["役満"] += sign * yakuman_count
+    
+    return stats
+
+def merge_stats(current, ours, base):
+    """統計の3方向統合（他のプロセスの保存内容に、このセッションでの増減を加える）
+    
+    current: 他のプロセスが保存した統計、ours: このセッションの統計、
+    base: このセッションが前回保存（読み込み）した時点の統計。
+    このセッションで削除したプレイヤーは統合後も削除する。
+    """
+    merged = {}
+    for player, player_stats in current.items():
+        if player in base and player not in ours:
+            continue
+        merged[player] = dict(player_stats)
+    
+    for player, player_stats in ours.items():
+        base_stats = base.get(player, {})
+        target = merged.setdefault(player, {})
+        for key, value in player_stats.items():
+            if not isinstance(value, (int, float)):
+                target[key] = value
+                continue
+            target[key] = target.get(key, 0) + value - base_stats.get(key, 0)
+    return merged
+
+def reconcile_stats(stats, snapshot, merged):
+    """統合結果の増減をセッションの統計へ反映（統合後の変更は保つ）"""
+    for player, player_stats in merged.items():
+        snapshot_stats = snapshot.get(player, {})
+        target = stats.setdefault(player, {})
+        for key, value in player_stats.items():
+            if isinstance(value, (int, float)):
+                target[key] = target.get(key, 0) + value - snapshot_stats.get(key, 0)
+    return stats
@@ -0,0 +1,211 @@
+"""
+バックアップモジュール - 差分バックアップと世代管理
+
+定期的に全データのベースを書き出し、それ以外は前回のバックアップからの差分
+（追加・取り消されたゲーム）のみを書き出す。復元はベースに差分を順に適用する。
+コマンドラインからも実行できる:
+
+    python -m modules.backup create
+    python -m modules.backup list
+    python -m modules.backup restore --output restored.json
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from .data_storage import DATA_DIR, data_lock, write_data_file, read_data_file
+from .export import iter_backup_json
+from .records import insert_after
+from .schema import SCHEMA_VERSION, schema_version, migrate_history, migrate_stats
+
+BACKUP_DIR = DATA_DIR / "backups"
+BACKUP_INDEX_FILE = BACKUP_DIR / "index.json"
+
+# ベース（全データ）を書き出す間隔（日数）。間の日は差分のみ書き出す
+BASE_INTERVAL_DAYS = int(os.environ.get("MAHJONG_BACKUP_BASE_DAYS", "7"))
+
+# 世代管理: 日ごと・週ごとに最新のバックアップを残す数
+KEEP_DAILY = int(os.environ.get("MAHJONG_BACKUP_KEEP_DAILY", "7"))
+KEEP_WEEKLY = int(os.environ.get("MAHJONG_BACKUP_KEEP_WEEKLY", "4"))
+
+def load_index():
+    """バックアップ一覧の読み込み
+    
+    entries は作成順のバックアップ（file, kind: "base" / "delta", created）、
+    ids は最新のバックアップ時点のゲームID。
+    """
+    if not BACKUP_INDEX_FILE.exists():
+        return {"entries": [], "ids": []}
+    return read_data_file(BACKUP_INDEX_FILE)
+
+def _save_index(index):
+    """バックアップ一覧の保存"""
+    write_data_file(BACKUP_INDEX_FILE, index, compact=True)
+
+def last_backup_time():
+    """最新のバックアップの作成日時（バックアップがなければNone）"""
+    entries = load_index()["entries"]
+    if not entries:
+        return None
+    return datetime.fromisoformat(entries[-1]["created"])
+
+def create_backup(history, stats, settings, now=None):
+    """バックアップの作成（ベースの書き出しから BASE_INTERVAL_DAYS 日以内なら差分のみ）
+    
+    戻り値は作成したバックアップファイルのパス。
+    """
+    now = now or datetime.now()
+    with data_lock():
+        BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+        index = load_index()
+        entries = index["entries"]
+        bases = [entry for entry in entries if entry["kind"] == "base"]
+        full = not bases or now - datetime.fromisoformat(bases[-1]["created"]) >= timedelta(days=BASE_INTERVAL_DAYS)
+        
+        data = {"created": now.isoformat(), "stats": stats, "settings": settings, "version": SCHEMA_VERSION}
+        if full:
+            history = list(history)
+            ids = [record["id"] for record in history]
+            data.update(kind="base", history=history)
+        else:
+            # 前回のバックアップ時点のゲームIDと比べて差分を求める
+            # （追加したゲームには、途中に挿入したゲームの位置を復元できるよう直前のゲームIDも記録）
+            previous = set(index["ids"])
+            ids = []
+            added = []
+            after = []
+            for record in history:
+                if record["id"] not in previous:
+                    added.append(record)
+                    after.append(ids[-1] if ids else None)
+                ids.append(record["id"])
+            current = set(ids)
+            removed = [game_id for game_id in index["ids"] if game_id not in current]
+            data.update(kind="delta", previous=entries[-1]["file"], added=added, after=after, removed=removed)
+        
+        path = BACKUP_DIR / f"{data['kind']}-{now.strftime('%Y%m%d_%H%M%S_%f')}.json"
+        write_data_file(path, data, compact=True)
+        
+        entries.append({"file": path.name, "kind": data["kind"], "created": data["created"]})
+        index["ids"] = ids
+        _prune(index)
+        _save_index(index)
+    return path
+
+def _retained_entries(entries):
+    """世代管理で残すバックアップの位置（復元に必要なベース・差分を含む）"""
+    latest_daily = {}
+    latest_weekly = {}
+    for position, entry in enumerate(entries):
+        created = datetime.fromisoformat(entry["created"])
+        latest_daily[created.date()] = position
+        latest_weekly[created.isocalendar()[:2]] = position
+    
+    points = {len(entries) - 1}
+    if KEEP_DAILY > 0:
+        points.update(sorted(latest_daily.values())[-KEEP_DAILY:])
+    if KEEP_WEEKLY > 0:
+        points.update(sorted(latest_weekly.values())[-KEEP_WEEKLY:])
+    
+    # 差分は直前のバックアップに依存するため、ベースまでさかのぼって残す
+    retained = set()
+    for position in points:
+        while position >= 0 and position not in retained:
+            retained.add(position)
+            if entries[position]["kind"] == "base":
+                break
+            position -= 1
+    return retained
+
+def _prune(index):
+    """世代管理から外れたバックアップファイルの削除"""
+    entries = index["entries"]
+    if not entries:
+        return
+    retained = _retained_entries(entries)
+    for position, entry in enumerate(entries):
+        if position not in retained:
+            try:
+                os.remove(BACKUP_DIR / entry["file"])
+            except OSError:
+                pass
+    index["entries"] = [entry for position, entry in enumerate(entries) if position in retained]
+
+def restore_backup(name=None):
+    """バックアップからの復元（ベースに差分を順に適用）
+    
+    name 省略時は最新のバックアップ。戻り値は history・stats・settings・created を持つ辞書。
+    """
+    entries = load_index()["entries"]
+    if not entries:
+        raise FileNotFoundError("バックアップがありません")
+    
+    names = [entry["file"] for entry in entries]
+    position = len(entries) - 1 if name is None else names.index(name)
+    
+    # 復元するバックアップからベースまでさかのぼる
+    chain = []
+    while position >= 0:
+        chain.append(entries[position])
+        if entries[position]["kind"] == "base":
+            break
+        position -= 1
+    if chain[-1]["kind"] != "base":
+        raise ValueError(f"ベースのバックアップが見つかりません: {chain[0]['file']}")
+    
+    history = []
+    for entry in reversed(chain):
+        data = read_data_file(BACKUP_DIR / entry["file"])
+        version = schema_version(data)
+        if data["kind"] == "base":
+            history = migrate_history(data["history"], version)
+        else:
+            removed = set(data["removed"])
+            history = [record for record in history if record["id"] not in removed]
+            added = migrate_history(data["added"], version)
+            if "after" in data:
+                for record, previous_id in zip(added, data["after"]):
+                    insert_after(history, previous_id, record)
+            else:
+                history.extend(added)
+    return {
+        "history": history,
+        "stats": migrate_stats(data["stats"], version),
+        "settings": data["settings"],
+        "created": data["created"],
+    }
+
+def main(argv=None):
+    """コマンドラインからのバックアップ作成・一覧表示・復元"""
+    from .data_storage import iter_history, load_stats, load_settings, load_ledger
+    
+    parser = argparse.ArgumentParser(description="麻雀スコアのデータをバックアップ・復元します")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create", help="保存済みデータのバックアップを作成")
+    subparsers.add_parser("list", help="バックアップの一覧を表示")
+    restore = subparsers.add_parser("restore", help="バックアップをエクスポート形式のJSONに復元")
+    restore.add_argument("--point", help="復元するバックアップのファイル名（省略時は最新）")
+    restore.add_argument("--output", "-o", help="出力ファイル（省略時は data/mahjong_restore_日時.json）")
+    args = parser.parse_args(argv)
+    
+    if args.command == "create":
+        settings = load_settings()
+        ledger = load_ledger()
+        if ledger:
+            # 集計台帳は以前のバージョンと同じく設定の項目として含める
+            settings["stats_ledger"] = ledger
+        path = create_backup(iter_history(), load_stats(), settings)
+        print(path)
+    elif args.command == "list":
+        for entry in load_index()["entries"]:
+            print(f"{entry['created']}  {entry['kind']:5}  {entry['file']}")
+    else:
+        data = restore_backup(args.point)
+        output = args.output or DATA_DIR / f"mahjong_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(output, "w", encoding="utf-8") as f:
+            f.writelines(iter_backup_json(data["stats"], data["settings"], data["history"]))
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 """
 データ初期化モジュール - アプリケーション状態の管理
 """
+import os
 import streamlit as st
-from .data_storage import auto_load, auto_save
+from .data_storage import auto_load, auto_save, refresh_shared_data
+from .score_utils import stats_ledger, restore_session_stats, verify_stats, repair_stats
+
+# 起動時の統計と対戦履歴の照合（off: しない、check: 不一致を通知、repair: 不一致なら集計し直す）
+STATS_CHECK = os.environ.get("MAHJONG_STATS_CHECK", "off")
 
 def init_players():
     """プレイヤー情報の初期化"""
@@ -109,6 +114,10 @@ def init_app_state():
     if "data_loaded" not in st.session_state:
         auto_load()
         st.session_state.data_loaded = True
+        init_stats()
+    else:
+        # 他のプロセスが保存したデータがあれば反映
+        refresh_shared_data()
     
     init_ui_state()
     init_players()
@@ -116,6 +125,29 @@ def init_app_state():
     init_uma_settings()
     init_widget_defaults()
 
+def init_stats():
+    """集計台帳の準備、今回の戦績の復元と、設定に応じた起動時の統計の照合"""
+    stats_ledger()
+    restore_session_stats()
+    if STATS_CHECK not in ("check", "repair"):
+        return
+    
+    try:
+        check = verify_stats()
+    except ValueError as e:
+        st.warning(f"⚠️ 統計を対戦履歴と照合できませんでした: {e}")
+        return
+    count = len(check["stats"]) + len(check["current_session_stats"])
+    if not count:
+        return
+    
+    if STATS_CHECK == "repair":
+        success, message = repair_stats()
+        if success:
+            st.info(f"統計が対戦履歴からの集計と{count}項目一致しなかったため、集計し直しました")
+            return
+    st.warning(f"⚠️ 統計が対戦履歴からの集計と{count}項目一致しません。ゲーム設定の「統計データ管理」から集計し直せます")
+
 def save_current_state():
     """現在の状態を保存"""
     auto_save()
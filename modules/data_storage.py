@@ -4,14 +4,496 @@
 import streamlit as st
 import json
 import os
-from datetime import datetime
+import hashlib
+import gzip
+import lzma
+import atexit
+import copy
+import itertools
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
+try:
+    import fcntl
+except ImportError:
+    # fcntlのない環境（Windows）ではプロセス間ロックなし
+    fcntl = None
+from .aggregation import apply_game, merge_stats, reconcile_stats
+from .derived_stats import new_ledger, adopt_ledger, merge_ledger, session_stats_from_history
+from .records import (
+    merge_history, reconcile_history, insert_after,
+    pack_history, unpack_history, is_packed_history, group_by_shard, shard_order,
+)
+from . import sqlite_storage
+from .lazy_history import LazyHistory
+from .schema import SCHEMA_VERSION, schema_version, migrate, migrate_history, migrate_stats
+from .export import iter_json_with_history
+from .write_behind import WriteBehindWriter
+from .shared_store import get_shared_store
 
 # データ保存用ディレクトリ
 DATA_DIR = Path("./data")
 STATS_FILE = DATA_DIR / "mahjong_stats.json"
 HISTORY_FILE = DATA_DIR / "mahjong_history.json"
 SETTINGS_FILE = DATA_DIR / "app_settings.json"
+LEDGER_FILE = DATA_DIR / "stats_ledger.json"
+HISTORY_JOURNAL_FILE = DATA_DIR / "mahjong_history.jsonl"
+SNAPSHOT_FILE = DATA_DIR / "mahjong_snapshot.json"
+SQLITE_FILE = DATA_DIR / "mahjong.db"
+HISTORY_SHARD_DIR = DATA_DIR / "history"
+HISTORY_MANIFEST_FILE = HISTORY_SHARD_DIR / "manifest.json"
+LOCK_FILE = DATA_DIR / ".lock"
+
+# ストレージバックエンド
+# "json": JSONファイルに保存（デフォルト）
+# "sqlite": SQLiteデータベースに保存
+STORAGE_BACKEND = os.environ.get("MAHJONG_STORAGE_BACKEND", "json")
+
+# 対戦履歴の保存方式
+# "file": 履歴全体を毎回書き直す（デフォルト）
+# "journal": 1ゲームごとに1行を追記するジャーナル方式
+# "sharded": 記録月ごとのファイル（data/history/YYYY-MM.json）に分けて保存
+HISTORY_STORAGE = os.environ.get("MAHJONG_HISTORY_STORAGE", "file")
+
+# ジャーナルを履歴ファイルへ統合するまでの記録件数
+COMPACTION_INTERVAL = int(os.environ.get("MAHJONG_COMPACTION_INTERVAL", "100"))
+
+# 書き込み遅延（バックグラウンドスレッドでまとめて保存）
+WRITE_BEHIND = os.environ.get("MAHJONG_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_DELAY = float(os.environ.get("MAHJONG_WRITE_BEHIND_DELAY", "0.5"))
+
+# fsync（ディスクへの同期）のタイミング
+# "always": 書き込みのたびに同期（デフォルト）
+# "batch": FSYNC_BATCH_SIZE回の書き込みごとにまとめて同期
+# "idle": 書き込みが途切れた時にまとめて同期
+FSYNC_POLICY = os.environ.get("MAHJONG_FSYNC_POLICY", "always")
+FSYNC_BATCH_SIZE = int(os.environ.get("MAHJONG_FSYNC_BATCH_SIZE", "10"))
+
+# 保存ファイルの形式（読み込み時は形式・圧縮方式を自動判別する）
+# "json": インデント付きのJSON（デフォルト）
+# "compact": インデントなしのJSON、対戦履歴は列指向（キー一覧＋ゲームごとの配列）
+FILE_FORMAT = os.environ.get("MAHJONG_FILE_FORMAT", "json")
+
+# 保存ファイルの圧縮方式: "none"（デフォルト） / "gzip" / "lzma"
+COMPRESSION = os.environ.get("MAHJONG_COMPRESSION", "none")
+
+# 圧縮形式の判別用の先頭バイト
+GZIP_MAGIC = b"\x1f\x8b"
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+
+# ファイルの読み込み・展開に失敗した時の例外
+DECODE_ERRORS = (OSError, ValueError, EOFError, lzma.LZMAError)
+
+# 読み込み済みのデータを全セッションで共有する（セッションごとの再読み込みを避ける）
+SHARED_STORE = os.environ.get("MAHJONG_SHARED_STORE", "1") == "1"
+
+# 自動バックアップの間隔（時間）。0（デフォルト）で自動バックアップしない
+AUTO_BACKUP_HOURS = float(os.environ.get("MAHJONG_AUTO_BACKUP_HOURS", "0"))
+
+_writer = None
+_shared_store = None
+_sync_lock = threading.Lock()
+_unsynced_paths = set()
+_writes_since_sync = 0
+_process_lock = threading.RLock()
+_lock_depth = 0
+_read_versions = {}
+_stale_files = set()
+_last_backup = None
+# 統計の変更カウンタ（共有データの統計は全セッションで同じ辞書のため、プロセス全体で1つ）
+_stats_versions = itertools.count(1)
+_stats_version = 0
+
+def _get_writer():
+    """書き込み遅延用ライターの取得（初回に起動）"""
+    global _writer
+    if _writer is None:
+        _writer = WriteBehindWriter(delay=WRITE_BEHIND_DELAY, on_idle=_sync_on_idle)
+        atexit.register(_writer.flush)
+    return _writer
+
+@contextmanager
+def data_lock():
+    """データディレクトリの排他ロック（プロセス間はfcntlのアドバイザリロック）
+    
+    読み込み・統合・書き込みの一連の処理を他のプロセスと重ならないようにする。
+    同じスレッド内では入れ子で取得できる。
+    """
+    global _lock_depth
+    with _process_lock:
+        if _lock_depth > 0 or fcntl is None or not ensure_data_directory():
+            _lock_depth += 1
+            try:
+                yield
+            finally:
+                _lock_depth -= 1
+            return
+        
+        with open(LOCK_FILE, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            _lock_depth += 1
+            try:
+                yield
+            finally:
+                _lock_depth -= 1
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _submit(key, func, coalesce=True):
+    """書き込み処理の実行（書き込み遅延が有効ならキューに登録）
+    
+    coalesce=Trueの処理は、短時間に同じキーで複数回登録されると最後の1件のみ実行される。
+    """
+    def task():
+        result = func()
+        _note_shared_write()
+        return result
+    
+    if WRITE_BEHIND:
+        _get_writer().submit(key, task, coalesce)
+        return True
+    return task()
+
+def _shared_files():
+    """共有データの元になるファイルの一覧"""
+    if is_sqlite_backend():
+        return [SQLITE_FILE, SQLITE_FILE.with_name(SQLITE_FILE.name + "-wal")]
+    files = [STATS_FILE, LEDGER_FILE, HISTORY_FILE]
+    if is_journal_mode():
+        files += [HISTORY_JOURNAL_FILE, SNAPSHOT_FILE]
+    if is_sharded_mode():
+        # シャードの保存時は必ず一覧も書き直す
+        files = [STATS_FILE, LEDGER_FILE, HISTORY_MANIFEST_FILE]
+    return files
+
+def _file_signature(paths):
+    """ファイルの更新時刻とサイズの組（変更検出用）"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def _note_shared_write():
+    """自プロセスでの書き込み後、共有データを読み込み直さないようシグネチャを更新"""
+    if _shared_store is not None:
+        _shared_store.update_signature("data", _file_signature(_shared_files()))
+
+def flush_pending_writes(timeout=None):
+    """書き込み遅延中の保存をすべて完了させる（終了時・テスト用）"""
+    result = True
+    if _writer is not None:
+        result = _writer.flush(timeout)
+    sync_pending_writes()
+    return result
+
+def _backup_path(path):
+    """1世代前のファイルのパス"""
+    return path.with_name(path.name + ".bak")
+
+def _fsync_directory(directory):
+    """ディレクトリのエントリ（ファイル名の置き換え）をディスクへ同期"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def sync_pending_writes():
+    """未同期のファイルをまとめてディスクへ同期"""
+    global _writes_since_sync
+    with _sync_lock:
+        paths = list(_unsynced_paths)
+        _unsynced_paths.clear()
+        _writes_since_sync = 0
+    
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+        except OSError:
+            pass
+    for directory in {path.parent for path in paths}:
+        _fsync_directory(directory)
+
+def _sync_on_idle():
+    """書き込み遅延ライターのキューが空になった時の同期"""
+    if FSYNC_POLICY == "idle":
+        sync_pending_writes()
+
+def _after_write(path):
+    """fsyncポリシーに従った書き込み後の同期"""
+    global _writes_since_sync
+    if FSYNC_POLICY == "always":
+        _fsync_directory(path.parent)
+        return
+    
+    with _sync_lock:
+        _unsynced_paths.add(path)
+        _writes_since_sync += 1
+        due = FSYNC_POLICY == "batch" and _writes_since_sync >= FSYNC_BATCH_SIZE
+    if due:
+        sync_pending_writes()
+
+def _write_bytes_atomic(path, payload):
+    """一時ファイルに書き込んでから置き換える（途中で中断しても元のファイルは壊れない）
+    
+    置き換え前のファイルは「.bak」として1世代分残し、読み込み失敗時の復旧に使う。
+    """
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            if FSYNC_POLICY == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        if path.exists():
+            os.replace(path, _backup_path(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    
+    _after_write(path)
+    return True
+
+def _append_bytes(path, payload):
+    """ファイル末尾への追記"""
+    with open(path, 'ab') as f:
+        f.write(payload)
+        if FSYNC_POLICY == "always":
+            f.flush()
+            os.fsync(f.fileno())
+    
+    _after_write(path)
+    return True
+
+def _read_json(path, report=True):
+    """JSONファイルの読み込み（破損・欠損時は1世代前のファイルから復旧）
+    
+    どちらのファイルもない場合はNoneを返す。両方とも読めない場合は、
+    壊れたファイルを「.corrupt-日時」として退避してから例外を送出する。
+    report=Falseの場合は復旧をセッションに通知しない（バックグラウンド処理用）。
+    """
+    backup = _backup_path(path)
+    if not path.exists() and not backup.exists():
+        return None
+    
+    try:
+        data = _decode_file(path)
+        _record_version(path, data)
+        return data
+    except DECODE_ERRORS as error:
+        if not backup.exists():
+            _quarantine(path)
+            raise
+        
+        try:
+            data = _decode_file(backup)
+        except DECODE_ERRORS:
+            _quarantine(path)
+            raise error
+        
+        # 壊れたファイルを退避し、次回の保存で1世代前のファイルが上書きされないようにする
+        _quarantine(path)
+    
+    _record_version(path, data)
+    if report:
+        # 復旧したファイルを記録（auto_loadで通知）
+        st.session_state.setdefault("recovered_files", []).append(path.name)
+    return data
+
+def _read_json_quietly(path):
+    """JSONファイルの読み込み（バックグラウンドのスレッド用、1世代前のファイルも読めなければNone）
+    
+    _read_json と異なり、壊れたファイルの退避・復旧の通知・データバージョンの記録をしない。
+    """
+    for candidate in (path, _backup_path(path)):
+        try:
+            return _decode_file(candidate)
+        except DECODE_ERRORS:
+            continue
+    return None
+
+def _record_version(path, data):
+    """読み込んだファイルのデータバージョン（競合検出用）とスキーマの古さを記録"""
+    if isinstance(data, dict):
+        _read_versions[str(path)] = data.get("data_version", 0)
+        if schema_version(data) != SCHEMA_VERSION:
+            # 移行した内容で書き直すファイル
+            _stale_files.add(str(path))
+
+def _quarantine(path):
+    """読み込めないファイルを「.corrupt-日時」として退避"""
+    if path.exists():
+        os.replace(path, path.with_name(f"{path.name}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}"))
+
+def _decode_file(path):
+    """保存ファイルの読み込み（圧縮・列指向の履歴は先頭バイトと内容から判別して展開）"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if raw.startswith(GZIP_MAGIC):
+        raw = gzip.decompress(raw)
+    elif raw.startswith(LZMA_MAGIC):
+        raw = lzma.decompress(raw)
+    
+    data = json.loads(raw.decode('utf-8'))
+    if isinstance(data, dict) and is_packed_history(data.get("history")):
+        data["history"] = unpack_history(data["history"])
+    return data
+
+def _serialize_json(data, compact=False):
+    """保存ファイルのバイト列への変換（FILE_FORMAT・COMPRESSIONに従う）"""
+    if FILE_FORMAT == "compact":
+        compact = True
+        if "history" in data:
+            data = dict(data, history=pack_history(data["history"]))
+    
+    if compact:
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    elif isinstance(data.get("history"), list):
+        # 件数の多い対戦履歴は1ゲーム1行にし、インデント付きの遅い変換を避ける
+        text = "".join(iter_json_with_history(data))
+    else:
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+    payload = text.encode('utf-8')
+    
+    if COMPRESSION == "gzip":
+        return gzip.compress(payload, mtime=0)
+    if COMPRESSION == "lzma":
+        return lzma.compress(payload)
+    return payload
+
+def _versioned_write_task(sync, path, data, compact=False, merge=None, on_saved=None):
+    """データバージョン付きでJSONファイルを保存する処理
+    
+    ロック中にファイルのバージョンを確認し、前回の保存・読み込み以降に他のプロセスが
+    保存していた場合は merge(ファイルの内容) で統合した内容を保存する（mergeなしは上書き）。
+    保存した内容は on_saved(内容) に渡す。data は呼び出し後に変更しないこと。
+    """
+    key = str(path)
+    
+    def task():
+        with data_lock():
+            version = sync["versions"].get(key, 0)
+            content = data
+            if _file_signature([path]) != sync["signatures"].get(key):
+                # 最後に読み書きした後にファイルが変わっている場合のみ読み込んで確認
+                current = _read_json(path, report=False) or {}
+                current_version = current.get("data_version", 0)
+                if merge is not None and current_version != version:
+                    content = merge(current)
+                version = current_version
+            
+            content = dict(content, data_version=version + 1)
+            _write_bytes_atomic(path, _serialize_json(content, compact))
+            _stale_files.discard(key)
+            sync["versions"][key] = version + 1
+            sync["signatures"][key] = _file_signature([path])
+        
+        if on_saved is not None:
+            on_saved(content)
+        return True
+    return task
+
+def _write_json(path, data, compact=False, merge=None, on_saved=None):
+    """JSONファイルの保存（データバージョン付き、競合時は merge で統合）"""
+    task = _versioned_write_task(_sync_state(), path, data, compact, merge, on_saved)
+    return _submit(str(path), task)
+
+def _new_sync_state(history, stats, ledger=None):
+    """保存時の競合検出用の状態（読み込み時点の各ファイルのバージョン・ゲームID・統計・集計台帳）"""
+    versions = dict(_read_versions)
+    signatures = {key: _file_signature([Path(key)]) for key in versions}
+    shard_ids = {}
+    history_ids = []
+    if isinstance(history, LazyHistory):
+        # 遅延読み込みの履歴は読み込んだシャードのゲームIDのみ記録する
+        shard_ids = {
+            month: [record["id"] for record in records]
+            for month, records in history.loaded_shards().items()
+        }
+        
+        def on_load(month, records):
+            # 後から読み込んだシャードも、読み込んだ時点のバージョンを競合検出に使う
+            shard_ids.setdefault(month, [record["id"] for record in records])
+            key = str(_shard_path(month))
+            if key in _read_versions and key not in versions:
+                versions[key] = _read_versions[key]
+                signatures[key] = _file_signature([Path(key)])
+        
+        history.on_load = on_load
+    else:
+        history_ids = [record["id"] for record in history]
+        if is_sharded_mode() and HISTORY_MANIFEST_FILE.exists():
+            shard_ids = {
+                month: [record["id"] for record in records]
+                for month, records in group_by_shard(history).items()
+            }
+    return {
+        "versions": versions,
+        "signatures": signatures,
+        "history_ids": history_ids,
+        # シャードごとの保存済みゲームID（未作成のシャードは次回の保存で書き込む）
+        "shard_ids": shard_ids,
+        "stats": copy.deepcopy(stats),
+        "ledger": copy.deepcopy(ledger),
+        # 統合結果のうちセッションへ未反映のもの（種類, 保存しようとした内容, 統合後の内容）
+        "pending": [],
+    }
+
+def _sync_state():
+    """保存時の競合検出用の状態（共有データストア使用時は全セッション共通）"""
+    if "sync_state" not in st.session_state:
+        st.session_state.sync_state = _new_sync_state(
+            st.session_state.get("history", []), st.session_state.get("stats", {}),
+            st.session_state.get("stats_ledger"),
+        )
+    return st.session_state.sync_state
+
+def _apply_merged_changes():
+    """他のプロセスの保存内容と統合した結果をセッションの履歴・統計へ反映"""
+    sync = st.session_state.get("sync_state")
+    if not sync:
+        return
+    recount = False
+    while sync["pending"]:
+        domain, snapshot, merged = sync["pending"].pop(0)
+        if domain == "history":
+            history = st.session_state.setdefault("history", [])
+            if isinstance(history, LazyHistory):
+                history.reconcile(snapshot, merged)
+            else:
+                reconcile_history(history, snapshot, merged)
+            recount = True
+        elif domain == "ledger":
+            ledger = st.session_state.get("stats_ledger")
+            if ledger is not None:
+                # 統合後にこのセッションで変更した内容は保つ（共有している台帳の辞書はそのまま使う）
+                reconciled = merge_ledger(merged, ledger, snapshot)
+                ledger.clear()
+                ledger.update(reconciled)
+            recount = True
+        else:
+            reconcile_stats(st.session_state.setdefault("stats", {}), snapshot, merged)
+            mark_stats_changed()
+    
+    if recount and st.session_state.get("stats_ledger") is not None:
+        # 他のプロセスが記録・清算したゲームを含めて、今回の戦績を未清算のゲームから集計し直す
+        session_stats = st.session_state.setdefault("current_session_stats", {})
+        session_stats.clear()
+        session_stats.update(session_stats_from_history(st.session_state.get("history", []), st.session_state.stats_ledger))
+        mark_stats_changed()
 
 def ensure_data_directory():
     """データディレクトリの存在確認と作成"""
@@ -22,181 +504,1076 @@ def ensure_data_directory():
         # クラウド環境で書き込み権限がない場合はスキップ
         return False
 
+def is_sqlite_backend():
+    """SQLiteバックエンドを使用しているか"""
+    return STORAGE_BACKEND == "sqlite"
+
 def save_stats():
     """統計データの保存"""
     if not ensure_data_directory():
         # ディレクトリ作成に失敗した場合はスキップ
         return False
     
+    _share_stats()
+    sync = _sync_state()
+    stats = copy.deepcopy(st.session_state.get("stats", {}))
+    
+    if is_sqlite_backend():
+        def task():
+            # 他のプロセスが保存していた場合はトランザクション内で統合される
+            saved = sqlite_storage.save_stats(SQLITE_FILE, stats, sync["stats"])
+            if saved is not stats:
+                sync["pending"].append(("stats", stats, saved))
+            sync["stats"] = saved
+            return True
+        
+        try:
+            return _submit("sqlite:stats", task)
+        except Exception as e:
+            return False
+    
     data = {
-        "stats": st.session_state.get("stats", {}),
+        "stats": stats,
         "last_updated": datetime.now().isoformat(),
-        "version": "1.0"
+        "version": SCHEMA_VERSION
     }
     
+    def merge(current):
+        # 他のプロセスの保存内容に、このセッションでの増減を加える
+        merged = merge_stats(migrate_stats(current.get("stats", {}), schema_version(current)), stats, sync["stats"])
+        sync["pending"].append(("stats", stats, merged))
+        return dict(data, stats=merged)
+    
+    def saved(content):
+        sync["stats"] = content["stats"]
+    
     try:
-        with open(STATS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
+        return _write_json(STATS_FILE, data, merge=merge, on_saved=saved)
     except Exception as e:
         # クラウド環境ではファイル保存をスキップ
         return False
+
+def _share_stats():
+    """セッションで作成した統計を共有データとして登録（共有データの統計が空だった場合）"""
+    shared = _shared_store.peek("data") if _shared_store is not None else None
+    stats = st.session_state.get("stats")
+    if shared is not None and stats and shared["stats"] is not stats:
+        shared["stats"] = stats
+
+def save_ledger():
+    """集計台帳の保存（他のプロセスが保存していた場合は未清算のゲームIDなどをゲームIDごとに統合）"""
+    if not ensure_data_directory():
+        return False
+    
+    sync = _sync_state()
+    ledger = copy.deepcopy(st.session_state.get("stats_ledger") or new_ledger())
+    
+    if is_sqlite_backend():
+        def task():
+            # 他のプロセスが保存していた場合はトランザクション内で統合される
+            saved = sqlite_storage.save_ledger(SQLITE_FILE, ledger, sync["ledger"])
+            if saved is not ledger:
+                sync["pending"].append(("ledger", ledger, saved))
+            sync["ledger"] = saved
+            return True
+        
+        try:
+            return _submit("sqlite:ledger", task)
+        except Exception as e:
+            return False
+    
+    data = {
+        "ledger": ledger,
+        "last_updated": datetime.now().isoformat(),
+        "version": SCHEMA_VERSION
+    }
+    
+    def merge(current):
+        # 他のプロセスの保存内容に、このセッションでの変更を加える
+        merged = merge_ledger(current.get("ledger") or new_ledger(), ledger, sync["ledger"])
+        sync["pending"].append(("ledger", ledger, merged))
+        return dict(data, ledger=merged)
+    
+    def saved(content):
+        sync["ledger"] = content["ledger"]
+    
+    try:
+        return _write_json(LEDGER_FILE, data, merge=merge, on_saved=saved)
+    except Exception as e:
         return False
 
+def load_ledger():
+    """集計台帳の読み込み（保存されていなければNone）"""
+    try:
+        if is_sqlite_backend():
+            return sqlite_storage.load_ledger(SQLITE_FILE)
+        return (_read_json(LEDGER_FILE) or {}).get("ledger")
+    except Exception as e:
+        st.error(f"集計台帳の読み込みに失敗しました: {e}")
+        return None
+
 def load_stats():
     """統計データの読み込み"""
-    if not STATS_FILE.exists():
-        return {}
+    if is_sqlite_backend():
+        try:
+            return sqlite_storage.load_stats(SQLITE_FILE)
+        except Exception as e:
+            st.error(f"統計データの読み込みに失敗しました: {e}")
+            return {}
     
     try:
-        with open(STATS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data.get("stats", {})
+        data = _read_json(STATS_FILE) or {}
+        return migrate_stats(data.get("stats", {}), schema_version(data))
     except Exception as e:
         st.error(f"統計データの読み込みに失敗しました: {e}")
         return {}
 
+def is_journal_mode():
+    """ジャーナル方式で対戦履歴を保存しているか"""
+    return not is_sqlite_backend() and HISTORY_STORAGE == "journal"
+
+def is_sharded_mode():
+    """記録月ごとのファイルに対戦履歴を分けて保存しているか"""
+    return not is_sqlite_backend() and HISTORY_STORAGE == "sharded"
+
+def _journal_state():
+    """ジャーナルの世代番号・長さ（バイト）・件数（共有データストア使用時は全セッション共通）"""
+    if "journal_state" not in st.session_state:
+        st.session_state.journal_state = {"generation": 0, "offset": 0, "entries": 0}
+    return st.session_state.journal_state
+
+def _append_journal(*entries):
+    """ジャーナルファイルへ追記（1操作1行、複数の操作は1回の書き込みにまとめる）"""
+    if not ensure_data_directory():
+        return False
+    
+    journal = _journal_state()
+    body = b"".join(
+        (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8')
+        for entry in entries
+    )
+    payload = body
+    if journal["offset"] == 0:
+        # 新規作成時は世代番号のヘッダーを先頭に書く
+        header = {"op": "header", "generation": journal["generation"], "version": SCHEMA_VERSION}
+        payload = (json.dumps(header, separators=(",", ":")) + "\n").encode('utf-8') + body
+    
+    def task():
+        with data_lock():
+            if payload is not body and HISTORY_JOURNAL_FILE.exists() and HISTORY_JOURNAL_FILE.stat().st_size > 0:
+                # 他のプロセスが先にジャーナルを作成していた場合はヘッダーを書かない
+                return _append_bytes(HISTORY_JOURNAL_FILE, body)
+            return _append_bytes(HISTORY_JOURNAL_FILE, payload)
+    
+    try:
+        _submit(str(HISTORY_JOURNAL_FILE), task, coalesce=False)
+        # 書き込み遅延中でも位置がずれないよう、ジャーナルの長さは手元で管理する
+        journal["offset"] += len(payload)
+        journal["entries"] += len(entries)
+        return True
+    except Exception as e:
+        return False
+
+def append_history_entry(game_record):
+    """記録したゲームをジャーナルへ追記"""
+    return _append_journal({"op": "add", "game": game_record})
+
+def append_history_entries(game_records):
+    """記録したゲームをまとめてジャーナルへ追記"""
+    return _append_journal(*({"op": "add", "game": game_record} for game_record in game_records))
+
+def append_history_tombstone(game_record=None):
+    """ゲームの取り消しをジャーナルへ追記（他のプロセスの記録を消さないようゲームIDを記録）"""
+    entry = {"op": "undo"}
+    if game_record is not None:
+        entry["id"] = game_record["id"]
+    return _append_journal(entry)
+
+def append_history_insertion(game_record, previous_id):
+    """取り消したゲームの復元をジャーナルへ追記（直前のゲームIDとともに記録）"""
+    return _append_journal({"op": "add", "game": game_record, "after": previous_id})
+
+def append_history_replacement(game_id, game_record):
+    """ゲーム記録の置き換え（修正）をジャーナルへ追記"""
+    return _append_journal({"op": "replace", "id": game_id, "game": game_record})
+
+def mark_history_changed():
+    """対戦履歴の変更を記録（次回のauto_saveで履歴を保存対象にする）"""
+    st.session_state.history_version = st.session_state.get("history_version", 0) + 1
+
+def mark_stats_changed():
+    """統計の変更を記録（統計から作る表・グラフを作り直す目安）"""
+    global _stats_version
+    _stats_version = next(_stats_versions)
+
+def stats_version():
+    """統計の変更カウンタ（読み込み直しで統計の辞書ごと置き換えた場合と区別するよう、辞書のIDと組にする）"""
+    return id(st.session_state.get("stats")), _stats_version
+
+def persist_game_added(game_record):
+    """記録したゲームの保存（追記型の保存方式のみ1件分を書き込む）"""
+    mark_history_changed()
+    if is_sqlite_backend():
+        try:
+            return _submit("sqlite:history", lambda: bool(sqlite_storage.append_game(SQLITE_FILE, game_record)), coalesce=False)
+        except Exception as e:
+            return False
+    if is_journal_mode():
+        return append_history_entry(game_record)
+    # 全体保存方式ではsave_historyで書き直す
+    return True
+
+def persist_games_added(game_records):
+    """まとめて追加したゲームの保存（取り込み用、追記型の保存方式でも書き込みは1回）"""
+    if not game_records:
+        return True
+    mark_history_changed()
+    if is_sqlite_backend():
+        try:
+            return _submit("sqlite:history", lambda: sqlite_storage.append_games(SQLITE_FILE, game_records), coalesce=False)
+        except Exception as e:
+            return False
+    if is_journal_mode():
+        return append_history_entries(game_records)
+    return True
+
+def persist_history_rewritten():
+    """全ゲームの内容を書き換えた対戦履歴の保存（ルール変更による再計算用）
+    
+    追記型の保存方式でも全件を書き直す。月別保存では全シャードを読み込んだ上で書き直す。
+    """
+    mark_history_changed()
+    history = st.session_state.get("history", [])
+    if is_sqlite_backend():
+        snapshot = list(history)
+        try:
+            return _submit("sqlite:history", lambda: sqlite_storage.save_history(SQLITE_FILE, snapshot), coalesce=False)
+        except Exception as e:
+            return False
+    if is_journal_mode():
+        return compact_history(rewritten=True)
+    if is_sharded_mode():
+        shards = history.loaded_shards() if isinstance(history, LazyHistory) else group_by_shard(history)
+        _stale_files.update(str(_shard_path(month)) for month in shards)
+    return True
+
+def persist_game_inserted(game_record, previous_id):
+    """途中に戻したゲーム（取り消しのやり直し）の保存（追記型の保存方式のみ1件分を書き込む）"""
+    mark_history_changed()
+    if is_sqlite_backend():
+        try:
+            return _submit("sqlite:history", lambda: bool(sqlite_storage.insert_game_after(SQLITE_FILE, game_record, previous_id)), coalesce=False)
+        except Exception as e:
+            return False
+    if is_journal_mode():
+        return append_history_insertion(game_record, previous_id)
+    return True
+
+def persist_game_replaced(game_id, game_record):
+    """修正したゲームの保存（追記型の保存方式のみ1件分を書き込む）
+    
+    修正したゲームには新しいゲームIDを付けるため、全体保存方式・月別保存では
+    ゲームIDの変化から保存対象になり、他のプロセスとの統合でも修正前の記録は残らない。
+    """
+    mark_history_changed()
+    if is_sqlite_backend():
+        try:
+            return _submit("sqlite:history", lambda: sqlite_storage.replace_game(SQLITE_FILE, game_id, game_record), coalesce=False)
+        except Exception as e:
+            return False
+    if is_journal_mode():
+        return append_history_replacement(game_id, game_record)
+    return True
+
+def persist_game_removed(game_record=None):
+    """取り消したゲームの保存（追記型の保存方式のみ）"""
+    mark_history_changed()
+    if is_sqlite_backend():
+        game_id = game_record["id"] if game_record is not None else None
+        try:
+            return _submit("sqlite:history", lambda: sqlite_storage.delete_game(SQLITE_FILE, game_id), coalesce=False)
+        except Exception as e:
+            return False
+    if is_journal_mode():
+        return append_history_tombstone(game_record)
+    return True
+
+def _iter_journal():
+    """ジャーナルの各行を（行末のバイト位置, 内容）の組で順に返す"""
+    if not HISTORY_JOURNAL_FILE.exists():
+        return
+    
+    offset = 0
+    with open(HISTORY_JOURNAL_FILE, 'rb') as f:
+        for raw in f:
+            offset += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                # 書き込み途中で中断された行はスキップ
+                continue
+            yield offset, entry
+
+def _replay_journal(history, absorbed_generation=-1, record=True):
+    """ジャーナルを再生して履歴に追記・取り消しを適用
+    
+    record=False の場合は古いスキーマのジャーナルを移行対象として記録しない（バックグラウンド処理用）。
+    戻り値は（世代番号, 操作件数, 操作一覧, 統合済みか）。操作一覧は
+    （行末のバイト位置, 操作, 追加または取り消されたゲーム, 適用後の履歴件数）の組
+    （置き換えは（置き換え前, 置き換え後）のゲームの組）。
+    """
+    generation = 0
+    version = SCHEMA_VERSION
+    operations = []
+    
+    for offset, entry in _iter_journal():
+        op = entry.get("op")
+        if op == "header":
+            generation = entry.get("generation", 0)
+            version = schema_version(entry)
+            if version != SCHEMA_VERSION and record:
+                _stale_files.add(str(HISTORY_JOURNAL_FILE))
+            continue
+        
+        # 履歴ファイルへ統合済みの世代は再生しない
+        if generation <= absorbed_generation:
+            break
+        
+        game = None
+        if op == "add":
+            game = migrate("game", entry["game"], version, len(history))
+            if "after" in entry:
+                insert_after(history, entry["after"], game)
+            else:
+                history.append(game)
+        elif op == "undo" and history:
+            index = _find_game(history, entry.get("id"))
+            if index is not None:
+                game = history.pop(index)
+        elif op == "replace" and history:
+            index = _find_game(history, entry["id"])
+            if index is not None:
+                replacement = migrate("game", entry["game"], version, index)
+                game = (history[index], replacement)
+                history[index] = replacement
+        operations.append((offset, op, game, len(history)))
+    
+    absorbed = HISTORY_JOURNAL_FILE.exists() and generation <= absorbed_generation
+    if generation <= absorbed_generation:
+        generation = absorbed_generation + 1
+        operations = []
+    return generation, len(operations), operations, absorbed
+
+def _find_game(history, game_id):
+    """ゲームIDに一致する記録の位置（ID指定なしは直近、見つからなければNone）"""
+    if game_id is None:
+        return len(history) - 1
+    for index in range(len(history) - 1, -1, -1):
+        if history[index]["id"] == game_id:
+            return index
+    return None
+
+def _load_history_file(report=True):
+    """履歴ファイル（ジャーナル適用前）の読み込み"""
+    data = _read_json(HISTORY_FILE, report) or {}
+    return migrate_history(data.get("history", []), schema_version(data)), data.get("journal_generation", -1)
+
 def save_history():
     """対戦履歴の保存"""
+    if is_sqlite_backend():
+        # SQLiteでは記録・取り消しの都度1件ずつ反映済み
+        return True
+    
+    if is_journal_mode():
+        # ジャーナル方式では記録・取り消しの都度追記済みのため、
+        # 一定件数たまった時だけ履歴ファイルへ統合する
+        if _journal_state()["entries"] >= COMPACTION_INTERVAL:
+            return compact_history()
+        return True
+    
     if not ensure_data_directory():
         return False
     
+    if is_sharded_mode():
+        return save_history_shards()
+    
+    sync = _sync_state()
+    history = list(st.session_state.get("history", []))
     data = {
-        "history": st.session_state.get("history", []),
+        "history": history,
         "last_updated": datetime.now().isoformat(),
-        "version": "1.0"
+        "version": SCHEMA_VERSION
     }
     
+    def merge(current):
+        # 他のプロセスが保存していた場合はゲームIDで統合
+        current_history = migrate_history(current.get("history", []), schema_version(current))
+        merged = merge_history(current_history, history, sync["history_ids"])
+        sync["pending"].append(("history", history, merged))
+        return dict(data, history=merged)
+    
+    def saved(content):
+        sync["history_ids"] = [record["id"] for record in content["history"]]
+    
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        return _write_json(HISTORY_FILE, data, merge=merge, on_saved=saved)
+    except Exception as e:
+        st.error(f"対戦履歴の保存に失敗しました: {e}")
+        return False
+
+def _shard_path(month):
+    """シャード（1か月分の対戦履歴）のファイルパス"""
+    return HISTORY_SHARD_DIR / f"{month}.json"
+
+def save_history_shards():
+    """変更のあったシャードとシャード一覧のみ保存（通常は今月分の1ファイルのみ）"""
+    sync = _sync_state()
+    history = st.session_state.get("history", [])
+    if isinstance(history, LazyHistory):
+        # 遅延読み込みの履歴では読み込んだシャード以外は変更されていない
+        shards = history.loaded_shards()
+    else:
+        shards = group_by_shard(history)
+    changed = {
+        month: list(records) for month, records in shards.items()
+        if [record["id"] for record in records] != sync["shard_ids"].get(month)
+        or str(_shard_path(month)) in _stale_files
+    }
+    for month in sync["shard_ids"]:
+        if month not in shards:
+            # 取り消しで空になったシャード
+            changed[month] = []
+    if not changed:
+        return True
+    
+    def shard_task(month, records):
+        data = {
+            "month": month,
+            "history": records,
+            "last_updated": datetime.now().isoformat(),
+            "version": SCHEMA_VERSION
+        }
+        
+        def merge(current):
+            # 他のプロセスが保存していた場合はゲームIDで統合
+            current_history = migrate_history(current.get("history", []), schema_version(current))
+            merged = merge_history(current_history, records, sync["shard_ids"].get(month, []))
+            sync["pending"].append(("history", records, merged))
+            return dict(data, history=merged)
+        
+        def saved(content):
+            sync["shard_ids"][month] = [record["id"] for record in content["history"]]
+        
+        return _versioned_write_task(sync, _shard_path(month), data, merge=merge, on_saved=saved)
+    
+    tasks = [shard_task(month, records) for month, records in changed.items()]
+    
+    def task():
+        with data_lock():
+            HISTORY_SHARD_DIR.mkdir(exist_ok=True)
+            for shard in tasks:
+                shard()
+            
+            # 読み込んでいないシャード・他のプロセスが保存したシャードの件数は残し、
+            # 保存したシャードの件数のみ更新
+            counts = dict((_read_json(HISTORY_MANIFEST_FILE, report=False) or {}).get("shards", {}))
+            for month in changed:
+                counts[month] = len(sync["shard_ids"].get(month, []))
+            manifest = {
+                "shards": {month: count for month, count in counts.items() if count},
+                "last_updated": datetime.now().isoformat(),
+                "version": SCHEMA_VERSION
+            }
+            _versioned_write_task(sync, HISTORY_MANIFEST_FILE, manifest)()
         return True
+    
+    try:
+        return _submit("history:shards", task)
     except Exception as e:
+        st.error(f"対戦履歴の保存に失敗しました: {e}")
         return False
 
+def load_history_manifest():
+    """シャード一覧（記録月→件数）の読み込み"""
+    data = _read_json(HISTORY_MANIFEST_FILE) or {}
+    return data.get("shards", {})
+
+def load_history_shard(month):
+    """1か月分の対戦履歴の読み込み"""
+    data = _read_json(_shard_path(month)) or {}
+    return migrate_history(data.get("history", []), schema_version(data))
+
+def _load_sharded_history():
+    """シャードに分けた対戦履歴の読み込み（シャード未作成なら従来の履歴ファイルから）
+    
+    シャードは全件を読み込まず、必要になった時に読み込む LazyHistory を返す。
+    """
+    if not HISTORY_MANIFEST_FILE.exists():
+        return _load_history_file()[0]
+    return LazyHistory(load_history_manifest(), load_history_shard)
+
 def load_history():
     """対戦履歴の読み込み"""
-    if not HISTORY_FILE.exists():
-        return []
-    
     try:
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data.get("history", [])
+        if is_sqlite_backend():
+            return sqlite_storage.load_history(SQLITE_FILE)
+        
+        if is_sharded_mode():
+            return _load_sharded_history()
+        
+        history, absorbed_generation = _load_history_file()
+        
+        # ジャーナル方式では既存の履歴ファイルを土台にジャーナルを再生
+        if is_journal_mode():
+            _replay_journal(history, absorbed_generation)
+        return history
     except Exception as e:
         st.error(f"対戦履歴の読み込みに失敗しました: {e}")
         return []
 
+def iter_history():
+    """保存済みの対戦履歴を記録順に1ゲームずつ返す（エクスポート用）
+    
+    SQLite・シャード分割の保存方式では全件をメモリに載せずに読み込む。
+    """
+    if is_sqlite_backend():
+        return sqlite_storage.iter_history(SQLITE_FILE)
+    return iter(load_history())
+
+def _iter_saved_history():
+    """保存済みの対戦履歴を記録順に1ゲームずつ返す（バックグラウンドのスレッド用）
+    
+    iter_history と異なり、セッション・読み込み時の記録（データバージョン・移行対象のファイル）を
+    変更せず、読み込めないファイルの通知もしない。
+    """
+    if is_sqlite_backend():
+        yield from sqlite_storage.iter_history(SQLITE_FILE)
+        return
+    
+    if is_sharded_mode() and HISTORY_MANIFEST_FILE.exists():
+        counts = (_read_json_quietly(HISTORY_MANIFEST_FILE) or {}).get("shards", {})
+        for month in sorted(counts, key=shard_order):
+            data = _read_json_quietly(_shard_path(month)) or {}
+            yield from migrate_history(data.get("history", []), schema_version(data))
+        return
+    
+    data = _read_json_quietly(HISTORY_FILE) or {}
+    history = migrate_history(data.get("history", []), schema_version(data))
+    if is_journal_mode():
+        _replay_journal(history, data.get("journal_generation", -1), record=False)
+    yield from history
+
+def compact_history(rewritten=False):
+    """ジャーナルを履歴ファイルへ統合し、新しい世代のジャーナルを開始
+    
+    他のプロセスの追記も失わないよう、ロック中にファイル上の履歴とジャーナルから統合する。
+    rewritten=True の場合は、セッションの履歴にあるゲームをセッションの内容（再計算後など）で置き換える。
+    """
+    if not ensure_data_directory():
+        return False
+    
+    journal = _journal_state()
+    sync = _sync_state()
+    snapshot = list(st.session_state.get("history", []))
+    
+    def task():
+        with data_lock():
+            history, absorbed_generation = _load_history_file(report=False)
+            generation = _replay_journal(history, absorbed_generation)[0]
+            if rewritten:
+                records = {record["id"]: record for record in snapshot}
+                history = [records.get(record["id"], record) for record in history]
+            data = {
+                "history": history,
+                "journal_generation": generation,
+                "last_updated": datetime.now().isoformat(),
+                "version": SCHEMA_VERSION
+            }
+            
+            # 履歴ファイルに統合済みの世代番号を記録してから、ジャーナルを差し替える
+            _versioned_write_task(sync, HISTORY_FILE, data)()
+            header = {"op": "header", "generation": generation + 1, "version": SCHEMA_VERSION}
+            payload = (json.dumps(header, separators=(",", ":")) + "\n").encode('utf-8')
+            _write_bytes_atomic(HISTORY_JOURNAL_FILE, payload)
+            _stale_files.discard(str(HISTORY_JOURNAL_FILE))
+        
+        sync["history_ids"] = [record["id"] for record in history]
+        sync["pending"].append(("history", snapshot, history))
+        return True
+    
+    try:
+        _submit(str(HISTORY_JOURNAL_FILE), task, coalesce=False)
+        
+        # 書き込み遅延中も続けて追記できるよう、ジャーナルの状態は手元で先に更新する
+        header = {"op": "header", "generation": journal["generation"] + 1, "version": SCHEMA_VERSION}
+        offset = len((json.dumps(header, separators=(",", ":")) + "\n").encode('utf-8'))
+        journal.update(generation=journal["generation"] + 1, offset=offset, entries=0)
+        return True
+    except Exception as e:
+        return False
+
+def save_snapshot():
+    """集計済み統計のスナップショット保存（ジャーナルの位置とともに記録）"""
+    if not ensure_data_directory():
+        return False
+    
+    data = {
+        "stats": copy.deepcopy(st.session_state.get("stats", {})),
+        "current_session_stats": copy.deepcopy(st.session_state.get("current_session_stats", {})),
+        "history_offset": len(st.session_state.get("history", [])),
+        "journal_generation": _journal_state()["generation"],
+        "journal_offset": _journal_state()["offset"],
+        "last_updated": datetime.now().isoformat(),
+        "version": SCHEMA_VERSION
+    }
+    
+    try:
+        return _write_json(SNAPSHOT_FILE, data, compact=True)
+    except Exception as e:
+        return False
+
+def load_snapshot():
+    """スナップショットの読み込み"""
+    try:
+        data = _read_json(SNAPSHOT_FILE) or {}
+    except Exception as e:
+        return {}
+    for key in ("stats", "current_session_stats"):
+        if key in data:
+            data[key] = migrate_stats(data[key], schema_version(data))
+    return data
+
+def load_journal_state():
+    """ジャーナル方式の状態復元（スナップショット＋ジャーナル末尾の再生）
+    
+    戻り値は（履歴, 統計, 今回の戦績, ジャーナルの状態）。スナップショットが
+    現在のジャーナルと整合しない場合は統計ファイルを使い、今回の戦績は空とする。
+    """
+    history, absorbed_generation = _load_history_file()
+    base_length = len(history)
+    generation, entries, operations, absorbed = _replay_journal(history, absorbed_generation)
+    journal = {
+        "generation": generation,
+        "offset": HISTORY_JOURNAL_FILE.stat().st_size if HISTORY_JOURNAL_FILE.exists() else 0,
+        "entries": entries,
+    }
+    
+    if absorbed:
+        # 統合後のジャーナル差し替え前に中断していた場合は新しい世代で作り直す
+        header = {"op": "header", "generation": generation, "version": SCHEMA_VERSION}
+        payload = (json.dumps(header, separators=(",", ":")) + "\n").encode('utf-8')
+        _write_bytes_atomic(HISTORY_JOURNAL_FILE, payload)
+        journal["offset"] = len(payload)
+    
+    snapshot = load_snapshot()
+    if snapshot.get("journal_generation") == generation:
+        offset = snapshot.get("journal_offset", 0)
+        
+        # スナップショット時点の履歴件数と一致する場合のみ採用
+        history_offset = base_length
+        for end, _, _, length in operations:
+            if end > offset:
+                break
+            history_offset = length
+        
+        if history_offset == snapshot.get("history_offset"):
+            stats = snapshot.get("stats", {})
+            session_stats = snapshot.get("current_session_stats", {})
+            
+            # スナップショット以降の操作のみ集計に反映
+            added = set()
+            for end, op, game, _ in operations:
+                if end <= offset or game is None:
+                    continue
+                if op == "add":
+                    apply_game(session_stats, game)
+                    added.add(game["id"])
+                elif op == "undo" and game["id"] in added:
+                    # スナップショット以降に記録したゲームは今回の戦績のみに含まれる
+                    apply_game(session_stats, game, -1)
+                elif op == "undo":
+                    apply_game(stats, game, -1)
+                    apply_game(session_stats, game, -1)
+                elif op == "replace":
+                    before, after = game
+                    targets = (session_stats,) if before["id"] in added else (stats, session_stats)
+                    for target in targets:
+                        apply_game(target, before, -1)
+                        apply_game(target, after)
+                    if before["id"] in added:
+                        added.add(after["id"])
+            return history, stats, session_stats, journal
+    
+    return history, load_stats(), {}, journal
+
+def write_data_file(path, data, compact=False):
+    """保存ファイルの書き込み（保存形式・圧縮方式・fsyncの設定に従い、1世代前は「.bak」に残す）"""
+    return _write_bytes_atomic(path, _serialize_json(data, compact))
+
+def read_data_file(path):
+    """保存ファイルの読み込み（形式・圧縮方式は自動判別、復旧・データバージョンの記録はしない）"""
+    return _decode_file(path)
+
+def _collect_settings():
+    """保存対象のアプリ設定を収集"""
+    return {
+        "rate": st.session_state.get("rate", 1.0),
+        "game_type": st.session_state.get("game_type", "四麻"),
+        "available_players": st.session_state.get("available_players", []),
+        "selected_players": st.session_state.get("selected_players", []),
+        "players": st.session_state.get("players", []),
+        # ウマ設定
+        "uma_1st": st.session_state.get("uma_1st", 10),
+        "uma_2nd": st.session_state.get("uma_2nd", 5),
+        "uma_3rd": st.session_state.get("uma_3rd", -5),
+        "uma_4th": st.session_state.get("uma_4th", -10),
+        "uma_1st_sanma": st.session_state.get("uma_1st_sanma", 15),
+        "uma_2nd_sanma": st.session_state.get("uma_2nd_sanma", -5),
+        "uma_3rd_sanma": st.session_state.get("uma_3rd_sanma", -10),
+    }
+
+def _backup_settings():
+    """バックアップに含めるアプリ設定（集計台帳も設定の項目として含める）"""
+    return dict(
+        copy.deepcopy(_collect_settings()),
+        stats_ledger=copy.deepcopy(st.session_state.get("stats_ledger")),
+    )
+
 def save_settings():
     """アプリ設定の保存"""
     if not ensure_data_directory():
         return False
     
+    if is_sqlite_backend():
+        settings = copy.deepcopy(_collect_settings())
+        try:
+            return _submit("sqlite:settings", lambda: sqlite_storage.save_settings(SQLITE_FILE, settings))
+        except Exception as e:
+            return False
+    
     data = {
-        "settings": {
-            "rate": st.session_state.get("rate", 1.0),
-            "game_type": st.session_state.get("game_type", "四麻"),
-            "available_players": st.session_state.get("available_players", []),
-            "selected_players": st.session_state.get("selected_players", []),
-            "players": st.session_state.get("players", []),
-            # ウマ設定
-            "uma_1st": st.session_state.get("uma_1st", 10),
-            "uma_2nd": st.session_state.get("uma_2nd", 5),
-            "uma_3rd": st.session_state.get("uma_3rd", -5),
-            "uma_4th": st.session_state.get("uma_4th", -10),
-            "uma_1st_sanma": st.session_state.get("uma_1st_sanma", 15),
-            "uma_2nd_sanma": st.session_state.get("uma_2nd_sanma", -5),
-            "uma_3rd_sanma": st.session_state.get("uma_3rd_sanma", -10),
-        },
+        "settings": copy.deepcopy(_collect_settings()),
         "last_updated": datetime.now().isoformat(),
-        "version": "1.0"
+        "version": SCHEMA_VERSION
     }
     
     try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
+        return _write_json(SETTINGS_FILE, data)
     except Exception as e:
         return False
 
 def load_settings():
     """アプリ設定の読み込み"""
-    if not SETTINGS_FILE.exists():
-        return {}
+    if is_sqlite_backend():
+        try:
+            return sqlite_storage.load_settings(SQLITE_FILE)
+        except Exception as e:
+            st.error(f"設定の読み込みに失敗しました: {e}")
+            return {}
     
     try:
-        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = _read_json(SETTINGS_FILE) or {}
         return data.get("settings", {})
     except Exception as e:
         st.error(f"設定の読み込みに失敗しました: {e}")
         return {}
 
+def _content_hash(data):
+    """保存内容のハッシュ値"""
+    serialized = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+def _fingerprint(domain):
+    """データ領域ごとの変更検出用の値
+    
+    履歴は件数に比例してハッシュ計算が重くなるため変更カウンタを使い、
+    統計・集計台帳・設定は小さいため内容のハッシュ値で比較する。
+    """
+    if domain == "history":
+        return st.session_state.get("history_version", 0)
+    if domain == "stats":
+        return _content_hash(st.session_state.get("stats", {}))
+    if domain == "ledger":
+        return _content_hash(st.session_state.get("stats_ledger") or {})
+    if domain == "settings":
+        return _content_hash(_collect_settings())
+    if domain == "snapshot":
+        return (
+            _fingerprint("stats"),
+            _fingerprint("history"),
+            _content_hash(st.session_state.get("current_session_stats", {})),
+        )
+    raise ValueError(f"不明なデータ領域です: {domain}")
+
+def _saved_domains():
+    """保存対象のデータ領域と保存関数の一覧"""
+    # 統計・集計台帳は対戦履歴を集計した値のため、対戦履歴を先に保存する
+    domains = [("history", save_history), ("stats", save_stats), ("ledger", save_ledger), ("settings", save_settings)]
+    if is_journal_mode():
+        domains.append(("snapshot", save_snapshot))
+    return domains
+
+def mark_all_saved():
+    """現在の内容を保存済みとして記録"""
+    st.session_state.saved_fingerprints = {
+        domain: _fingerprint(domain) for domain, _ in _saved_domains()
+    }
+
 def auto_save():
-    """自動保存（統計、履歴、設定をまとめて保存）"""
+    """自動保存（統計、履歴、集計台帳、設定のうち変更のあったものだけを保存）
+    
+    保存したデータ領域は st.session_state.last_saved_domains に記録する。
+    """
+    saved = st.session_state.setdefault("saved_fingerprints", {})
+    flushed = []
     results = []
-    results.append(save_stats())
-    results.append(save_history())
-    results.append(save_settings())
+    
+    for domain, saver in _saved_domains():
+        fingerprint = _fingerprint(domain)
+        if saved.get(domain) == fingerprint:
+            continue
+        
+        if domain != "history" and saved.get("history") != _fingerprint("history"):
+            # 対戦履歴を保存できなかった場合は、保存されていないゲームを集計した統計も保存しない
+            # （変更ありのまま残し、次回の保存で対戦履歴とともに保存する）
+            results.append(False)
+            continue
+        
+        result = saver()
+        results.append(result)
+        if result:
+            saved[domain] = fingerprint
+            flushed.append(domain)
+    
+    st.session_state.last_saved_domains = flushed
+    
+    # 他のプロセスの保存内容と統合した場合はセッションへ反映
+    _apply_merged_changes()
+    
+    if flushed:
+        _auto_backup()
+    
+    # 書き込み遅延なしの場合は保存処理の終わりを書き込みの区切りとみなす
+    if FSYNC_POLICY == "idle" and not WRITE_BEHIND:
+        sync_pending_writes()
     return all(results)
 
+def _seed_sqlite_from_json():
+    """SQLiteデータベースの新規作成時、既存のJSONファイルから取り込む"""
+    if SQLITE_FILE.exists() or not ensure_data_directory():
+        return
+    
+    if HISTORY_MANIFEST_FILE.exists():
+        history = list(_load_sharded_history())
+    else:
+        history, absorbed_generation = _load_history_file()
+        _replay_journal(history, absorbed_generation)
+    sqlite_storage.save_history(SQLITE_FILE, history)
+    
+    for path, key, saver in (
+        (STATS_FILE, "stats", sqlite_storage.save_stats),
+        (SETTINGS_FILE, "settings", sqlite_storage.save_settings),
+    ):
+        data = _read_json(path)
+        if data:
+            content = data.get(key, {})
+            saver(SQLITE_FILE, migrate_stats(content, schema_version(data)) if key == "stats" else content)
+    
+    ledger = (_read_json(LEDGER_FILE) or {}).get("ledger")
+    if ledger:
+        sqlite_storage.save_ledger(SQLITE_FILE, ledger)
+
+def _load_shared_data():
+    """全セッション共通のデータ（履歴・統計・集計台帳・今回の戦績・ジャーナルの状態）の読み込み
+    
+    今回の戦績は集計台帳の未清算のゲームから集計する。台帳のない保存データでは、
+    現在の統計を基準値として台帳を作成する（ledger_unsaved: 台帳の保存先へ保存し直す）。
+    """
+    mark_stats_changed()
+    if is_journal_mode():
+        # スナップショットを読み込み、ジャーナル末尾のみ再生
+        history, stats, session_stats, journal = load_journal_state()
+    else:
+        history, stats, session_stats = load_history(), load_stats(), {}
+        journal = {"generation": 0, "offset": 0, "entries": 0}
+    
+    ledger = load_ledger()
+    ledger_unsaved = False
+    if ledger is None:
+        # 以前のバージョンではアプリ設定とともに保存していた
+        ledger = load_settings().get("stats_ledger")
+        ledger_unsaved = ledger is not None or bool(history)
+    if ledger is None:
+        ledger = adopt_ledger(history, stats, session_stats)
+    else:
+        ledger = dict(new_ledger(), **ledger)
+        session_stats = session_stats_from_history(history, ledger)
+    return {
+        "history": history,
+        "stats": stats,
+        "stats_ledger": ledger,
+        "ledger_unsaved": ledger_unsaved,
+        "current_session_stats": session_stats,
+        "journal": journal,
+        "sync": _new_sync_state(history, stats, ledger),
+    }
+
+def _attach_shared_data(data):
+    """共有データをセッションから参照させる（統計は空でない場合のみ）
+    
+    集計台帳・今回の戦績も全セッションで共有し、どのセッションで記録したゲームも清算できるようにする。
+    """
+    if st.session_state.get("history") is not data["history"]:
+        st.session_state.history = data["history"]
+    if st.session_state.get("journal_state") is not data["journal"]:
+        st.session_state.journal_state = data["journal"]
+    if st.session_state.get("sync_state") is not data["sync"]:
+        st.session_state.sync_state = data["sync"]
+    if data["stats"] and st.session_state.get("stats") is not data["stats"]:
+        st.session_state.stats = data["stats"]
+    for key in ("stats_ledger", "current_session_stats"):
+        if st.session_state.get(key) is not data[key]:
+            st.session_state[key] = data[key]
+
+def refresh_shared_data():
+    """他のプロセスによるファイル更新を検出し、共有データを読み込み直す（毎回の実行時）"""
+    _apply_merged_changes()
+    if not SHARED_STORE or _shared_store is None or "data_loaded" not in st.session_state:
+        return
+    if _writer is not None and _writer.pending:
+        # 書き込み待ちの内容を失わないよう、書き込み完了まで読み込み直さない
+        return
+    data = _shared_store.get("data", _file_signature(_shared_files()), _load_shared_data)
+    _attach_shared_data(data)
+
 def auto_load():
     """自動読み込み（アプリ起動時）"""
+    global _shared_store
     try:
-        # 統計データの読み込み
-        stats = load_stats()
-        if stats:
-            st.session_state.stats = stats
+        if is_sqlite_backend():
+            _seed_sqlite_from_json()
         
-        # 対戦履歴の読み込み
-        history = load_history()
-        if history:
-            st.session_state.history = history
+        if SHARED_STORE:
+            # 読み込み済みの共有データがあればファイルを読み直さずに使う
+            _shared_store = get_shared_store()
+            data = _shared_store.get("data", _file_signature(_shared_files()), _load_shared_data)
+            _attach_shared_data(data)
+        else:
+            data = _load_shared_data()
+            st.session_state.journal_state = data["journal"]
+            st.session_state.sync_state = data["sync"]
+            st.session_state.stats_ledger = data["stats_ledger"]
+            st.session_state.current_session_stats = data["current_session_stats"]
+            
+            # 統計データの反映
+            if data["stats"]:
+                st.session_state.stats = data["stats"]
+            
+            # 対戦履歴の反映
+            if data["history"]:
+                st.session_state.history = data["history"]
         
-        # 設定の読み込み
+        # 設定の読み込み（設定はセッションごとに持つ、以前のバージョンの集計台帳は除く）
         settings = load_settings()
+        settings.pop("stats_ledger", None)
         if settings:
             for key, value in settings.items():
                 if key not in st.session_state or st.session_state[key] != value:
                     st.session_state[key] = value
         
+        # 破損していたファイルの通知
+        recovered = st.session_state.pop("recovered_files", [])
+        if recovered:
+            st.warning(f"保存データが破損していたため、1世代前のデータから復旧しました: {', '.join(recovered)}")
+        
+        # 読み込んだ内容は保存済みとして扱う
+        mark_all_saved()
+        if data.pop("ledger_unsaved", False):
+            # 台帳のない保存データ・アプリ設定に保存していた台帳は、台帳の保存先へ保存する
+            st.session_state.saved_fingerprints.pop("ledger", None)
+            auto_save()
+        _persist_migrations()
         return True
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {e}")
         return False
 
-def export_all_data():
-    """全データのエクスポート（バックアップ用）"""
-    ensure_data_directory()
-    
-    export_data = {
-        "stats": st.session_state.get("stats", {}),
-        "history": st.session_state.get("history", []),
-        "settings": {
-            "rate": st.session_state.get("rate", 1.0),
-            "game_type": st.session_state.get("game_type", "四麻"),
-            "available_players": st.session_state.get("available_players", []),
-            "selected_players": st.session_state.get("selected_players", []),
-            "players": st.session_state.get("players", []),
-            "uma_1st": st.session_state.get("uma_1st", 10),
-            "uma_2nd": st.session_state.get("uma_2nd", 5),
-            "uma_3rd": st.session_state.get("uma_3rd", -5),
-            "uma_4th": st.session_state.get("uma_4th", -10),
-            "uma_1st_sanma": st.session_state.get("uma_1st_sanma", 15),
-            "uma_2nd_sanma": st.session_state.get("uma_2nd_sanma", -5),
-            "uma_3rd_sanma": st.session_state.get("uma_3rd_sanma", -10),
-        },
-        "export_date": datetime.now().isoformat(),
-        "version": "1.0"
-    }
+def _persist_migrations():
+    """読み込み時に現在のスキーマへ移行したファイルを保存し直す
+    
+    遅延読み込みのシャードは、次回の対戦履歴の保存時に書き直す。
+    """
+    if not _stale_files or is_sqlite_backend():
+        return
+    
+    saved = st.session_state.setdefault("saved_fingerprints", {})
+    for domain, path in (("stats", STATS_FILE), ("ledger", LEDGER_FILE), ("settings", SETTINGS_FILE), ("snapshot", SNAPSHOT_FILE)):
+        if str(path) in _stale_files:
+            saved.pop(domain, None)
+    
+    if is_journal_mode():
+        if str(HISTORY_FILE) in _stale_files or str(HISTORY_JOURNAL_FILE) in _stale_files:
+            compact_history()
+    elif str(HISTORY_FILE) in _stale_files:
+        mark_history_changed()
+        if is_sharded_mode():
+            # 履歴ファイルはシャードへ書き出した後は使わない
+            _stale_files.discard(str(HISTORY_FILE))
+    auto_save()
+
+def _auto_backup():
+    """前回のバックアップから AUTO_BACKUP_HOURS 時間たっていればバックアップを作成
     
-    export_filename = f"mahjong_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    export_path = DATA_DIR / export_filename
+    保存処理を待たせないよう、バックアップはライターのスレッドで作成する。対戦履歴はセッションの
+    履歴（月別保存では未読み込みのシャードがある）ではなく、保存済みのファイルから1ゲームずつ読み込む
+    （ライターのスレッドではセッションの状態・読み込み時の記録を変更しない _iter_saved_history を使う）。
+    """
+    global _last_backup
+    if AUTO_BACKUP_HOURS <= 0 or not ensure_data_directory():
+        return
+    
+    from .backup import create_backup, last_backup_time
+    now = datetime.now()
+    if _last_backup is None:
+        _last_backup = last_backup_time() or datetime.min
+    if now - _last_backup < timedelta(hours=AUTO_BACKUP_HOURS):
+        return
+    
+    _last_backup = now
+    has_history = bool(st.session_state.get("history"))
+    stats = copy.deepcopy(st.session_state.get("stats", {}))
+    settings = _backup_settings()
+    
+    def task():
+        # 保存済みの履歴を読み込めなかった場合は、全ゲームの削除として記録しないよう作成しない
+        records = _iter_saved_history()
+        first = next(records, None)
+        if first is None and has_history:
+            return None
+        history = records if first is None else itertools.chain([first], records)
+        return create_backup(history, stats, settings, now)
+    
+    # 書き込み遅延なしの場合もライターのスレッドで作成する（先に登録した保存の後に実行される）
+    _get_writer().submit("backup", task)
+
+def export_all_data():
+    """全データのバックアップ（前回のバックアップからの差分のみ書き出す）"""
+    global _last_backup
+    if not ensure_data_directory():
+        return None
     
+    from .backup import create_backup
     try:
-        with open(export_path, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
-        return export_path
+        _last_backup = datetime.now()
+        return create_backup(
+            st.session_state.get("history", []),
+            copy.deepcopy(st.session_state.get("stats", {})),
+            _backup_settings(),
+            _last_backup,
+        )
     except Exception as e:
         st.error(f"データのエクスポートに失敗しました: {e}")
         return None
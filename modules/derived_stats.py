@@ -0,0 +1,257 @@
+"""
+派生統計モジュール - 対戦履歴からの統計の再集計と、保存済みの統計との照合
+
+総合統計・今回の戦績は対戦履歴から求められる集計結果（キャッシュ）として扱う。
+対戦履歴だけでは決まらない操作（清算・統計リセット・統計の削除）は集計台帳に記録する:
+  baseline: 基準時点の総合統計、baseline_through: 基準時点の最後のゲームID
+  （それ以前のゲームは基準値に含まれる）、baseline_after: 基準値に集計されていない最後のゲームID
+  （統計リセットの時点、Noneは先頭から全て集計済み）、session: 今回の戦績（未清算）のゲームID、
+  excluded: 統計を削除したプレイヤー。
+総合統計 = baseline + 基準時点より後の清算済みのゲーム、今回の戦績 = session のゲーム。
+ゲームの集計先（locate_game）: "session"（今回の戦績）、"stats"（基準時点より後）、
+"baseline"（基準値に集計済み、baseline_after より後で baseline_through まで）、
+"reset"（統計リセット前、baseline_after まで。どの統計にも含まれない）。
+"""
+import copy
+from .aggregation import apply_game, new_player_stats
+
+# 基準時点を示す台帳の項目（ゲームIDを持つ）
+MARKER_KEYS = ("baseline_through", "baseline_after")
+
+# 照合で一致とみなす差（確定値は小数のため、加算の順序による誤差を許容する）
+TOLERANCE = 1e-6
+
+def new_ledger():
+    """集計台帳の初期値（基準値なし、全ゲームを集計する）"""
+    return {"baseline": {}, "baseline_through": None, "baseline_after": None, "session": [], "excluded": []}
+
+def adopt_ledger(history, stats, session_stats):
+    """台帳のない保存データの集計台帳（現在の統計を基準値とする）
+    
+    今回の戦績のゲーム数（1位の回数の合計）だけ末尾のゲームを未清算とみなす。
+    清算済みのゲームは基準値に集計済み（集計先 "baseline"、baseline_after はNone）として扱い、
+    修正・削除・ルールでの再計算の増減は基準値に反映する。
+    """
+    session_games = sum(player_stats.get("1位", 0) for player_stats in session_stats.values())
+    session_games = min(session_games, len(history))
+    settled_games = len(history) - session_games
+    
+    ledger = new_ledger()
+    ledger["baseline"] = copy.deepcopy(stats)
+    ledger["baseline_through"] = history[settled_games - 1]["id"] if settled_games else None
+    ledger["session"] = [history[index]["id"] for index in range(settled_games, len(history))]
+    return ledger
+
+def rebase(ledger, stats, history, reset=False):
+    """総合統計を直接変更した後（リセット・削除）の基準値の記録
+    
+    reset=True（統計リセット）の場合は、それまでのゲームを基準値に集計されていないものとする。
+    """
+    ledger["baseline"] = copy.deepcopy(stats)
+    ledger["baseline_through"] = history[-1]["id"] if history else None
+    if reset:
+        ledger["baseline_after"] = ledger["baseline_through"]
+
+def add_session_game(ledger, game_record):
+    """記録したゲームを今回の戦績として台帳に追加"""
+    ledger["session"].append(game_record["id"])
+    if ledger["excluded"]:
+        # 統計を削除したプレイヤーも、再び記録した場合は集計対象に戻す
+        ledger["excluded"] = [player for player in ledger["excluded"] if player not in game_record["results"]]
+
+def settle(ledger):
+    """清算（今回の戦績のゲームを清算済みにする）"""
+    ledger["session"] = []
+
+def merge_ledger(current, ours, base):
+    """集計台帳の3方向統合（他のプロセスの保存内容に、このセッションでの変更を加える）
+    
+    current: 他のプロセスが保存した台帳、ours: このセッションの台帳、
+    base: このセッションが前回保存（読み込み）した時点の台帳。
+    未清算のゲームID・統計を削除したプレイヤーは merge_history と同じく ID ごとに統合し、
+    基準値・基準時点はこのセッションで変更した場合のみこのセッションの値にする。
+    """
+    base = base or new_ledger()
+    merged = copy.deepcopy(current)
+    for key in ("session", "excluded"):
+        base_items = set(base.get(key, []))
+        ours_items = ours.get(key, [])
+        removed = base_items - set(ours_items)
+        items = [item for item in merged.get(key, []) if item not in removed]
+        items += [item for item in ours_items if item not in base_items and item not in items]
+        merged[key] = items
+    for key in ("baseline",) + MARKER_KEYS:
+        if ours.get(key) != base.get(key):
+            merged[key] = copy.deepcopy(ours.get(key))
+    return merged
+
+def locate_game(history, ledger, game_id):
+    """ゲームの位置と集計先（"session"・"stats"・"baseline"・"reset"）を末尾から探す（見つからなければNone）
+    
+    未清算のゲームは今回の戦績、基準時点以前のゲームは基準値（統計リセット前のゲームはどの統計にも
+    含まれない）、それ以外は総合統計に含まれる。
+    """
+    side = "stats"
+    baseline_after = ledger.get("baseline_after")
+    for index in range(len(history) - 1, -1, -1):
+        current_id = history[index]["id"]
+        if current_id == ledger["baseline_through"] and side == "stats":
+            side = "baseline"
+        if baseline_after is not None and current_id == baseline_after:
+            side = "reset"
+        if current_id == game_id:
+            if game_id in ledger["session"]:
+                return index, "session"
+            return index, side
+    return None
+
+def detach_game(ledger, game_id, side, previous_id):
+    """取り除いたゲームを台帳から除き、そのゲームを指していた基準時点の項目名の一覧を返す
+    
+    previous_id は取り除いたゲームの直前のゲームID（基準時点を1ゲーム戻す）。
+    """
+    if side == "session" and game_id in ledger["session"]:
+        ledger["session"].remove(game_id)
+    markers = [key for key in MARKER_KEYS if ledger.get(key) == game_id]
+    for key in markers:
+        ledger[key] = previous_id
+    return markers
+
+def attach_game(ledger, game_id, side, markers=()):
+    """戻したゲームを取り除く前の集計先で台帳に戻す（markers: detach_game の戻り値）"""
+    if side == "session" and game_id not in ledger["session"]:
+        ledger["session"].append(game_id)
+    for key in markers:
+        ledger[key] = game_id
+
+def rename_game(ledger, game_id, new_id):
+    """ゲームIDの変更（修正で記録を置き換えた場合）"""
+    ledger["session"] = [new_id if current_id == game_id else current_id for current_id in ledger["session"]]
+    for key in MARKER_KEYS:
+        if ledger.get(key) == game_id:
+            ledger[key] = new_id
+
+def baseline_games(history, ledger):
+    """基準値に集計済みのゲーム（baseline_after より後、baseline_through まで、未清算のゲームを除く）"""
+    baseline_through = ledger["baseline_through"]
+    if baseline_through is None:
+        return []
+    baseline_after = ledger.get("baseline_after")
+    session_ids = set(ledger["session"])
+    counting = baseline_after is None
+    games = []
+    for game_record in history:
+        game_id = game_record["id"]
+        if counting and game_id not in session_ids:
+            games.append(game_record)
+        if game_id == baseline_through:
+            return games
+        if game_id == baseline_after:
+            counting = True
+    raise ValueError(f"集計の基準時点のゲームが対戦履歴にありません: {baseline_through}")
+
+def shift_baseline(ledger, changes):
+    """基準値に集計済みのゲームを計算し直した増減の反映（changes: プレイヤー→{項目: 増減}）
+    
+    統計を削除したプレイヤー・基準値にないプレイヤーは基準値に含まれていないため変えない。
+    """
+    excluded = set(ledger["excluded"])
+    for player, player_changes in changes.items():
+        player_stats = ledger["baseline"].get(player)
+        if player_stats is None or player in excluded:
+            continue
+        for key, value in player_changes.items():
+            player_stats[key] = player_stats.get(key, 0) + value
+
+def apply_to_side(ledger, stats, session_stats, side, game_record, sign=1):
+    """集計先の統計へ1ゲーム分を加算（sign=-1で減算、統計リセット前のゲームは何もしない）
+    
+    基準値に集計済みのゲームは、基準値と総合統計の両方に加算する（shift_baseline と同じく、
+    基準値を変えないと対戦履歴からの再集計で元に戻るため）。
+    """
+    excluded = set(ledger["excluded"])
+    if side == "session":
+        _apply(session_stats, game_record, excluded, sign)
+    elif side == "stats":
+        _apply(stats, game_record, excluded, sign)
+    elif side == "baseline":
+        _apply(ledger["baseline"], game_record, excluded, sign)
+        _apply(stats, game_record, excluded, sign)
+
+def _apply(stats, game_record, excluded, sign=1):
+    """統計を削除したプレイヤーを除いて1ゲーム分を加算（sign=-1で減算）"""
+    if excluded and not excluded.isdisjoint(game_record["results"]):
+        results = {player: game_data for player, game_data in game_record["results"].items() if player not in excluded}
+        game_record = {"results": results}
+    apply_game(stats, game_record, sign)
+
+def fold_history(history, ledger):
+    """対戦履歴を1回走査して（総合統計, 今回の戦績）を求める"""
+    stats = copy.deepcopy(ledger["baseline"])
+    session_stats = {}
+    session_ids = set(ledger["session"])
+    excluded = set(ledger["excluded"])
+    baseline_through = ledger["baseline_through"]
+    in_baseline = baseline_through is not None
+    
+    for game_record in history:
+        game_id = game_record["id"]
+        if game_id in session_ids:
+            _apply(session_stats, game_record, excluded)
+        elif not in_baseline:
+            _apply(stats, game_record, excluded)
+        if in_baseline and game_id == baseline_through:
+            in_baseline = False
+    
+    if in_baseline:
+        raise ValueError(f"集計の基準時点のゲームが対戦履歴にありません: {baseline_through}")
+    return stats, session_stats
+
+def session_stats_from_history(history, ledger):
+    """今回の戦績のみの再集計（末尾から未清算のゲームを探すため、通常は全件を読まない）"""
+    remaining = set(ledger["session"])
+    excluded = set(ledger["excluded"])
+    games = []
+    index = len(history) - 1
+    while remaining and index >= 0:
+        game_record = history[index]
+        if game_record["id"] in remaining:
+            remaining.discard(game_record["id"])
+            games.append(game_record)
+        index -= 1
+    
+    session_stats = {}
+    for game_record in reversed(games):
+        _apply(session_stats, game_record, excluded)
+    return session_stats
+
+def diff_stats(expected, stored):
+    """統計の差分の一覧（各要素はプレイヤー・項目・保存済みの値・履歴からの値の辞書）
+    
+    全項目が0のプレイヤーは、統計にないプレイヤーと同じとみなす。
+    """
+    differences = []
+    players = list(expected) + [player for player in stored if player not in expected]
+    for player in players:
+        expected_stats = expected.get(player, {})
+        stored_stats = stored.get(player, {})
+        for key in new_player_stats():
+            stored_value = stored_stats.get(key, 0)
+            expected_value = expected_stats.get(key, 0)
+            if abs(stored_value - expected_value) > TOLERANCE:
+                differences.append({
+                    "player": player, "key": key,
+                    "stored": stored_value, "expected": expected_value,
+                })
+    return differences
+
+def verify(history, ledger, stats, session_stats):
+    """保存済みの統計と対戦履歴からの集計の照合
+    
+    戻り値は（総合統計, 今回の戦績）の組と、それぞれの差分の一覧の辞書。
+    """
+    expected_stats, expected_session = fold_history(history, ledger)
+    return (expected_stats, expected_session), {
+        "stats": diff_stats(expected_stats, stats),
+        "current_session_stats": diff_stats(expected_session, session_stats),
+    }
@@ -0,0 +1,133 @@
+"""
+エクスポートモジュール - 対戦履歴・統計のCSV / JSON Lines形式での逐次出力
+
+各関数は1行ずつ文字列を返すジェネレーターで、出力全体をメモリに載せない。
+コマンドラインからも実行できる:
+
+    python -m modules.export history --format csv --output history.csv
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+from .aggregation import new_player_stats
+from .schema import SCHEMA_VERSION
+
+# 対戦履歴のCSVの列（1行 = 1ゲームの1プレイヤー分）
+HISTORY_COLUMNS = [
+    "game_id", "timestamp", "player", "score", "score_diff",
+    "position", "yakuman", "special", "confirmed_value",
+]
+
+# 統計のCSVの列
+STATS_COLUMNS = ["順位", "プレイヤー", *new_player_stats()]
+
+def iter_csv(rows, header):
+    """CSVの行を1行ずつ文字列で返す"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+def iter_history_rows(history):
+    """対戦履歴のCSVの行（ゲームのプレイヤーごと）"""
+    for record in history:
+        for player, game_data in record["results"].items():
+            yield [
+                record["id"],
+                record.get("timestamp", ""),
+                player,
+                game_data["score"],
+                game_data["score_diff"],
+                game_data["position"],
+                game_data["yakuman"],
+                game_data["special"],
+                game_data["confirmed_value"],
+            ]
+
+def iter_history_csv(history):
+    """対戦履歴のCSV出力"""
+    return iter_csv(iter_history_rows(history), HISTORY_COLUMNS)
+
+def iter_history_jsonl(history):
+    """対戦履歴のJSON Lines出力（1行 = 1ゲーム）"""
+    for record in history:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+def iter_stats_rows(stats):
+    """統計のCSVの行（総合勝ち得点の高い順）"""
+    ranking = sorted(stats.items(), key=lambda item: item[1].get("総合勝ち得点", 0), reverse=True)
+    for rank, (player, player_stats) in enumerate(ranking, 1):
+        yield [rank, player, *(player_stats.get(key, 0) for key in STATS_COLUMNS[2:])]
+
+def iter_stats_csv(stats):
+    """統計のCSV出力"""
+    return iter_csv(iter_stats_rows(stats), STATS_COLUMNS)
+
+def iter_stats_jsonl(stats):
+    """統計のJSON Lines出力（1行 = 1プレイヤー）"""
+    for rank, player, *values in iter_stats_rows(stats):
+        row = {"順位": rank, "プレイヤー": player, **dict(zip(STATS_COLUMNS[2:], values))}
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+def iter_json_with_history(data):
+    """対戦履歴を含むデータのインデント付きJSON出力（対戦履歴は1ゲーム1行で書き出す）"""
+    header = {key: value for key, value in data.items() if key != "history"}
+    text = json.dumps(header, ensure_ascii=False, indent=2)
+    # 末尾の「}」を外して対戦履歴の配列を続ける
+    yield (text[:-2] + ",\n" if header else "{\n") + '  "history": ['
+    separator = "\n    "
+    for record in data.get("history", []):
+        yield separator + json.dumps(record, ensure_ascii=False)
+        separator = ",\n    "
+    yield "\n  ]\n}\n"
+
+def iter_backup_json(stats, settings, history):
+    """バックアップ用JSONの出力（対戦履歴は1ゲームずつ書き出す）"""
+    return iter_json_with_history({
+        "stats": stats,
+        "settings": settings,
+        "export_date": datetime.now().isoformat(),
+        "version": SCHEMA_VERSION,
+        "history": history,
+    })
+
+EXPORTERS = {
+    ("history", "csv"): iter_history_csv,
+    ("history", "jsonl"): iter_history_jsonl,
+    ("stats", "csv"): iter_stats_csv,
+    ("stats", "jsonl"): iter_stats_jsonl,
+}
+
+def main(argv=None):
+    """コマンドラインからのエクスポート（保存済みデータを読み込んで出力）"""
+    from .data_storage import iter_history, load_stats
+    
+    parser = argparse.ArgumentParser(description="麻雀スコアの対戦履歴・統計をエクスポートします")
+    parser.add_argument("target", choices=["history", "stats"], help="出力するデータ")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="出力形式")
+    parser.add_argument("--output", "-o", help="出力ファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+    
+    source = iter_history() if args.target == "history" else load_stats()
+    lines = EXPORTERS[(args.target, args.format)](source)
+    
+    if args.output is None:
+        sys.stdout.writelines(lines)
+        return 0
+    
+    # CSVはExcelで開けるようBOM付きで保存
+    encoding = "utf-8-sig" if args.format == "csv" else "utf-8"
+    with open(args.output, "w", encoding=encoding, newline="") as f:
+        f.writelines(lines)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
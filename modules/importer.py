@@ -0,0 +1,385 @@
+"""
+インポートモジュール - バックアップ・対戦履歴ファイルの逐次取り込み
+
+バックアップJSON・JSON Lines・CSVを1ゲームずつ読み込み、点数を検証したうえで
+記録時と同じ計算で対戦履歴・統計に反映する。保存はバッチ（既定5000ゲーム）ごとに1回。
+コマンドラインからも実行できる:
+
+    python -m modules.importer history.csv --rejects rejected.csv
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import sys
+from datetime import datetime
+import streamlit as st
+from .data_storage import auto_save, persist_games_added, mark_stats_changed, GZIP_MAGIC, LZMA_MAGIC
+from .export import iter_csv
+from .records import is_game_record, game_results, make_game_record
+from .scoring import score_game
+from .derived_stats import apply_to_side
+from .score_utils import current_rules, validate_scores, stats_ledger
+
+# 1回の保存にまとめるゲーム数
+IMPORT_BATCH_SIZE = int(os.environ.get("MAHJONG_IMPORT_BATCH_SIZE", "5000"))
+
+IMPORT_FORMATS = ("json", "jsonl", "csv")
+
+# CSVの列名（エクスポートの列名のほか日本語の列名も受け付ける）
+CSV_COLUMN_ALIASES = {
+    "ゲームID": "game_id",
+    "記録日時": "timestamp",
+    "プレイヤー": "player",
+    "点数": "score",
+    "跳び/跳ばし": "special",
+    "役満祝儀": "yakuman",
+}
+
+SPECIAL_FLAGS = ("なし", "跳び", "跳ばし")
+
+# 拒否した行の報告の列
+REJECTED_COLUMNS = ["row", "game_id", "reason"]
+
+def detect_format(name):
+    """ファイル名の拡張子から形式を判定"""
+    name = str(name).lower()
+    for compressed in (".gz", ".xz"):
+        if name.endswith(compressed):
+            name = name[:-len(compressed)]
+    suffix = os.path.splitext(name)[1]
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "json"
+
+def _open_text(source):
+    """ファイルパスまたはバイナリのファイルオブジェクトをテキストとして開く（圧縮は自動判別）"""
+    raw = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+    head = raw.read(len(LZMA_MAGIC))
+    raw.seek(0)
+    if head.startswith(GZIP_MAGIC):
+        raw = gzip.GzipFile(fileobj=raw)
+    elif head.startswith(LZMA_MAGIC):
+        raw = lzma.LZMAFile(raw)
+    # CSVはBOM付きで書き出すためBOMを読み飛ばす
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+class _JsonStream:
+    """JSONの値を先頭から1つずつ読み込む（全体をメモリに載せない）"""
+    
+    def __init__(self, f, chunk_size=1 << 16):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._eof = False
+    
+    def _fill(self):
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+        self._buffer += chunk
+        return bool(chunk)
+    
+    def peek(self):
+        """空白を読み飛ばして次の文字を返す（終端ならNone）"""
+        while True:
+            stripped = self._buffer.lstrip()
+            if stripped or self._eof:
+                self._buffer = stripped
+                return stripped[:1] or None
+            self._buffer = ""
+            self._fill()
+    
+    def expect(self, char):
+        """次の文字が char であることを確認して読み飛ばす"""
+        if self.peek() != char:
+            raise ValueError(f"JSONの形式が正しくありません（「{char}」がありません）")
+        self._buffer = self._buffer[1:]
+    
+    def value(self):
+        """次のJSONの値を読み込む"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise ValueError(f"JSONの形式が正しくありません: {e}") from e
+            # 数値などは読み込んだ範囲の末尾で途切れている可能性があるため続きを読む
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._buffer = self._buffer[end:]
+            return value
+
+def _iter_json_records(f):
+    """バックアップJSONの対戦履歴を1ゲームずつ返す（対戦履歴以外の項目は読み飛ばす）"""
+    stream = _JsonStream(f)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "history" and stream.peek() == "[":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.peek() == "]":
+                        stream.expect("]")
+                        break
+                    stream.expect(",")
+        else:
+            stream.value()
+        if stream.peek() == "}":
+            return
+        stream.expect(",")
+
+def _game_from_record(record):
+    """ゲーム記録（旧形式を含む）から取り込む内容を取り出す"""
+    if not isinstance(record, dict):
+        raise ValueError("ゲーム記録の形式が正しくありません")
+    game = {
+        "id": record.get("id") if is_game_record(record) else None,
+        "timestamp": record.get("timestamp") if is_game_record(record) else None,
+        "scores": {},
+        "special": {},
+        "yakuman": {},
+    }
+    for player, game_data in game_results(record).items():
+        if not isinstance(game_data, dict):
+            raise ValueError(f"{player} の結果の形式が正しくありません")
+        game["scores"][player] = game_data.get("score")
+        game["special"][player] = game_data.get("special", "なし")
+        game["yakuman"][player] = game_data.get("yakuman", 0)
+    return game
+
+def iter_json_games(f):
+    """バックアップJSONのゲームを（ゲーム番号, 取り込む内容, エラー）の組で返す"""
+    for number, record in enumerate(_iter_json_records(f), 1):
+        try:
+            yield number, _game_from_record(record), None
+        except ValueError as e:
+            yield number, None, str(e)
+
+def iter_jsonl_games(f):
+    """JSON Lines（1行 = 1ゲーム）のゲームを（行番号, 取り込む内容, エラー）の組で返す"""
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, None, f"JSONの形式が正しくありません: {e}"
+            continue
+        try:
+            yield number, _game_from_record(record), None
+        except ValueError as e:
+            yield number, None, str(e)
+
+def iter_csv_games(f):
+    """CSV（1行 = 1ゲームの1プレイヤー分、game_id が同じ連続した行を1ゲームとする）のゲームを返す
+    
+    点数は跳び・跳ばしの加減後の値（エクスポートの score 列と同じ）。
+    戻り値は（ゲームの先頭の行番号, 取り込む内容, エラー）の組。
+    """
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [CSV_COLUMN_ALIASES.get(name.strip(), name.strip()) for name in header]
+    missing = [name for name in ("game_id", "player", "score") if name not in columns]
+    if missing:
+        raise ValueError(f"CSVに必要な列がありません: {', '.join(missing)}")
+    
+    game = None
+    error = None
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        number = reader.line_num
+        values = {name: value.strip() for name, value in zip(columns, row)}
+        game_id = values.get("game_id", "")
+        if game is None or game_id != game["id"]:
+            if game is not None:
+                yield game["row"], game, error
+            game = {
+                "row": number, "id": game_id, "timestamp": values.get("timestamp") or None,
+                "scores": {}, "special": {}, "yakuman": {},
+            }
+            error = None if game_id else "game_id が空です"
+        
+        player = values.get("player", "")
+        if not player:
+            error = error or f"{number}行目: プレイヤー名が空です"
+            continue
+        try:
+            game["scores"][player] = int(values.get("score", "").replace(",", ""))
+            game["yakuman"][player] = int(values.get("yakuman") or 0)
+        except ValueError:
+            error = error or f"{number}行目: 点数・役満祝儀が整数ではありません"
+        game["special"][player] = values.get("special") or "なし"
+    if game is not None:
+        yield game["row"], game, error
+
+GAME_READERS = {
+    "json": iter_json_games,
+    "jsonl": iter_jsonl_games,
+    "csv": iter_csv_games,
+}
+
+def normalize_timestamp(timestamp):
+    """記録日時をISO形式（YYYY-MM-DDTHH:MM:SS）にそろえる（日付の区切りは「/」も可、読めなければ ValueError）"""
+    if not isinstance(timestamp, str):
+        raise ValueError(timestamp)
+    return datetime.fromisoformat(timestamp.strip().replace("/", "-")).isoformat()
+
+def validate_game(game, known_ids):
+    """取り込むゲームの検証（問題があれば理由、なければNone）
+    
+    記録日時は月別保存のシャードの決定に使うため、ISO形式にそろえて game に書き戻す。
+    """
+    if game["timestamp"] is not None:
+        try:
+            game["timestamp"] = normalize_timestamp(game["timestamp"])
+        except ValueError:
+            return f"記録日時が正しくありません: {game['timestamp']}"
+    
+    scores = game["scores"]
+    if len(scores) not in (3, 4):
+        return f"プレイヤー数が{len(scores)}人です（3人または4人）"
+    for player, score in scores.items():
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            return f"{player} の点数が数値ではありません"
+    for player, special in game["special"].items():
+        if special not in SPECIAL_FLAGS:
+            return f"{player} の跳び/跳ばしの値が正しくありません: {special}"
+    for player, yakuman in game["yakuman"].items():
+        if isinstance(yakuman, bool) or not isinstance(yakuman, int) or not -10 <= yakuman <= 10:
+            return f"{player} の役満祝儀が正しくありません: {yakuman}"
+    
+    validation = validate_scores(scores)
+    if not validation["is_valid"]:
+        return f"点数の合計が{validation['total']:,}点です（{validation['expected']:,}点との差 {validation['difference']:+,}点）"
+    
+    if game["id"] and game["id"] in known_ids:
+        return "同じゲームIDの記録が取り込み済みです"
+    return None
+
+def _flush_batch(batch):
+    """1バッチ分のゲームを対戦履歴・統計に反映して保存（保存できなければ OSError）
+    
+    追記型の保存方式ではゲームを先に書き込み、書き込めなかったバッチはセッションにも反映しない。
+    統計は記録したゲームと同じく、統計を削除したプレイヤーを除いて総合統計に加算する。
+    """
+    if not persist_games_added(batch):
+        raise OSError("対戦履歴の保存に失敗しました")
+    
+    history = st.session_state.history
+    stats = st.session_state.stats
+    session_stats = st.session_state.setdefault("current_session_stats", {})
+    ledger = stats_ledger()
+    for game_record in batch:
+        history.append(game_record)
+        apply_to_side(ledger, stats, session_stats, "stats", game_record)
+    mark_stats_changed()
+    if not auto_save():
+        raise OSError("対戦履歴・統計の保存に失敗しました")
+
+def _flush_or_abort(batch, imported):
+    """バッチの保存（失敗した場合は保存済みの件数を添えて取り込みを中止）"""
+    try:
+        _flush_batch(batch)
+    except OSError as e:
+        raise OSError(f"{e}。取り込みを中止しました（保存済み: {imported}件）") from e
+
+def import_games(games, batch_size=None):
+    """ゲームの取り込み（過去の清算済みのゲームとして総合統計に反映）
+    
+    games は（行番号, 取り込む内容, エラー）の組を返すイテラブル。点数は現在のルール設定で
+    計算し直す。戻り値は {"imported": 取り込んだ件数, "rejected": 拒否した行の一覧}。
+    保存に失敗した場合は OSError（それまでのバッチは保存済み）。
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    if "history" not in st.session_state:
+        st.session_state.history = []
+    known_ids = {record["id"] for record in st.session_state.history}
+    
+    # 計算ルールは取り込み開始時の設定で人数ごとに1回だけ作成
+    rules = {player_count: current_rules(player_count) for player_count in (3, 4)}
+    
+    imported = 0
+    rejected = []
+    batch = []
+    for row, game, error in games:
+        if error is None:
+            error = validate_game(game, known_ids)
+        if error is not None:
+            rejected.append({"row": row, "game_id": (game or {}).get("id") or "", "reason": error})
+            continue
+        
+        results = score_game(game["scores"], game["special"], game["yakuman"], rules[len(game["scores"])])
+        game_record = make_game_record(results, game["id"] or None, game["timestamp"])
+        known_ids.add(game_record["id"])
+        batch.append(game_record)
+        if len(batch) >= batch_size:
+            _flush_or_abort(batch, imported)
+            imported += len(batch)
+            batch = []
+    
+    if batch:
+        _flush_or_abort(batch, imported)
+        imported += len(batch)
+    return {"imported": imported, "rejected": rejected}
+
+def import_file(source, format=None, batch_size=None):
+    """ファイルの取り込み（source はファイルパスまたはバイナリのファイルオブジェクト）"""
+    format = format or detect_format(getattr(source, "name", source))
+    with _open_text(source) as f:
+        return import_games(GAME_READERS[format](f), batch_size)
+
+def iter_rejected_csv(rejected):
+    """拒否した行の報告のCSV出力"""
+    return iter_csv(([item[key] for key in REJECTED_COLUMNS] for item in rejected), REJECTED_COLUMNS)
+
+def main(argv=None):
+    """コマンドラインからの取り込み（保存済みデータに追加して保存）"""
+    from .data_init import init_app_state
+    from .data_storage import flush_pending_writes
+    
+    parser = argparse.ArgumentParser(description="麻雀スコアの対戦履歴を取り込みます")
+    parser.add_argument("input", help="取り込むファイル（バックアップJSON・JSON Lines・CSV）")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="入力形式（省略時は拡張子から判定）")
+    parser.add_argument("--batch-size", type=int, help="1回の保存にまとめるゲーム数")
+    parser.add_argument("--rejects", help="拒否した行の報告を書き出すCSVファイル")
+    args = parser.parse_args(argv)
+    
+    init_app_state()
+    try:
+        result = import_file(args.input, args.format, args.batch_size)
+    except (OSError, ValueError) as e:
+        print(f"取り込みに失敗しました: {e}", file=sys.stderr)
+        return 1
+    finally:
+        flush_pending_writes()
+    
+    print(f"取り込み: {result['imported']}件 / 拒否: {len(result['rejected'])}件")
+    if args.rejects:
+        with open(args.rejects, "w", encoding="utf-8-sig", newline="") as f:
+            f.writelines(iter_rejected_csv(result["rejected"]))
+    else:
+        for item in result["rejected"]:
+            print(f"{item['row']}: {item['game_id']} {item['reason']}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
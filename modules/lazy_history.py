@@ -0,0 +1,146 @@
+"""
+遅延読み込み履歴モジュール - 月別シャードから必要な分だけ読み込む対戦履歴
+"""
+from bisect import bisect_right
+from .records import shard_key, shard_order, reconcile_history
+
+class LazyHistory:
+    """対戦履歴のリストの代わりに使う、シャードを必要な時だけ読み込むシーケンス
+    
+    シャード一覧の件数から各シャードの開始位置（オフセット）を求め、
+    len・負のインデックス・pop・置き換え・追記は該当するシャードだけを読み込んで行う。
+    全件を順に読む場合もシャードを保持しないため、メモリ使用量は履歴の件数によらない。
+    """
+    
+    def __init__(self, counts, loader, on_load=None):
+        # counts: 記録月→件数、loader(記録月): シャードの対戦履歴を返す関数
+        self._counts = {month: count for month, count in counts.items() if count}
+        self._loader = loader
+        self._loaded = {}
+        self.on_load = on_load
+        self._reindex()
+    
+    def _reindex(self):
+        """シャードの並びと開始位置の再計算"""
+        self._months = sorted(self._counts, key=shard_order)
+        self._offsets = []
+        total = 0
+        for month in self._months:
+            self._offsets.append(total)
+            total += self._counts[month]
+        self._length = total
+    
+    def _shard(self, month):
+        """シャードの取得（未読み込みなら読み込んで保持）"""
+        if month not in self._loaded:
+            records = list(self._loader(month)) if month in self._counts else []
+            self._loaded[month] = records
+            if self.on_load is not None:
+                self.on_load(month, records)
+            if len(records) != self._counts.get(month, 0):
+                # シャード一覧の件数がずれていた場合は実際の件数に合わせる
+                self._set_count(month, len(records))
+        return self._loaded[month]
+    
+    def _set_count(self, month, count):
+        """シャードの件数の更新"""
+        if count:
+            self._counts[month] = count
+        else:
+            self._counts.pop(month, None)
+        self._reindex()
+    
+    def _locate_loaded(self, index):
+        """位置のシャードを読み込んでから、シャードとシャード内の位置を求める"""
+        while True:
+            month, offset = self._locate(index)
+            if month in self._loaded:
+                return month, offset
+            # 読み込みでシャードの件数が補正されることがあるため、読み込み後に求め直す
+            self._shard(month)
+    
+    def _locate(self, index):
+        """位置からシャードとシャード内の位置を求める"""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("対戦履歴の範囲外の位置です")
+        position = bisect_right(self._offsets, index) - 1
+        return self._months[position], index - self._offsets[position]
+    
+    def __len__(self):
+        return self._length
+    
+    def __bool__(self):
+        return self._length > 0
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        month, offset = self._locate(index)
+        return self._shard(month)[offset]
+    
+    def __setitem__(self, index, record):
+        """ゲーム記録の置き換え（記録月は変わらないこと）"""
+        month, offset = self._locate_loaded(index)
+        self._loaded[month][offset] = record
+    
+    def __iter__(self):
+        for _, records in self.pages():
+            yield from records
+    
+    def pages(self):
+        """シャード（1か月分）ごとに（記録月, 対戦履歴）を順に返す（読み込んだシャードは保持しない）"""
+        for month in list(self._months):
+            if month in self._loaded:
+                yield month, self._loaded[month]
+            else:
+                yield month, self._loader(month)
+    
+    def append(self, record):
+        """ゲーム記録の追加（記録月のシャードのみ読み込む）"""
+        month = shard_key(record)
+        records = self._shard(month)
+        records.append(record)
+        self._set_count(month, len(records))
+    
+    def insert_after(self, previous_id, record):
+        """ゲーム記録を記録月のシャード内で指定したゲームの直後に追加（見つからなければシャードの先頭）"""
+        month = shard_key(record)
+        records = self._shard(month)
+        position = 0
+        for index in range(len(records) - 1, -1, -1):
+            if records[index]["id"] == previous_id:
+                position = index + 1
+                break
+        records.insert(position, record)
+        self._set_count(month, len(records))
+    
+    def pop(self, index=-1):
+        """ゲーム記録の取り出し（該当するシャードのみ読み込む）"""
+        if not self._length:
+            raise IndexError("対戦履歴が空です")
+        month, offset = self._locate_loaded(index)
+        records = self._loaded[month]
+        record = records.pop(offset)
+        self._set_count(month, len(records))
+        return record
+    
+    def load_all(self):
+        """全シャードの読み込み（全件を書き換えて保存し直す場合用）"""
+        for month in list(self._months):
+            self._shard(month)
+    
+    def loaded_shards(self):
+        """読み込み済みのシャード（変更がありうるのはこれらのみ）"""
+        return dict(self._loaded)
+    
+    def reconcile(self, snapshot, merged):
+        """1シャード分の統合結果の反映"""
+        records = merged or snapshot
+        if not records:
+            return
+        month = shard_key(records[0])
+        shard = self._shard(month)
+        reconcile_history(shard, snapshot, merged)
+        self._set_count(month, len(shard))
@@ -0,0 +1,184 @@
+"""
+対戦記録モジュール - ゲーム記録の形式とゲームIDによる統合
+"""
+import re
+import uuid
+
+# 記録日時のない旧形式のゲームを入れるシャード
+LEGACY_SHARD = "legacy"
+
+# シャードにする記録日時の先頭（記録月「YYYY-MM」、以降は「-日…」のみ）
+SHARD_MONTH_PATTERN = re.compile(r"(\d{4}-(?:0[1-9]|1[0-2]))(?:-.*)?", re.DOTALL)
+
+def new_game_id():
+    """新しいゲームIDの発行"""
+    return uuid.uuid4().hex
+
+def make_game_record(results, game_id=None, timestamp=None):
+    """ゲーム記録の作成（results はプレイヤー名→結果の辞書、timestamp は記録日時）"""
+    record = {"id": game_id or new_game_id(), "results": results}
+    if timestamp:
+        record["timestamp"] = timestamp
+    return record
+
+def is_game_record(record):
+    """ID付きの形式のゲーム記録か（旧形式はプレイヤー名→結果の辞書）"""
+    results = record.get("results")
+    return isinstance(results, dict) and "score" not in results
+
+def game_results(record):
+    """ゲーム記録のプレイヤー別結果（旧形式にも対応）"""
+    return record["results"] if is_game_record(record) else record
+
+def normalize_game(record, index=0):
+    """旧形式のゲーム記録をID付きの形式に変換
+    
+    旧形式のIDは履歴中の位置から決めるため、どのプロセスで変換しても同じIDになる。
+    """
+    if is_game_record(record):
+        if "id" in record:
+            return record
+        return dict(record, id=f"legacy-{index}")
+    return make_game_record(record, f"legacy-{index}")
+
+def normalize_history(history):
+    """対戦履歴の全ゲームをID付きの形式に変換"""
+    return [normalize_game(record, index) for index, record in enumerate(history)]
+
+def merge_history(current, ours, base_ids):
+    """ゲームIDによる対戦履歴の統合
+    
+    current: 他のプロセスが保存した履歴、ours: このセッションの履歴、
+    base_ids: このセッションが前回保存（読み込み）した時点のゲームID。
+    current の並びを土台に、このセッションで取り消したゲームを除き、
+    このセッションで追加したゲームを末尾に加える（途中に挿入したゲームは直前のゲームの後）。
+    """
+    base_ids = set(base_ids)
+    ours_ids = {record["id"] for record in ours}
+    removed = base_ids - ours_ids
+    
+    merged = [record for record in current if record["id"] not in removed]
+    merged_ids = {record["id"] for record in merged}
+    
+    # 追加したゲームを、このセッションの履歴で直前にある統合済みのゲームごとにまとめる
+    inserted = {}
+    added = []
+    previous_id = None
+    for record in ours:
+        game_id = record["id"]
+        if game_id in merged_ids:
+            if added:
+                inserted.setdefault(previous_id, []).extend(added)
+                added = []
+            previous_id = game_id
+        elif game_id not in base_ids:
+            added.append(record)
+    
+    if inserted:
+        result = list(inserted.get(None, []))
+        for record in merged:
+            result.append(record)
+            result.extend(inserted.get(record["id"], []))
+        merged = result
+    return merged + added
+
+def insert_after(history, previous_id, record):
+    """ゲーム記録を指定したゲームの直後に追加（previous_id がNoneなら先頭、見つからなければ末尾）"""
+    if previous_id is None:
+        history.insert(0, record)
+        return
+    for index in range(len(history) - 1, -1, -1):
+        if history[index]["id"] == previous_id:
+            history.insert(index + 1, record)
+            return
+    history.append(record)
+
+def reconcile_history(history, snapshot, merged):
+    """統合結果をセッションの履歴へ反映（統合後に追加・取り消したゲームは保つ）
+    
+    snapshot: 統合時に保存しようとした履歴（全体または1シャード分）、merged: 統合後の内容。
+    他のプロセスが取り消したゲームを除き、追加したゲームを記録日時の順に加える。
+    """
+    snapshot_ids = {record["id"] for record in snapshot}
+    merged_ids = {record["id"] for record in merged}
+    history_ids = {record["id"] for record in history}
+    
+    removed = snapshot_ids - merged_ids
+    added = [
+        record for record in merged
+        if record["id"] not in snapshot_ids and record["id"] not in history_ids
+    ]
+    if not removed and not added:
+        return history
+    
+    reconciled = [record for record in history if record["id"] not in removed]
+    if added:
+        reconciled += added
+        reconciled.sort(key=lambda record: record.get("timestamp") or "")
+    history[:] = reconciled
+    return history
+
+def shard_key(record):
+    """ゲーム記録のシャード（記録月「YYYY-MM」）
+    
+    シャード名はファイル名になるため、記録日時がない・「YYYY-MM」で始まらない場合は LEGACY_SHARD にする。
+    """
+    timestamp = record.get("timestamp") if is_game_record(record) else None
+    match = SHARD_MONTH_PATTERN.fullmatch(timestamp) if isinstance(timestamp, str) else None
+    return match.group(1) if match else LEGACY_SHARD
+
+def shard_order(month):
+    """シャードの並び順（旧形式のシャードを先頭にする）"""
+    return (month != LEGACY_SHARD, month)
+
+def group_by_shard(history):
+    """対戦履歴をシャードごとに分ける（記録順を保つ）"""
+    shards = {}
+    for record in history:
+        shards.setdefault(shard_key(record), []).append(record)
+    return shards
+
+def pack_history(history):
+    """対戦履歴を列指向の形式に変換（キー名を繰り返さず、結果は位置で並べる）
+    
+    戻り値は {"format": "columns", "keys": 結果のキー一覧, "games": ゲームごとの配列}。
+    ゲームは [ID, [[プレイヤー名, 値...], ...]] で、ID・結果以外の項目があれば3番目に付ける。
+    """
+    keys = []
+    for record in history:
+        for game_data in game_results(record).values():
+            for key in game_data:
+                if key not in keys:
+                    keys.append(key)
+    
+    games = []
+    for record in history:
+        rows = [
+            [player, *(game_data.get(key) for key in keys)]
+            for player, game_data in game_results(record).items()
+        ]
+        game = [record.get("id"), rows]
+        extras = {key: value for key, value in record.items() if key not in ("id", "results")} if is_game_record(record) else {}
+        if extras:
+            game.append(extras)
+        games.append(game)
+    return {"format": "columns", "keys": keys, "games": games}
+
+def unpack_history(packed):
+    """列指向の形式の対戦履歴を元の形式に戻す"""
+    keys = packed["keys"]
+    history = []
+    for game in packed["games"]:
+        results = {
+            row[0]: {key: value for key, value in zip(keys, row[1:]) if value is not None}
+            for row in game[1]
+        }
+        record = make_game_record(results, game[0])
+        if len(game) > 2:
+            record.update(game[2])
+        history.append(record)
+    return history
+
+def is_packed_history(history):
+    """列指向の形式の対戦履歴か"""
+    return isinstance(history, dict) and history.get("format") == "columns"
@@ -0,0 +1,177 @@
+"""
+再計算モジュール - ルール変更時の対戦履歴全体の一括再計算
+
+対戦履歴を「ゲーム×席」の配列（点数・順位・跳び/跳ばし・役満祝儀）に読み込み、
+全ゲームの score_diff・confirmed_value とプレイヤー別の集計を配列演算でまとめて求める。
+ウマ・レート・役満祝儀を変更した後に、過去のゲームを新しいルールで計算し直すために使う。
+"""
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from .aggregation import new_player_stats
+
+# 1ゲームの最大人数（三麻のゲームは4席目を空席にする）
+MAX_SEATS = 4
+
+# 跳び/跳ばしの配列上の値
+SPECIAL_CODES = {"なし": 0, "跳ばし": 1, "跳び": 2}
+
+# 配列に読み込むプレイヤー別結果の項目
+RESULT_FIELDS = ("score", "position", "yakuman", "special", "score_diff", "confirmed_value")
+
+def history_arrays(history):
+    """対戦履歴を「ゲーム×席」の配列に変換
+    
+    戻り値の辞書:
+      players: プレイヤー名の一覧（player の値が位置）、player: 席ごとのプレイヤー（空席は-1）、
+      player_count: ゲームごとの人数、RESULT_FIELDS の各項目: 席ごとの値（空席は0）、
+      entries: 全席のプレイヤー別結果（ゲーム記録の results の値）と、その（game_index, seat_index）。
+    席の並びはゲーム記録の results の順。
+    """
+    results = [record["results"] for record in history]
+    names = np.fromiter(chain.from_iterable(results), dtype=object)
+    values = list(chain.from_iterable(map(dict.values, results)))
+    player_count = np.fromiter(map(len, results), dtype=np.int64, count=len(results))
+    game_count = len(player_count)
+    
+    # 各席の（ゲーム, 席）の位置
+    game_index = np.repeat(np.arange(game_count), player_count)
+    starts = np.cumsum(player_count) - player_count
+    seat_index = np.arange(len(values)) - np.repeat(starts, player_count)
+    
+    codes, players = pd.factorize(names)
+    arrays = {
+        "players": list(players),
+        "player_count": player_count,
+        "entries": values,
+        "game_index": game_index,
+        "seat_index": seat_index,
+    }
+    
+    player = np.full((game_count, MAX_SEATS), -1, dtype=np.int64)
+    player[game_index, seat_index] = codes
+    arrays["player"] = player
+    
+    for field in RESULT_FIELDS:
+        column = map(itemgetter(field), values)
+        if field == "special":
+            column, dtype = map(SPECIAL_CODES.get, column), np.int8
+        elif field == "position":
+            dtype = np.int64
+        else:
+            dtype = np.float64
+        table = np.zeros((game_count, MAX_SEATS), dtype=dtype)
+        table[game_index, seat_index] = np.fromiter(column, dtype=dtype, count=len(values))
+        arrays[field] = table
+    return arrays
+
+def _rule_columns(player_count, rules):
+    """ゲームごとのルールの値（持ち点・ウマ表・レート・役満祝儀）の配列"""
+    game_count = len(player_count)
+    base_score = np.zeros(game_count)
+    uma = np.zeros((game_count, MAX_SEATS))
+    rate = np.zeros(game_count)
+    bonus = np.zeros(game_count)
+    penalty = np.zeros(game_count)
+    for count, rule in rules.items():
+        mask = player_count == count
+        base_score[mask] = rule.base_score
+        uma[mask] = np.pad(np.asarray(rule.uma, dtype=np.float64) * 1000, (0, MAX_SEATS - len(rule.uma)))
+        rate[mask] = rule.rate
+        bonus[mask] = rule.yakuman_bonus
+        penalty[mask] = abs(rule.yakuman_penalty)
+    
+    unknown = ~np.isin(player_count, list(rules))
+    if unknown.any():
+        raise ValueError(f"計算ルールのない人数のゲームがあります: {sorted(set(player_count[unknown].tolist()))}人")
+    return base_score, uma, rate, bonus, penalty
+
+def rescore(arrays, rules):
+    """全ゲームの score_diff・confirmed_value の再計算（rules: 人数→ScoringRules）
+    
+    順位は点数だけで決まるためルールを変えても変わらず、記録済みの順位をそのまま使う。
+    計算は ScoringRules.confirmed_value と同じ順序で行うため、1ゲームずつ計算した値と一致する。
+    戻り値は（score_diff, confirmed_value）の「ゲーム×席」の配列（空席は0）。
+    """
+    base_score, uma, rate, bonus, penalty = _rule_columns(arrays["player_count"], rules)
+    seated = arrays["player"] >= 0
+    
+    # ウマは順位で引く（空席は順位0のため0にする）
+    position = np.where(seated, arrays["position"] - 1, 0)
+    uma_points = np.take_along_axis(uma, position, axis=1)
+    score_diff = np.where(seated, arrays["score"] - base_score[:, None] + uma_points, 0.0)
+    
+    # 役満祝儀（+は祝儀、-は減点の絶対値を掛ける）
+    yakuman = arrays["yakuman"]
+    unit = np.where(yakuman > 0, bonus[:, None], penalty[:, None])
+    adjustment = yakuman * unit * 1000 * rate[:, None]
+    confirmed_value = np.where(seated, (score_diff + adjustment) * rate[:, None] / 10, 0.0)
+    return score_diff, confirmed_value
+
+def player_totals(arrays, score_diff=None, confirmed_value=None):
+    """プレイヤー別の集計（new_player_stats と同じ列のDataFrame、行はプレイヤー名）
+    
+    score_diff・confirmed_value を省略した場合は記録済みの値で集計する。
+    """
+    if score_diff is None:
+        score_diff = arrays["score_diff"]
+    if confirmed_value is None:
+        confirmed_value = arrays["confirmed_value"]
+    
+    players = arrays["players"]
+    size = len(players)
+    seated = arrays["player"] >= 0
+    player = arrays["player"][seated]
+    
+    totals = pd.DataFrame(0, index=pd.Index(players, dtype=object), columns=list(new_player_stats()))
+    totals["総合勝ち得点"] = _integral(np.bincount(player, weights=score_diff[seated], minlength=size))
+    totals["確定値"] = np.bincount(player, weights=confirmed_value[seated], minlength=size)
+    
+    # 順位ごとの回数（プレイヤー×順位の表を1回の集計で作る）
+    position = arrays["position"][seated]
+    ranks = np.bincount(player * MAX_SEATS + position - 1, minlength=size * MAX_SEATS).reshape(size, MAX_SEATS)
+    for index in range(MAX_SEATS):
+        totals[f"{index + 1}位"] = ranks[:, index]
+    
+    special = arrays["special"][seated]
+    for name, code in SPECIAL_CODES.items():
+        if name in totals.columns:
+            totals[name] = np.bincount(player[special == code], minlength=size)
+    
+    # 役満記録（+の場合のみカウント）
+    yakuman = arrays["yakuman"][seated]
+    totals["役満"] = _integral(np.bincount(player, weights=np.maximum(yakuman, 0), minlength=size))
+    return totals
+
+def _integral(values):
+    """全て整数値の配列は整数型にする（JSONに小数点付きで保存しないため）"""
+    if np.array_equal(values, np.round(values)):
+        return values.astype(np.int64)
+    return values
+
+def write_back(arrays, score_diff, confirmed_value):
+    """再計算した score_diff・confirmed_value を読み込み元のゲーム記録へ書き戻す"""
+    seats = (arrays["game_index"], arrays["seat_index"])
+    score_diffs = _integral(score_diff[seats]).tolist()
+    confirmed_values = confirmed_value[seats].tolist()
+    for game_data, diff, value in zip(arrays["entries"], score_diffs, confirmed_values):
+        game_data["score_diff"] = diff
+        game_data["confirmed_value"] = value
+
+def rescore_history(history, rules):
+    """対戦履歴の全ゲームを新しいルールで計算し直す（ゲーム記録は書き換える）
+    
+    rules: 人数→ScoringRules。戻り値はプレイヤー別の「総合勝ち得点」「確定値」の増減（DataFrame）。
+    """
+    arrays = history_arrays(history)
+    score_diff, confirmed_value = rescore(arrays, rules)
+    
+    before = player_totals(arrays)
+    after = player_totals(arrays, score_diff, confirmed_value)
+    write_back(arrays, score_diff, confirmed_value)
+    
+    columns = ["総合勝ち得点", "確定値"]
+    return after[columns] - before[columns]
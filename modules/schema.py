@@ -0,0 +1,72 @@
+"""
+スキーマモジュール - 保存データのスキーマバージョンと記録ごとの移行
+
+保存ファイルの "version" が現在のスキーマより古い場合、読み込み時に記録（ゲーム記録・
+プレイヤー統計）ごとに移行処理を順に適用し、以降の処理では全項目がそろった形を前提にする。
+"""
+from .aggregation import new_player_stats
+from .records import normalize_game
+
+# 現在のスキーマバージョン（保存ファイルの "version"）
+SCHEMA_VERSION = "2.0"
+
+# "version" のないファイルのスキーマバージョン
+INITIAL_VERSION = "1.0"
+
+# プレイヤー別結果の全項目と既定値
+RESULT_DEFAULTS = {
+    "score": 0, "score_diff": 0, "position": 1,
+    "yakuman": 0, "special": "なし", "confirmed_value": 0,
+}
+
+# 移行処理の一覧:（記録の種類, 移行元のバージョン）→（移行先のバージョン, 変換関数）
+_MIGRATIONS = {}
+
+def migration(kind, from_version, to_version):
+    """移行処理の登録（変換関数は移行済みの記録に適用しても内容が変わらないこと）"""
+    def register(upgrade):
+        _MIGRATIONS[(kind, from_version)] = (to_version, upgrade)
+        return upgrade
+    return register
+
+@migration("game", "1.0", "2.0")
+def _upgrade_game_v1(record, index):
+    """ゲーム記録をID付きの形式にし、プレイヤー別結果の全項目をそろえる"""
+    record = normalize_game(record, index)
+    results = {
+        player: {**RESULT_DEFAULTS, **game_data}
+        for player, game_data in record["results"].items()
+    }
+    return dict(record, results=results)
+
+@migration("player_stats", "1.0", "2.0")
+def _upgrade_player_stats_v1(player_stats, index):
+    """プレイヤー統計の全項目をそろえる"""
+    return {**new_player_stats(), **player_stats}
+
+def schema_version(data):
+    """保存データのスキーマバージョン"""
+    if isinstance(data, dict):
+        return data.get("version", INITIAL_VERSION)
+    return INITIAL_VERSION
+
+def migrate(kind, record, version, index=0):
+    """1件の記録を現在のスキーマへ移行（index は履歴中の位置、旧形式のゲームID用）"""
+    while version != SCHEMA_VERSION:
+        if (kind, version) not in _MIGRATIONS:
+            raise ValueError(f"未対応のスキーマバージョンです: {kind} {version}")
+        version, upgrade = _MIGRATIONS[(kind, version)]
+        record = upgrade(record, index)
+    return record
+
+def migrate_history(history, version):
+    """対戦履歴の全ゲームを現在のスキーマへ移行（現在のスキーマならそのまま）"""
+    if version == SCHEMA_VERSION:
+        return history
+    return [migrate("game", record, version, index) for index, record in enumerate(history)]
+
+def migrate_stats(stats, version):
+    """全プレイヤーの統計を現在のスキーマへ移行（現在のスキーマならそのまま）"""
+    if version == SCHEMA_VERSION:
+        return stats
+    return {player: migrate("player_stats", player_stats, version) for player, player_stats in stats.items()}
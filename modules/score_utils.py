@@ -3,7 +3,37 @@
 """
 import streamlit as st
 import pandas as pd
-from .data_storage import auto_save
+from datetime import datetime
+from .data_storage import (
+    auto_save, persist_game_added, persist_game_removed, persist_game_inserted, persist_game_replaced,
+    persist_history_rewritten, mark_stats_changed, stats_version
+)
+from .aggregation import apply_game, new_player_stats
+from .lazy_history import LazyHistory
+from .records import make_game_record, insert_after
+from .scoring import rules_from_settings, score_game
+from .rescoring import rescore_history, history_arrays, player_totals
+from .derived_stats import (
+    adopt_ledger, add_session_game, rebase, fold_history, verify, session_stats_from_history,
+    locate_game, detach_game, attach_game, rename_game, apply_to_side, baseline_games, shift_baseline, settle
+)
+from .export import iter_stats_csv, iter_history_csv, iter_history_jsonl
+
+# 元に戻せる操作（記録・修正・削除）の件数
+UNDO_LIMIT = 50
+
+# 操作の表示名
+OPERATION_LABELS = {"add": "ゲームの記録", "delete": "ゲームの削除", "edit": "ゲームの修正"}
+
+# 順位の回数の列と、平均順位の計算に使う順位の値
+RANK_COLUMNS = ["1位", "2位", "3位", "4位"]
+RANK_WEIGHTS = [1, 2, 3, 4]
+
+# ルールを変えて計算し直すと変わる統計の項目
+RESCORED_COLUMNS = ["総合勝ち得点", "確定値"]
+
+# 統計表に表示する列
+STATS_DISPLAY_COLUMNS = ["プレイヤー", "得点", "確定値", "1位", "2位", "3位", "4位", "1位率", "2位率", "3位率", "跳ばし", "跳び", "役満"]
 
 def calculate_score_difference(scores, base_score=25000):
     """点数差の計算"""
@@ -23,33 +53,25 @@ def update_player_stats(player, score_diff, position, yakuman_count=0, uma_score
     # 基本点数差（ウマ・オカを含む最終スコア）
     final_score = score_diff + uma_score
     
-    # 役満祝儀による追加得点計算
-    yakuman_bonus = 0
-    if yakuman_count > 0:
-        yakuman_bonus_value = st.session_state.get("yakuman_bonus", 40)
-        yakuman_bonus = yakuman_count * yakuman_bonus_value * 1000 * st.session_state.rate
-    elif yakuman_count < 0:
-        yakuman_penalty_value = st.session_state.get("yakuman_penalty", 20)
-        yakuman_bonus = yakuman_count * yakuman_penalty_value * 1000 * st.session_state.rate
-    
     # 基本統計更新（得点はレート影響なし）
     st.session_state.stats[player]["総合勝ち得点"] += final_score
     st.session_state.stats[player][f"{position}位"] += 1
     
-    # 確定値（レート×点数÷10の計算）
-    confirmed_value = (final_score * st.session_state.rate + yakuman_bonus) / 10
-    st.session_state.stats[player]["確定値"] += confirmed_value
+    # 確定値（記録時と同じ計算）
+    st.session_state.stats[player]["確定値"] += current_rules().confirmed_value(final_score, yakuman_count)
     
     # 役満回数の更新（+1の場合のみカウント）
     if yakuman_count > 0:
         st.session_state.stats[player]["役満"] += yakuman_count
+    mark_stats_changed()
     
     # 跳ばし/跳び判定は特殊フラグで処理するため、ここでは削除
 
 def validate_scores(scores):
     """スコアの妥当性チェック"""
     total = sum(scores.values())
-    expected_total = len(scores) * 25000
+    # 四麻は25000点、三麻は35000点持ち
+    expected_total = len(scores) * (25000 if len(scores) == 4 else 35000)
     
     return {
         'is_valid': abs(total - expected_total) < 100,  # 100点の誤差を許容
@@ -63,20 +85,66 @@ def create_stats_dataframe():
     if not st.session_state.stats:
         return pd.DataFrame()
     
-    df_data = []
-    for player, stats in st.session_state.stats.items():
-        row = {"プレイヤー": player}
-        row.update(stats)
-        df_data.append(row)
+    # 順位付け（総合勝ち得点順、1から始まる順位）
+    df = stats_frame(st.session_state.stats)[list(new_player_stats())]
+    df = df.sort_values("総合勝ち得点", ascending=False, kind="stable").reset_index()
+    df.index += 1
+    return df
+
+def stats_frame(stats):
+    """統計（プレイヤー→項目）からプレイヤー別の表を作成（行はプレイヤー名、列単位で計算）
     
-    df = pd.DataFrame(df_data)
+    統計の項目に加えて 総ゲーム数・1位率〜4位率（%）・平均順位 の列を持つ。
+    ゲーム数が0のプレイヤーの率・平均順位は0。値の書式は表示時に指定する。
+    """
+    columns = list(new_player_stats())
+    frame = pd.DataFrame.from_dict(stats, orient="index").reindex(columns=columns, fill_value=0)
+    frame.index = pd.Index(frame.index, dtype=object, name="プレイヤー")
+    frame = frame.fillna(0)
     
-    # 順位付け（総合勝ち得点順）
-    if not df.empty:
-        df = df.sort_values("総合勝ち得点", ascending=False).reset_index(drop=True)
-        df.index += 1  # 1から始まる順位
+    ranks = frame[RANK_COLUMNS]
+    total_games = ranks.sum(axis=1)
+    divisor = total_games.where(total_games > 0)
+    frame["総ゲーム数"] = total_games
+    for column in RANK_COLUMNS:
+        frame[f"{column}率"] = (frame[column] / divisor * 100).fillna(0)
+    frame["平均順位"] = (ranks @ RANK_WEIGHTS / divisor).fillna(0)
+    return frame
+
+def build_stats_tables(stats):
+    """統計から表示用の表・グラフの系列を作成
     
-    return df
+    戻り値の辞書: frame（stats_frame の表、得点の高い順、プレイヤーは列）、display（統計表）、
+    active（ゲーム記録のあるプレイヤー）、charts（グラフの系列、項目名→プレイヤー別の値）。
+    表の値は数値のまま持ち、書式は表示時に指定する。
+    """
+    if not stats:
+        return {"frame": pd.DataFrame(), "display": pd.DataFrame(), "active": pd.DataFrame(), "charts": {}}
+    
+    # 得点でソート
+    df = stats_frame(stats).sort_values("総合勝ち得点", ascending=False, kind="stable")
+    
+    # フィルタ：ゲーム数が0より多いプレイヤーのみ
+    active = df[df["総ゲーム数"] > 0]
+    charts = {
+        "総合勝ち得点": active["総合勝ち得点"],
+        "確定値": active["確定値"],
+        "1位率": active["1位率"],
+        "2位率": active["2位率"],
+        "3位率": active["3位率"],
+        "順位分布": active[RANK_COLUMNS],
+    }
+    display = df.rename(columns={"総合勝ち得点": "得点"}).reset_index()[STATS_DISPLAY_COLUMNS]
+    return {"frame": df.reset_index(), "display": display, "active": active.reset_index(), "charts": charts}
+
+def stats_tables():
+    """統計の表・グラフの系列（統計の変更カウンタが変わった時だけ作り直し、セッションごとに1組だけ保持）"""
+    version = stats_version()
+    memo = st.session_state.get("stats_tables")
+    if memo is None or memo["version"] != version:
+        memo = dict(build_stats_tables(st.session_state.get("stats", {})), version=version)
+        st.session_state.stats_tables = memo
+    return memo
 
 def format_score(score):
     """スコアのフォーマット"""
@@ -87,13 +155,27 @@ def format_score(score):
 
 def export_stats_to_csv():
     """統計データのCSVエクスポート"""
-    df = create_stats_dataframe()
-    if not df.empty:
-        return df.to_csv(index=True, index_label="順位").encode('utf-8-sig')
+    if st.session_state.stats:
+        return "".join(iter_stats_csv(st.session_state.stats)).encode('utf-8-sig')
     return None
 
-def record_game(scores, special_flags=None, yakuman_counts=None):
-    """ゲーム結果の記録"""
+def export_history_download(format="csv"):
+    """対戦履歴のダウンロード用データ生成関数（ボタンを押した時に逐次出力から生成）"""
+    # 生成は別スレッドで行われるため、セッションの内容は呼び出し時点で取り出しておく
+    history = st.session_state.get("history", [])
+    if isinstance(history, list):
+        history = list(history)
+    
+    if format == "jsonl":
+        return lambda: "".join(iter_history_jsonl(history)).encode('utf-8')
+    return lambda: "".join(iter_history_csv(history)).encode('utf-8-sig')
+
+def current_rules(player_count=None):
+    """セッションの設定から計算ルールを作成（人数省略時は現在のプレイヤー数）"""
+    return rules_from_settings(st.session_state, player_count or len(st.session_state.players))
+
+def record_game(scores, special_flags=None, yakuman_counts=None, results=None):
+    """ゲーム結果の記録（results は画面のプレビューで計算済みの score_game の結果）"""
     # プレイヤーの存在確認と統計初期化
     for player in scores.keys():
         if player not in st.session_state.stats:
@@ -102,34 +184,6 @@ def record_game(scores, special_flags=None, yakuman_counts=None):
                 "跳ばし": 0, "跳び": 0, "役満": 0, "確定値": 0
             }
     
-    # 順位計算
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    ranks = {}
-    for i, (player, score) in enumerate(sorted_scores):
-        ranks[player] = i + 1
-    
-    # ウマ・オカの計算
-    uma_scores = calculate_uma_scores(scores, ranks)
-    
-    # 基本点数の設定
-    base_score = 25000 if len(st.session_state.players) == 4 else 35000
-    rate = st.session_state.get("rate", 1.0)
-    
-    # 各プレイヤーの統計更新
-    for player in scores:
-        # 基本点数差
-        score_diff = scores[player] - base_score
-        position = ranks[player]
-        uma_score = uma_scores[player]
-        
-        # 役満祝儀の回数
-        yakuman_count = yakuman_counts.get(player, 0) if yakuman_counts else 0
-        
-        # 特殊フラグの処理用の今回の戦績更新（総合統計には反映しない）
-        if special_flags and player in special_flags:
-            flag = special_flags[player]
-            # 今回の戦績に特殊フラグを記録（必要に応じて後で実装）
-    
     # 履歴に追加
     if "history" not in st.session_state:
         st.session_state.history = []
@@ -138,90 +192,31 @@ def record_game(scores, special_flags=None, yakuman_counts=None):
     if "current_session_stats" not in st.session_state:
         st.session_state.current_session_stats = {}
     
-    # 履歴記録用のゲームデータ
-    game_record = {}
-    
-    # 各プレイヤーのゲーム記録を作成
-    for player in scores:
-        score_diff = scores[player] - base_score
-        position = ranks[player]
-        uma_score = uma_scores[player]
-        yakuman_count = yakuman_counts.get(player, 0) if yakuman_counts else 0
-        special_flag = special_flags.get(player, "なし") if special_flags else "なし"
-        
-        # 役満祝儀による追加得点計算
-        yakuman_bonus = 0
-        if yakuman_count > 0:
-            yakuman_bonus_value = st.session_state.get("yakuman_bonus", 40)
-            yakuman_bonus = yakuman_count * yakuman_bonus_value * 1000 * rate
-        elif yakuman_count < 0:
-            yakuman_penalty_value = st.session_state.get("yakuman_penalty", -20)
-            yakuman_bonus = yakuman_count * abs(yakuman_penalty_value) * 1000 * rate
-        
-        # 確定値計算
-        final_score = score_diff + uma_score
-        confirmed_value = (final_score + yakuman_bonus) * rate / 10
-        
-        # ゲーム記録に追加
-        game_record[player] = {
-            'score': scores[player],
-            'score_diff': final_score,
-            'position': position,
-            'yakuman': yakuman_count,
-            'special': special_flag,
-            'confirmed_value': confirmed_value
-        }
-        
-        # 今回の戦績統計を更新
-        if player not in st.session_state.current_session_stats:
-            st.session_state.current_session_stats[player] = {
-                '1位': 0, '2位': 0, '3位': 0, '4位': 0,
-                '総合勝ち得点': 0, '役満': 0, '跳ばし': 0, '跳び': 0, '確定値': 0
-            }
-        
-        st.session_state.current_session_stats[player][f"{position}位"] += 1
-        st.session_state.current_session_stats[player]["総合勝ち得点"] += final_score
-        st.session_state.current_session_stats[player]["確定値"] += confirmed_value
-        
-        if special_flag == "跳ばし":
-            st.session_state.current_session_stats[player]["跳ばし"] += 1
-        elif special_flag == "跳び":
-            st.session_state.current_session_stats[player]["跳び"] += 1
-        
-        if yakuman_count > 0:
-            st.session_state.current_session_stats[player]["役満"] += yakuman_count
+    if results is None:
+        results = score_game(scores, special_flags, yakuman_counts, current_rules(len(scores)))
+    
+    # ゲームIDと記録日時を付けて記録（ゲームIDは複数プロセスでの保存時の統合に使う）
+    game_record = make_game_record(results, timestamp=datetime.now().isoformat(timespec="seconds"))
+    
+    # 今回の戦績統計を更新
+    ledger = stats_ledger()
+    apply_game(st.session_state.current_session_stats, game_record)
+    add_session_game(ledger, game_record)
+    mark_stats_changed()
     
     st.session_state.history.append(game_record)
     
+    # 追記型の保存方式では1ゲーム分のみ書き込む
+    persist_game_added(game_record)
+    _record_operation({"op": "add", "game": game_record})
+    
     # データの自動保存
     auto_save()
 
 def calculate_uma_scores(scores, ranks):
     """ウマ・オカのスコア計算"""
-    uma_scores = {}
-    
-    if len(st.session_state.players) == 4:
-        # 四麻のウマ設定（個別設定値を使用）
-        uma_1st = st.session_state.get("uma_1st", 10)
-        uma_2nd = st.session_state.get("uma_2nd", 5)
-        uma_3rd = st.session_state.get("uma_3rd", -5)
-        uma_4th = st.session_state.get("uma_4th", -10)
-        
-        uma_values = {1: uma_1st, 2: uma_2nd, 3: uma_3rd, 4: uma_4th}
-    else:
-        # 三麻のウマ設定
-        uma_1st = st.session_state.get("uma_1st_sanma", 15)
-        uma_2nd = st.session_state.get("uma_2nd_sanma", -5)
-        uma_3rd = st.session_state.get("uma_3rd_sanma", -10)
-        
-        uma_values = {1: uma_1st, 2: uma_2nd, 3: uma_3rd}
-    
-    # 各プレイヤーにウマ・オカを適用
-    for player, score in scores.items():
-        rank = ranks[player]
-        uma_scores[player] = uma_values[rank] * 1000  # ウマは千点単位
-    
-    return uma_scores
+    rules = current_rules(len(scores))
+    return {player: rules.uma_points(ranks[player]) for player in scores}
 
 
 def undo_last_game():
@@ -229,49 +224,353 @@ def undo_last_game():
     if not hasattr(st.session_state, 'history') or not st.session_state.history:
         return False, "取り消すゲーム記録がありません"
     
-    # 最後のゲーム記録を取得
-    last_game = st.session_state.history.pop()
-    
-    # 統計から最後のゲームの結果を減算
-    for player, game_data in last_game.items():
-        if player in st.session_state.stats:
-            # 順位統計を減算
-            position = game_data.get('position', 1)
-            st.session_state.stats[player][f"{position}位"] -= 1
-            
-            # 得点を減算
-            st.session_state.stats[player]["総合勝ち得点"] -= game_data.get('score_diff', 0)
-            st.session_state.stats[player]["確定値"] -= game_data.get('confirmed_value', 0)
-            
-            # 特殊記録を減算
-            if game_data.get('special') == '跳ばし':
-                st.session_state.stats[player]["跳ばし"] -= 1
-            elif game_data.get('special') == '跳び':
-                st.session_state.stats[player]["跳び"] -= 1
-            
-            # 役満記録を減算
-            yakuman_count = game_data.get('yakuman', 0)
-            if yakuman_count > 0:
-                st.session_state.stats[player]["役満"] -= yakuman_count
-    
-    # 今回の戦績からも減算
-    if hasattr(st.session_state, 'current_session_stats'):
-        for player, game_data in last_game.items():
-            if player in st.session_state.current_session_stats:
-                position = game_data.get('position', 1)
-                st.session_state.current_session_stats[player][f"{position}位"] -= 1
-                st.session_state.current_session_stats[player]["総合勝ち得点"] -= game_data.get('score_diff', 0)
-                
-                if game_data.get('special') == '跳ばし':
-                    st.session_state.current_session_stats[player]["跳ばし"] -= 1
-                elif game_data.get('special') == '跳び':
-                    st.session_state.current_session_stats[player]["跳び"] -= 1
-                
-                yakuman_count = game_data.get('yakuman', 0)
-                if yakuman_count > 0:
-                    st.session_state.current_session_stats[player]["役満"] -= yakuman_count
-    
-    # データを保存
+    success, message = delete_game(st.session_state.history[-1]["id"])
+    return success, "直近のゲーム記録を取り消しました" if success else message
+
+def game_label(game_record):
+    """ゲーム記録の表示名（記録日時とプレイヤー）"""
+    timestamp = game_record.get("timestamp", "").replace("T", " ")
+    return f"{timestamp} {'・'.join(game_record['results'])}".strip()
+
+def delete_game(game_id):
+    """ゲーム記録の削除（統計からは1ゲーム分のみ減算）"""
+    removal = _remove_game(game_id)
+    if removal is None:
+        return False, "削除するゲーム記録が見つかりません"
+    _record_operation({"op": "delete", "game": removal["game"], "removal": removal})
     auto_save()
     
-    return True, "直近のゲーム記録を取り消しました"
+    message = f"ゲーム記録を削除しました（{game_label(removal['game'])}）"
+    if removal["side"] == "reset":
+        message += "。統計リセット前のゲームのため、統計は変わりません"
+    return True, message
+
+def edit_game(game_id, scores, special_flags=None, yakuman_counts=None):
+    """記録済みのゲームの修正（現在のルールで計算し直し、統計は修正前との差分のみ反映）
+    
+    修正した記録には新しいゲームIDを付け、記録日時と記録順の位置は変えない。
+    """
+    history = st.session_state.get("history", [])
+    found = locate_game(history, stats_ledger(), game_id)
+    if found is None:
+        return False, "修正するゲーム記録が見つかりません"
+    
+    before = history[found[0]]
+    results = score_game(scores, special_flags, yakuman_counts, current_rules(len(scores)))
+    after = make_game_record(results, timestamp=before.get("timestamp"))
+    _replace_game(game_id, after)
+    _record_operation({"op": "edit", "game": after, "before": before, "after": after})
+    auto_save()
+    return True, f"ゲーム記録を修正しました（{game_label(after)}）"
+
+def undo_operation():
+    """直前の操作（記録・修正・削除）を元に戻す"""
+    undo_stack = st.session_state.get("history_undo", [])
+    if not undo_stack:
+        return False, "元に戻す操作がありません"
+    
+    operation = undo_stack.pop()
+    if not _apply_operation(operation, forward=False):
+        return False, "対象のゲーム記録が見つからないため、元に戻せませんでした"
+    st.session_state.setdefault("history_redo", []).append(operation)
+    auto_save()
+    return True, f"{OPERATION_LABELS[operation['op']]}を元に戻しました（{game_label(operation['game'])}）"
+
+def redo_operation():
+    """元に戻した操作のやり直し"""
+    redo_stack = st.session_state.get("history_redo", [])
+    if not redo_stack:
+        return False, "やり直す操作がありません"
+    
+    operation = redo_stack.pop()
+    if not _apply_operation(operation, forward=True):
+        return False, "対象のゲーム記録が見つからないため、やり直せませんでした"
+    st.session_state.setdefault("history_undo", []).append(operation)
+    auto_save()
+    return True, f"{OPERATION_LABELS[operation['op']]}をやり直しました（{game_label(operation['game'])}）"
+
+def _record_operation(operation):
+    """元に戻せる操作として記録（新しい操作をした時点でやり直せる操作は破棄）"""
+    undo_stack = st.session_state.setdefault("history_undo", [])
+    undo_stack.append(operation)
+    del undo_stack[:-UNDO_LIMIT]
+    st.session_state.history_redo = []
+
+def _clear_operations():
+    """元に戻せる操作の破棄（全ゲームを書き換えた後は、記録した操作の内容と一致しないため）"""
+    st.session_state.history_undo = []
+    st.session_state.history_redo = []
+
+def _apply_operation(operation, forward):
+    """操作の適用（forward=False で元に戻す）、対象のゲームがない場合はFalse"""
+    kind = operation["op"]
+    if kind == "edit":
+        source, target = (operation["before"], operation["after"]) if forward else (operation["after"], operation["before"])
+        return _replace_game(source["id"], target) is not None
+    
+    if (kind == "add") == forward:
+        # 記録のやり直し・削除の取り消しは、取り除いた時の位置と集計先に戻す
+        _insert_game(operation["removal"])
+        return True
+    removal = _remove_game(operation["game"]["id"])
+    if removal is None:
+        return False
+    operation["removal"] = removal
+    return True
+
+def _remove_game(game_id):
+    """ゲーム記録を取り除いて集計先の統計から減算（1ゲーム分の処理のみ）
+    
+    戻り値は元に戻すための情報（ゲーム・直前のゲームID・集計先・そのゲームを指していた基準時点の項目）、
+    ゲームが見つからなければNone。
+    """
+    history = st.session_state.get("history", [])
+    ledger = stats_ledger()
+    found = locate_game(history, ledger, game_id)
+    if found is None:
+        return None
+    
+    index, side = found
+    previous_id = history[index - 1]["id"] if index else None
+    game_record = history.pop(index)
+    
+    # 追記型の保存方式では取り消しのみ書き込む
+    persist_game_removed(game_record)
+    
+    # 未清算のゲームは今回の戦績から、清算済みのゲームは総合統計（基準値に集計済みなら基準値も）から減算
+    # （統計リセット前のゲームは統計に含まれていないため減算しない）
+    markers = detach_game(ledger, game_id, side, previous_id)
+    apply_to_side(ledger, st.session_state.stats, st.session_state.setdefault("current_session_stats", {}), side, game_record, -1)
+    mark_stats_changed()
+    return {"game": game_record, "previous_id": previous_id, "side": side, "markers": markers}
+
+def _insert_game(removal):
+    """取り除いたゲーム記録を元の位置に戻し、取り除く前の集計先の統計へ加算"""
+    history = st.session_state.setdefault("history", [])
+    game_record = removal["game"]
+    if isinstance(history, LazyHistory):
+        history.insert_after(removal["previous_id"], game_record)
+    else:
+        insert_after(history, removal["previous_id"], game_record)
+    persist_game_inserted(game_record, removal["previous_id"])
+    
+    ledger = stats_ledger()
+    attach_game(ledger, game_record["id"], removal["side"], removal["markers"])
+    apply_to_side(ledger, st.session_state.stats, st.session_state.setdefault("current_session_stats", {}), removal["side"], game_record)
+    mark_stats_changed()
+
+def _replace_game(game_id, game_record):
+    """ゲーム記録の置き換え（集計先の統計は置き換え前を減算・置き換え後を加算）
+    
+    戻り値は置き換え前の記録、ゲームが見つからなければNone。
+    """
+    history = st.session_state.get("history", [])
+    ledger = stats_ledger()
+    found = locate_game(history, ledger, game_id)
+    if found is None:
+        return None
+    
+    index, side = found
+    before = history[index]
+    history[index] = game_record
+    persist_game_replaced(game_id, game_record)
+    
+    rename_game(ledger, game_id, game_record["id"])
+    stats = st.session_state.stats
+    session_stats = st.session_state.setdefault("current_session_stats", {})
+    apply_to_side(ledger, stats, session_stats, side, before, -1)
+    apply_to_side(ledger, stats, session_stats, side, game_record)
+    mark_stats_changed()
+    return before
+
+def rescore_all_games():
+    """現在のルール設定で対戦履歴の全ゲームを計算し直し、総合統計・今回の戦績を集計し直す
+    
+    基準値に集計済みのゲーム（台帳のない保存データから引き継いだ清算済みのゲームなど）は、
+    計算し直した増減を基準値に加える。統計リセット前・統計を削除したプレイヤーのゲームは
+    統計に含まれていないため、統計には反映しない。
+    """
+    history = st.session_state.get("history", [])
+    if not history:
+        return False, "再計算するゲーム記録がありません"
+    
+    if isinstance(history, LazyHistory):
+        # 月別保存では全シャードを読み込んでから書き換える
+        history.load_all()
+    
+    ledger = stats_ledger()
+    try:
+        counted = baseline_games(history, ledger)
+    except ValueError:
+        counted = []
+    before = player_totals(history_arrays(counted))[RESCORED_COLUMNS] if counted else None
+    
+    changes = rescore_history(history, {count: current_rules(count) for count in (3, 4)})
+    if counted:
+        delta = player_totals(history_arrays(counted))[RESCORED_COLUMNS] - before
+        columns = [delta[column].tolist() for column in RESCORED_COLUMNS]
+        shift_baseline(ledger, {
+            player: dict(zip(RESCORED_COLUMNS, values)) for player, *values in zip(delta.index, *columns)
+        })
+    try:
+        stats, session_stats = fold_history(history, ledger)
+    except ValueError:
+        # 集計台帳が対戦履歴と整合しない場合は、増減のみ総合統計に反映
+        for player, score_change, value_change in zip(changes.index, changes["総合勝ち得点"].tolist(), changes["確定値"].tolist()):
+            player_stats = st.session_state.stats.setdefault(player, new_player_stats())
+            player_stats["総合勝ち得点"] += score_change
+            player_stats["確定値"] += value_change
+        mark_stats_changed()
+    else:
+        _replace_stats(stats, session_stats)
+    
+    persist_history_rewritten()
+    _clear_operations()
+    auto_save()
+    
+    return True, f"{len(history)}ゲームを現在のルールで再計算しました"
+
+def stats_ledger():
+    """集計台帳（統計を対戦履歴から求めるための記録、全セッションで共有して設定とは別に保存）
+    
+    台帳のない保存データでは、現在の統計を基準値として作成する。
+    """
+    ledger = st.session_state.get("stats_ledger")
+    if not ledger:
+        ledger = adopt_ledger(
+            st.session_state.get("history", []),
+            st.session_state.get("stats", {}),
+            st.session_state.get("current_session_stats", {}),
+        )
+        st.session_state.stats_ledger = ledger
+    return ledger
+
+def restore_session_stats():
+    """今回の戦績の復元（保存されていない保存方式で、未清算のゲームから集計し直す）"""
+    ledger = stats_ledger()
+    session_stats = st.session_state.setdefault("current_session_stats", {})
+    if ledger["session"] and not session_stats:
+        session_stats.update(session_stats_from_history(st.session_state.get("history", []), ledger))
+
+def settle_session():
+    """清算（未清算の全ゲームを総合統計に加え、今回の戦績を空にする）
+    
+    今回の戦績ではなく集計台帳の未清算のゲームから集計して加えるため、
+    他のセッションで記録したゲームも清算される。
+    """
+    ledger = stats_ledger()
+    stats = st.session_state.setdefault("stats", {})
+    for player, session_stats in session_stats_from_history(st.session_state.get("history", []), ledger).items():
+        player_stats = stats.setdefault(player, new_player_stats())
+        for key, value in session_stats.items():
+            player_stats[key] = player_stats.get(key, 0) + value
+    settle(ledger)
+    st.session_state.setdefault("current_session_stats", {}).clear()
+    mark_stats_changed()
+
+def rebase_stats(reset=False):
+    """総合統計を直接変更した後（リセット・削除）に、変更後の統計を集計の基準値として記録
+    
+    reset=True（統計リセット）の場合は、それまでのゲームを統計に含まれないものとして記録する。
+    """
+    rebase(stats_ledger(), st.session_state.stats, st.session_state.get("history", []), reset)
+
+def exclude_player_stats(players):
+    """プレイヤーの統計（総合・今回の戦績）の削除（以降の再集計でも集計しない）
+    
+    戻り値は総合統計を削除したプレイヤーの一覧。
+    """
+    ledger = stats_ledger()
+    session_stats = st.session_state.get("current_session_stats", {})
+    deleted = []
+    changed = False
+    for player in players:
+        removed = st.session_state.stats.pop(player, None) is not None
+        if removed:
+            deleted.append(player)
+        if session_stats.pop(player, None) is not None:
+            removed = True
+        if removed:
+            changed = True
+            if player not in ledger["excluded"]:
+                ledger["excluded"].append(player)
+    if changed:
+        rebase_stats()
+        mark_stats_changed()
+    return deleted
+
+def rename_player(current_name, new_name):
+    """プレイヤー名の変更（統計・今回の戦績・対戦履歴の全ゲームの名前を変更）"""
+    stats = st.session_state.stats
+    session_stats = st.session_state.setdefault("current_session_stats", {})
+    if new_name in stats or new_name in session_stats:
+        return False, f"{new_name} の統計が既にあるため、名前を変更できません"
+    
+    ledger = stats_ledger()
+    for player_stats in (stats, session_stats, ledger["baseline"]):
+        if current_name in player_stats:
+            player_stats[new_name] = player_stats.pop(current_name)
+    ledger["excluded"] = [new_name if player == current_name else player for player in ledger["excluded"]]
+    mark_stats_changed()
+    
+    history = st.session_state.get("history", [])
+    if isinstance(history, LazyHistory):
+        history.load_all()
+    renamed = 0
+    for game_record in history:
+        results = game_record["results"]
+        if current_name in results:
+            game_record["results"] = {
+                (new_name if player == current_name else player): game_data
+                for player, game_data in results.items()
+            }
+            renamed += 1
+    if renamed:
+        persist_history_rewritten()
+        _clear_operations()
+    return True, f"{current_name} を {new_name} に変更しました"
+
+def verify_stats():
+    """保存済みの統計（総合・今回の戦績）と対戦履歴からの集計の照合
+    
+    戻り値は（総合統計, 今回の戦績）それぞれの差分の一覧の辞書。
+    """
+    history = st.session_state.get("history", [])
+    return verify(
+        history, stats_ledger(),
+        st.session_state.get("stats", {}), st.session_state.get("current_session_stats", {})
+    )[1]
+
+def repair_stats(rebuild=False):
+    """統計を対戦履歴からの集計で置き換える
+    
+    rebuild=True の場合は基準値（統計リセット・削除の時点の統計）を使わず、全ゲームから集計する。
+    """
+    ledger = stats_ledger()
+    if rebuild:
+        ledger.update(baseline={}, baseline_through=None, baseline_after=None, excluded=[])
+    try:
+        stats, session_stats = fold_history(st.session_state.get("history", []), ledger)
+    except ValueError as e:
+        return False, str(e)
+    
+    _replace_stats(stats, session_stats)
+    auto_save()
+    return True, "統計を対戦履歴から集計し直しました"
+
+def _replace_stats(stats, session_stats):
+    """総合統計・今回の戦績の内容の置き換え（共有している統計・今回の戦績の辞書はそのまま使う）
+    
+    総合統計にあった清算済みのゲームのないプレイヤーは、0件の統計として残す。
+    """
+    current = st.session_state.setdefault("stats", {})
+    excluded = stats_ledger()["excluded"]
+    for player in current:
+        if player not in excluded:
+            stats.setdefault(player, new_player_stats())
+    current.clear()
+    current.update(stats)
+    current_session = st.session_state.setdefault("current_session_stats", {})
+    current_session.clear()
+    current_session.update(session_stats)
+    mark_stats_changed()
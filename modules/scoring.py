@@ -0,0 +1,91 @@
+"""
+スコア計算モジュール - ルール設定によるゲーム結果の計算
+
+Streamlitのセッション状態に依存しないため、画面の外（取り込み・一括処理）からも呼び出せる。
+"""
+from dataclasses import dataclass
+
+# ウマ設定のキー（順位順）と既定値
+YONMA_UMA_KEYS = ("uma_1st", "uma_2nd", "uma_3rd", "uma_4th")
+SANMA_UMA_KEYS = ("uma_1st_sanma", "uma_2nd_sanma", "uma_3rd_sanma")
+DEFAULT_UMA = {
+    "uma_1st": 10, "uma_2nd": 5, "uma_3rd": -5, "uma_4th": -10,
+    "uma_1st_sanma": 15, "uma_2nd_sanma": -5, "uma_3rd_sanma": -10,
+}
+
+@dataclass(frozen=True)
+class ScoringRules:
+    """ゲーム結果の計算ルール（作成後は変更しない）"""
+    # 持ち点（四麻25000点・三麻35000点）
+    base_score: int = 25000
+    # 順位ごとのウマ（千点単位、要素数が人数）
+    uma: tuple = (10, 5, -5, -10)
+    rate: float = 1.0
+    # 役満祝儀+1・-1の時の加減点（千点単位、減点は符号を問わない）
+    yakuman_bonus: int = 40
+    yakuman_penalty: int = -20
+
+    @property
+    def player_count(self):
+        """人数"""
+        return len(self.uma)
+
+    @property
+    def expected_total(self):
+        """点数の合計の期待値"""
+        return self.base_score * len(self.uma)
+
+    def uma_points(self, position):
+        """順位のウマ（点）"""
+        return self.uma[position - 1] * 1000
+
+    def yakuman_adjustment(self, yakuman_count):
+        """役満祝儀による追加得点（レート反映済み）"""
+        if yakuman_count > 0:
+            return yakuman_count * self.yakuman_bonus * 1000 * self.rate
+        if yakuman_count < 0:
+            return yakuman_count * abs(self.yakuman_penalty) * 1000 * self.rate
+        return 0
+
+    def confirmed_value(self, final_score, yakuman_count=0):
+        """確定値（ウマ込みの得点と役満祝儀にレートを掛けて÷10）"""
+        return (final_score + self.yakuman_adjustment(yakuman_count)) * self.rate / 10
+
+def rules_from_settings(settings, player_count=4):
+    """設定（セッション状態・保存済みの設定の辞書など）から計算ルールを作成"""
+    uma_keys = YONMA_UMA_KEYS if player_count == 4 else SANMA_UMA_KEYS
+    return ScoringRules(
+        base_score=25000 if player_count == 4 else 35000,
+        uma=tuple(settings.get(key, DEFAULT_UMA[key]) for key in uma_keys),
+        rate=settings.get("rate", 1.0),
+        yakuman_bonus=settings.get("yakuman_bonus", 40),
+        yakuman_penalty=settings.get("yakuman_penalty", -20),
+    )
+
+def rank_players(points):
+    """点数の高い順の順位（同点は入力順）"""
+    ranking = sorted(points, key=points.get, reverse=True)
+    return {player: position for position, player in enumerate(ranking, 1)}
+
+def score_game(points, flags, yakuman, rules):
+    """1ゲーム分のプレイヤー別結果の計算
+
+    points: プレイヤー名→点数（跳び・跳ばし加減後）、flags: プレイヤー名→跳び/跳ばし、
+    yakuman: プレイヤー名→役満祝儀の回数（flags・yakuman は省略可）。
+    戻り値はゲーム記録の results と同じ形式（プレイヤーの並びは points の順）。
+    """
+    positions = rank_players(points)
+    results = {}
+    for player, score in points.items():
+        position = positions[player]
+        yakuman_count = yakuman.get(player, 0) if yakuman else 0
+        final_score = score - rules.base_score + rules.uma_points(position)
+        results[player] = {
+            'score': score,
+            'score_diff': final_score,
+            'position': position,
+            'yakuman': yakuman_count,
+            'special': flags.get(player, "なし") if flags else "なし",
+            'confirmed_value': rules.confirmed_value(final_score, yakuman_count),
+        }
+    return results
@@ -0,0 +1,48 @@
+"""
+共有データストアモジュール - 全セッションで共有する読み込み済みデータの管理
+"""
+import threading
+import streamlit as st
+
+class SharedDataStore:
+    """プロセス内の全セッションで共有するデータストア
+    
+    データはキーごとに1回だけ読み込み、元ファイルのシグネチャ（更新時刻・サイズ）が
+    変わった時だけ読み込み直す。
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+    
+    def get(self, key, signature, loader):
+        """共有データの取得（シグネチャが変わっていれば読み込み直す）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                entry = (signature, loader())
+                self._entries[key] = entry
+            return entry[1]
+    
+    def peek(self, key):
+        """読み込み済みの共有データ（未読み込みならNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[1]
+    
+    def update_signature(self, key, signature):
+        """自プロセスでの書き込み後にシグネチャのみ更新（読み込み直しを避ける）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (signature, entry[1])
+    
+    def clear(self):
+        """共有データの破棄"""
+        with self._lock:
+            self._entries.clear()
+
+@st.cache_resource
+def get_shared_store():
+    """プロセス内で1つの共有データストアを取得"""
+    return SharedDataStore()
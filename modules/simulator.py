@@ -0,0 +1,139 @@
+"""
+ルール比較モジュール - 対戦履歴を複数のルール候補で計算し直した場合の成績の比較
+
+対戦履歴を一度だけ「ゲーム×席」の配列に読み込み、ルール候補（ウマ・レート・役満祝儀・
+跳び/跳ばしの加減点）ごとの成績をプロセスプールのワーカーで配列演算により求める。
+記録済みのゲーム・統計は変更しない。
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .rescoring import MAX_SEATS, SPECIAL_CODES, history_arrays, rescore, player_totals
+from .scoring import rules_from_settings
+
+# 記録済みの点数に含まれる跳び・跳ばしの加減点（点数入力画面の値）
+SPECIAL_POINTS = 10000
+
+# ルール候補を計算するワーカープロセスの数（1以下はプロセスを使わずに計算）
+SIMULATION_WORKERS = int(os.environ.get("MAHJONG_SIMULATION_WORKERS", str(os.cpu_count() or 1)))
+
+# ワーカープロセスに分ける計算量の下限（ゲーム数×ルール候補数）
+# 1プロセスでの計算は1ゲーム・1候補あたり約0.5〜1マイクロ秒で、ワーカーへの配列の受け渡しに
+# 数十ミリ秒、ワーカーの起動（初回のみ）に約0.7秒かかる。これより小さい比較はこのプロセスで計算する。
+SIMULATION_MIN_CELLS = int(os.environ.get("MAHJONG_SIMULATION_MIN_CELLS", "1000000"))
+
+# ワーカーに渡す配列（ゲーム記録への参照は渡さない）
+ARRAY_FIELDS = ("players", "player_count", "player", "score", "position", "yakuman", "special", "score_diff", "confirmed_value")
+
+@dataclass(frozen=True)
+class RuleSet:
+    """比較するルール候補（作成後は変更しない）"""
+    name: str
+    # 人数→ScoringRules
+    rules: dict
+    # 跳び・跳ばしの加減点
+    special_points: int = SPECIAL_POINTS
+
+def rule_set_from_settings(name, settings, special_points=SPECIAL_POINTS):
+    """設定の辞書（ウマ・レート・役満祝儀）からルール候補を作成"""
+    rules = {count: rules_from_settings(settings, count) for count in (3, 4)}
+    return RuleSet(name=name, rules=rules, special_points=special_points)
+
+def adjust_special(arrays, special_points):
+    """跳び・跳ばしの加減点を変えた場合の（点数, 順位）の配列
+    
+    加減点が変わると順位も変わるため、点数の高い順（同点は席順）に順位を付け直す。
+    """
+    if special_points == SPECIAL_POINTS:
+        return arrays["score"], arrays["position"]
+    
+    special = arrays["special"]
+    sign = np.where(special == SPECIAL_CODES["跳ばし"], 1, np.where(special == SPECIAL_CODES["跳び"], -1, 0))
+    score = arrays["score"] + sign * (special_points - SPECIAL_POINTS)
+    
+    seated = arrays["player"] >= 0
+    order = np.argsort(np.where(seated, -score, np.inf), axis=1, kind="stable")
+    position = np.empty_like(order)
+    ranks = np.broadcast_to(np.arange(1, MAX_SEATS + 1), order.shape)
+    np.put_along_axis(position, order, ranks, axis=1)
+    return score, np.where(seated, position, 0)
+
+def evaluate(arrays, rule_set):
+    """1つのルール候補での成績（プレイヤー別の統計と「順位」、確定値の高い順）"""
+    score, position = adjust_special(arrays, rule_set.special_points)
+    variant = dict(arrays, score=score, position=position)
+    score_diff, confirmed_value = rescore(variant, rule_set.rules)
+    
+    standings = player_totals(variant, score_diff, confirmed_value)
+    standings.insert(0, "順位", standings["確定値"].rank(method="min", ascending=False).astype(int))
+    return standings.sort_values("順位", kind="stable")
+
+def _evaluate_chunk(arrays, rule_sets):
+    """ワーカーでの複数のルール候補の計算（配列の受け渡しはワーカーごとに1回）"""
+    return [evaluate(arrays, rule_set) for rule_set in rule_sets]
+
+_executor = None
+
+def _get_executor():
+    """ワーカープロセスのプール（2回目以降の比較では起動済みのプロセスを使う）
+    
+    画面の処理はスレッドで動くため、fork ではなく forkserver（なければ spawn）で起動する。
+    """
+    global _executor
+    if _executor is None:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _executor = ProcessPoolExecutor(max_workers=SIMULATION_WORKERS, mp_context=context)
+    return _executor
+
+def _shutdown_executor():
+    """プールの破棄（ワーカーが異常終了した場合、次回は作り直す）"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def simulate(history, rule_sets, workers=None):
+    """対戦履歴を各ルール候補で計算し直した成績（ルール候補の名前→evaluate の結果）
+    
+    workers: ワーカーの数（省略時は MAHJONG_SIMULATION_WORKERS）。ゲーム数×候補数が
+    SIMULATION_MIN_CELLS 以上の場合のみ、候補をワーカーの数に分けてまとめて渡す。
+    それより小さい比較と、プロセスを起動できない環境ではこのプロセスで計算する。
+    """
+    names = [rule_set.name for rule_set in rule_sets]
+    if len(set(names)) != len(names):
+        raise ValueError("ルール候補の名前が重複しています")
+    if not rule_sets:
+        return {}
+    
+    full = history_arrays(history)
+    arrays = {field: full[field] for field in ARRAY_FIELDS}
+    
+    workers = min(SIMULATION_WORKERS if workers is None else workers, len(rule_sets))
+    if workers <= 1 or len(history) * len(rule_sets) < SIMULATION_MIN_CELLS:
+        return dict(zip(names, _evaluate_chunk(arrays, rule_sets)))
+    
+    chunks = [rule_sets[index::workers] for index in range(workers)]
+    try:
+        executor = _get_executor()
+        futures = [executor.submit(_evaluate_chunk, arrays, chunk) for chunk in chunks]
+        results = {}
+        for chunk, future in zip(chunks, futures):
+            results.update(zip((rule_set.name for rule_set in chunk), future.result()))
+    except (OSError, BrokenProcessPool):
+        _shutdown_executor()
+        return dict(zip(names, _evaluate_chunk(arrays, rule_sets)))
+    return {name: results[name] for name in names}
+
+def compare(results, column="確定値"):
+    """ルール候補ごとの1項目の比較表（行はプレイヤー（最初の候補の順位順）、列はルール候補）"""
+    table = pd.DataFrame({name: standings[column] for name, standings in results.items()})
+    if results:
+        table = table.reindex(next(iter(results.values())).index)
+    return table
@@ -0,0 +1,332 @@
+"""
+SQLiteストレージモジュール - 対戦履歴・統計・集計台帳・設定のSQLite保存
+"""
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from .aggregation import merge_stats
+from .derived_stats import merge_ledger
+from .records import make_game_record, new_game_id
+
+# 統計項目とテーブル列の対応
+STAT_COLUMNS = {
+    "総合勝ち得点": "total_score",
+    "1位": "first",
+    "2位": "second",
+    "3位": "third",
+    "4位": "fourth",
+    "跳ばし": "tobashi",
+    "跳び": "tobi",
+    "役満": "yakuman",
+    "確定値": "confirmed_value",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at TEXT NOT NULL,
+    uid TEXT
+);
+CREATE TABLE IF NOT EXISTS game_results (
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    seat INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    score_diff INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    yakuman INTEGER NOT NULL DEFAULT 0,
+    special TEXT NOT NULL DEFAULT 'なし',
+    confirmed_value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (game_id, seat)
+);
+CREATE INDEX IF NOT EXISTS idx_games_recorded_at ON games(recorded_at);
+CREATE INDEX IF NOT EXISTS idx_game_results_player ON game_results(player);
+CREATE TABLE IF NOT EXISTS player_stats (
+    player TEXT PRIMARY KEY,
+    total_score INTEGER NOT NULL DEFAULT 0,
+    first INTEGER NOT NULL DEFAULT 0,
+    second INTEGER NOT NULL DEFAULT 0,
+    third INTEGER NOT NULL DEFAULT 0,
+    fourth INTEGER NOT NULL DEFAULT 0,
+    tobashi INTEGER NOT NULL DEFAULT 0,
+    tobi INTEGER NOT NULL DEFAULT 0,
+    yakuman INTEGER NOT NULL DEFAULT 0,
+    confirmed_value REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats_ledger (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# 小数を持つ統計項目（他の項目は整数、以前のバージョンではREAL列に保存していた）
+REAL_STATS = ("確定値",)
+
+# スキーマ作成・移行済みのデータベースのパス（プロセスごとに1回だけ行う）
+_initialized_paths = set()
+
+def connect(db_path):
+    """データベース接続（スキーマ作成・移行はデータベースごとに初回の接続時のみ）
+    
+    WALモードはデータベースファイルに記録されるため初回のみ設定し、
+    接続ごとの設定（synchronous・外部キー）は毎回行う。
+    """
+    path = os.path.abspath(db_path)
+    initialized = path in _initialized_paths and os.path.exists(path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    if not initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        _initialized_paths.add(path)
+    return conn
+
+def _migrate(conn):
+    """既存データベースへの列追加（ゲームID）"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(games)")}
+    if "uid" not in columns:
+        conn.execute("ALTER TABLE games ADD COLUMN uid TEXT")
+        conn.execute("UPDATE games SET uid = 'sqlite-' || id")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_games_uid ON games(uid)")
+    conn.commit()
+
+def _integer(value):
+    """REAL列に保存されていた整数値を整数に戻す（以前のバージョンのデータベース）"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _insert_game(conn, game_record, recorded_at=None, row_id=None):
+    """1ゲーム分の行を追加（row_id 指定時はその記録順の位置に追加）"""
+    cursor = conn.execute(
+        "INSERT INTO games (id, recorded_at, uid) VALUES (?, ?, ?)",
+        (
+            row_id,
+            recorded_at or game_record.get("timestamp") or datetime.now().isoformat(),
+            game_record.get("id") or new_game_id(),
+        )
+    )
+    game_id = cursor.lastrowid
+    conn.executemany(
+        "INSERT INTO game_results (game_id, seat, player, score, score_diff, position, yakuman, special, confirmed_value) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                game_id, seat, player,
+                game_data['score'],
+                game_data['score_diff'],
+                game_data['position'],
+                game_data['yakuman'],
+                game_data['special'],
+                game_data['confirmed_value'],
+            )
+            for seat, (player, game_data) in enumerate(game_record["results"].items())
+        ]
+    )
+    return game_id
+
+def append_game(db_path, game_record):
+    """ゲーム記録を1件追加"""
+    with closing(connect(db_path)) as conn, conn:
+        return _insert_game(conn, game_record)
+
+def append_games(db_path, game_records):
+    """ゲーム記録をまとめて追加（1トランザクション）"""
+    with closing(connect(db_path)) as conn, conn:
+        for game_record in game_records:
+            _insert_game(conn, game_record)
+    return True
+
+def insert_game_after(db_path, game_record, previous_id=None):
+    """ゲーム記録を指定したゲームの直後に追加（取り消したゲームの復元用）
+    
+    直後の行番号が空いていない場合・指定したゲームがない場合は末尾に追加する。
+    """
+    with closing(connect(db_path)) as conn, conn:
+        row_id = None
+        if previous_id is None:
+            low = 0
+        else:
+            row = conn.execute("SELECT id FROM games WHERE uid = ?", (previous_id,)).fetchone()
+            low = row[0] if row else None
+        if low is not None:
+            following = conn.execute("SELECT MIN(id) FROM games WHERE id > ?", (low,)).fetchone()[0]
+            if following is not None and following - low > 1:
+                row_id = low + 1
+        return _insert_game(conn, game_record, row_id=row_id)
+
+def replace_game(db_path, game_id, game_record):
+    """ゲーム記録の置き換え（記録順の位置は変えない）"""
+    with closing(connect(db_path)) as conn, conn:
+        row = conn.execute("SELECT id FROM games WHERE uid = ?", (game_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM games WHERE id = ?", (row[0],))
+        _insert_game(conn, game_record, row_id=row[0])
+        return True
+
+def delete_game(db_path, game_id=None):
+    """ゲーム記録を1件削除（ゲームID指定なしの場合は直近の記録）"""
+    with closing(connect(db_path)) as conn, conn:
+        if game_id is not None:
+            cursor = conn.execute("DELETE FROM games WHERE uid = ?", (game_id,))
+            return cursor.rowcount > 0
+        row = conn.execute("SELECT MAX(id) FROM games").fetchone()
+        if row[0] is None:
+            return False
+        conn.execute("DELETE FROM games WHERE id = ?", (row[0],))
+        return True
+
+def iter_history(db_path):
+    """対戦履歴を記録順に1ゲームずつ返す（全件をメモリに載せない）"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT r.game_id, g.uid, g.recorded_at, r.player, r.score, r.score_diff, r.position, r.yakuman, r.special, r.confirmed_value "
+            "FROM game_results r JOIN games g ON g.id = r.game_id ORDER BY r.game_id, r.seat"
+        )
+        record = None
+        current_id = None
+        for game_id, uid, recorded_at, player, score, score_diff, position, yakuman, special, confirmed_value in rows:
+            if game_id != current_id:
+                if record is not None:
+                    yield record
+                record = make_game_record({}, uid, recorded_at)
+                current_id = game_id
+            record["results"][player] = {
+                'score': score,
+                'score_diff': _integer(score_diff),
+                'position': position,
+                'yakuman': yakuman,
+                'special': special,
+                'confirmed_value': confirmed_value
+            }
+        if record is not None:
+            yield record
+
+def load_history(db_path):
+    """対戦履歴の読み込み（記録順）"""
+    return list(iter_history(db_path))
+
+def save_history(db_path, history):
+    """対戦履歴の全件書き直し"""
+    with closing(connect(db_path)) as conn, conn:
+        conn.execute("DELETE FROM games")
+        for game_record in history:
+            _insert_game(conn, game_record)
+    return True
+
+def _row_stats(values):
+    """統計の列の値からプレイヤー統計（確定値以外は整数）"""
+    return {
+        key: value if key in REAL_STATS else _integer(value)
+        for key, value in zip(STAT_COLUMNS, values)
+    }
+
+def _select_stats(conn):
+    """統計データの取得"""
+    columns = list(STAT_COLUMNS.values())
+    rows = conn.execute(f"SELECT player, {', '.join(columns)} FROM player_stats")
+    return {row[0]: _row_stats(row[1:]) for row in rows}
+
+def save_stats(db_path, stats, base=None):
+    """統計データの保存
+    
+    base（前回保存・読み込み時点の統計）を渡すと、その後に他のプロセスが
+    保存していた場合はこのセッションでの増減だけを加えて統合する。
+    戻り値は保存した統計。
+    """
+    columns = list(STAT_COLUMNS.values())
+    placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+    with closing(connect(db_path)) as conn, conn:
+        if base is not None:
+            # 読み込みから書き込みまでを1つの書き込みトランザクションで行う
+            conn.execute("BEGIN IMMEDIATE")
+            current = _select_stats(conn)
+            if current != base:
+                stats = merge_stats(current, stats, base)
+        conn.execute("DELETE FROM player_stats")
+        conn.executemany(
+            f"INSERT INTO player_stats (player, {', '.join(columns)}) VALUES ({placeholders})",
+            [
+                (player, *(player_stats.get(key, 0) for key in STAT_COLUMNS))
+                for player, player_stats in stats.items()
+            ]
+        )
+    return stats
+
+def load_stats(db_path):
+    """統計データの読み込み"""
+    with closing(connect(db_path)) as conn:
+        return _select_stats(conn)
+
+def aggregate_stats(db_path, since=None):
+    """対戦履歴からプレイヤー別の統計をSQLで集計"""
+    query = (
+        "SELECT r.player, SUM(r.score_diff), "
+        "SUM(r.position = 1), SUM(r.position = 2), SUM(r.position = 3), SUM(r.position = 4), "
+        "SUM(r.special = '跳ばし'), SUM(r.special = '跳び'), "
+        "SUM(CASE WHEN r.yakuman > 0 THEN r.yakuman ELSE 0 END), SUM(r.confirmed_value) "
+        "FROM game_results r JOIN games g ON g.id = r.game_id"
+    )
+    params = ()
+    if since:
+        query += " WHERE g.recorded_at >= ?"
+        params = (since,)
+    query += " GROUP BY r.player"
+    
+    with closing(connect(db_path)) as conn:
+        return {row[0]: _row_stats(row[1:]) for row in conn.execute(query, params)}
+
+def _select_ledger(conn):
+    """集計台帳の取得（未保存ならNone）"""
+    ledger = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM stats_ledger")}
+    return ledger or None
+
+def save_ledger(db_path, ledger, base=None):
+    """集計台帳の保存
+    
+    base（前回保存・読み込み時点の台帳）を渡すと、その後に他のプロセスが
+    保存していた場合はゲームIDごとに統合する。戻り値は保存した台帳。
+    """
+    with closing(connect(db_path)) as conn, conn:
+        if base is not None:
+            conn.execute("BEGIN IMMEDIATE")
+            current = _select_ledger(conn)
+            if current is not None and current != base:
+                ledger = merge_ledger(current, ledger, base)
+        conn.execute("DELETE FROM stats_ledger")
+        conn.executemany(
+            "INSERT INTO stats_ledger (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in ledger.items()]
+        )
+    return ledger
+
+def load_ledger(db_path):
+    """集計台帳の読み込み（未保存ならNone）"""
+    with closing(connect(db_path)) as conn:
+        return _select_ledger(conn)
+
+def save_settings(db_path, settings):
+    """アプリ設定の保存"""
+    with closing(connect(db_path)) as conn, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()]
+        )
+    return True
+
+def load_settings(db_path):
+    """アプリ設定の読み込み"""
+    with closing(connect(db_path)) as conn:
+        return {
+            key: json.loads(value)
+            for key, value in conn.execute("SELECT key, value FROM settings")
+        }
@@ -0,0 +1,109 @@
+"""
+書き込み遅延モジュール - バックグラウンドスレッドでの一括書き込み
+"""
+import queue
+import threading
+import time
+
+# フラッシュ要求を示す目印
+_FLUSH = object()
+
+class WriteBehindWriter:
+    """書き込み処理をキューに積み、バックグラウンドスレッドでまとめて実行する
+    
+    短い待ち時間（delay秒）の間に届いた処理を1回にまとめ、同じキーの
+    上書き系の処理は最後の1件だけを実行する。追記系の処理（coalesce=False）は
+    すべて届いた順に実行する。キューが空になった時点で on_idle を呼び出す。
+    """
+    
+    def __init__(self, delay=0.5, on_idle=None):
+        self.delay = delay
+        self.on_idle = on_idle
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="mahjong-write-behind", daemon=True)
+        self._thread.start()
+    
+    def submit(self, key, func, coalesce=True):
+        """書き込み処理を登録"""
+        with self._condition:
+            self._pending += 1
+        self._queue.put((key, func, coalesce))
+    
+    @property
+    def pending(self):
+        """未完了の書き込み件数"""
+        with self._condition:
+            return self._pending
+    
+    def flush(self, timeout=None):
+        """登録済みの書き込みがすべて完了するまで待機"""
+        self._queue.put(_FLUSH)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        
+        error, self.last_error = self.last_error, None
+        return error is None
+    
+    def _collect(self):
+        """最初の処理が届いてから待ち時間内に届いた処理をまとめて取り出す"""
+        batch = []
+        deadline = None
+        item = self._queue.get()
+        while True:
+            if item is _FLUSH:
+                # フラッシュ要求があれば待ち時間を打ち切る
+                if batch:
+                    break
+            else:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.delay
+            
+            timeout = None
+            if batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+        return batch
+    
+    def _execute(self, batch):
+        """まとめた処理を実行（上書き系は同じキーの最後の1件のみ）"""
+        last_index = {}
+        for index, (key, _, coalesce) in enumerate(batch):
+            if coalesce:
+                last_index[key] = index
+        
+        for index, (key, func, coalesce) in enumerate(batch):
+            if coalesce and last_index[key] != index:
+                continue
+            try:
+                func()
+            except Exception as e:
+                self.last_error = e
+    
+    def _run(self):
+        """バックグラウンドスレッドの処理ループ"""
+        while True:
+            batch = self._collect()
+            try:
+                self._execute(batch)
+                if self.on_idle is not None and self._queue.empty():
+                    self.on_idle()
+            except Exception as e:
+                self.last_error = e
+            finally:
+                with self._condition:
+                    self._pending -= len(batch)
+                    self._condition.notify_all()
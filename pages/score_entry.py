@@ -8,8 +8,15 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from modules.score_utils import (
     validate_scores, update_player_stats, create_stats_dataframe, 
-    format_score, export_stats_to_csv, record_game, undo_last_game
+    format_score, export_stats_to_csv, export_history_download, record_game, undo_last_game,
+    current_rules, rescore_all_games, settle_session, rebase_stats, exclude_player_stats, rename_player,
+    verify_stats, repair_stats, undo_operation, redo_operation, edit_game, delete_game, game_label,
+    stats_tables, stats_frame
 )
+from modules.data_storage import mark_stats_changed
+from modules.simulator import SPECIAL_POINTS, rule_set_from_settings, simulate, compare
+from modules.scoring import score_game
+from modules.importer import import_file, detect_format, iter_rejected_csv
 from modules.data_init import clear_all_data, init_widget_defaults, reset_widget_values, init_uma_settings, save_current_state
 
 def show_mobile_score_entry():
@@ -126,6 +133,15 @@ def show_mobile_score_entry():
         with col2:
             yakuman_penalty = st.number_input("役満祝儀（-1の場合）", min_value=-100, max_value=100, value=st.session_state.get("yakuman_penalty", -20), step=5, key="yakuman_penalty", help="役満祝儀が-1の時の減点（負の値で設定）")
         
+        # ルール変更の過去のゲームへの反映
+        if st.session_state.get("history") and st.button("🔁 全ゲームを現在のルールで再計算", use_container_width=True, help="レート・ウマ・役満祝儀の変更を対戦履歴の全ゲームと総合統計に反映します"):
+            with st.spinner("再計算中..."):
+                success, message = rescore_all_games()
+            if success:
+                st.success(f"✅ {message}")
+            else:
+                st.warning(f"⚠️ {message}")
+        
         # プレイヤー名編集
         st.write("### プレイヤー名編集")
         st.info("利用可能プレイヤーリストを編集できます。")
@@ -136,9 +152,11 @@ def show_mobile_score_entry():
                 current_name = st.session_state.available_players[i]
                 new_name = st.text_input(f"プレイヤー {i+1}", value=current_name, key=f"edit_player_{i}")
                 if new_name != current_name and new_name.strip():
-                    # 統計データの名前も変更
-                    if current_name in st.session_state.stats:
-                        st.session_state.stats[new_name.strip()] = st.session_state.stats.pop(current_name)
+                    # 統計データ・対戦履歴の名前も変更
+                    renamed, message = rename_player(current_name, new_name.strip())
+                    if not renamed:
+                        st.warning(f"⚠️ {message}")
+                        continue
                     
                     # 利用可能プレイヤーリストを更新
                     st.session_state.available_players[i] = new_name.strip()
@@ -161,16 +179,10 @@ def show_mobile_score_entry():
         # 統計データクリーンアップ
         st.write("### 統計データ管理")
         if st.button("🗑️ プレイヤー1〜8の統計データを削除", help="プレイヤー1、プレイヤー2...プレイヤー8の統計データを削除します"):
-            deleted_players = []
+            # 統計・今回の戦績から削除（対戦履歴からの再集計でも集計しない）
+            deleted_players = exclude_player_stats([f"プレイヤー{i}" for i in range(1, 9)])
             for i in range(1, 9):
                 player_name = f"プレイヤー{i}"
-                if player_name in st.session_state.stats:
-                    del st.session_state.stats[player_name]
-                    deleted_players.append(player_name)
-                
-                # 今回の戦績からも削除
-                if hasattr(st.session_state, 'current_session_stats') and player_name in st.session_state.current_session_stats:
-                    del st.session_state.current_session_stats[player_name]
                 
                 # 利用可能プレイヤーリストからも削除
                 if player_name in st.session_state.available_players:
@@ -182,7 +194,80 @@ def show_mobile_score_entry():
                 st.rerun()
             else:
                 st.info("削除対象のプレイヤーが見つかりませんでした")
+        
+        # 統計と対戦履歴の照合（統計は対戦履歴から集計し直せる）
+        if st.button("🔍 統計を対戦履歴と照合", help="総合統計・今回の戦績が対戦履歴からの集計と一致するか確認します"):
+            try:
+                st.session_state.stats_check = verify_stats()
+            except ValueError as e:
+                st.session_state.stats_check = None
+                st.error(f"照合できませんでした: {e}")
+        
+        stats_check = st.session_state.get("stats_check")
+        if stats_check is not None:
+            differences = [
+                {"区分": label, "プレイヤー": item["player"], "項目": item["key"], "保存済み": item["stored"], "対戦履歴から": item["expected"]}
+                for key, label in (("stats", "総合"), ("current_session_stats", "今回の戦績"))
+                for item in stats_check[key]
+            ]
+            if not differences:
+                st.success("✅ 統計は対戦履歴からの集計と一致しています")
+            else:
+                st.warning(f"⚠️ {len(differences)}項目が対戦履歴からの集計と一致しません")
+                st.dataframe(pd.DataFrame(differences), use_container_width=True, hide_index=True)
+                rebuild = st.checkbox("統計リセット・削除の前のゲームも含めて全ゲームから集計する", key="stats_rebuild")
+                if st.button("🛠️ 対戦履歴から集計し直す", type="primary"):
+                    success, message = repair_stats(rebuild)
+                    st.session_state.stats_check = None
+                    if success:
+                        st.success(f"✅ {message}")
+                    else:
+                        st.error(f"集計し直せませんでした: {message}")
+        
+        # 対戦履歴の取り込み
+        st.write("### データ取り込み")
+        uploaded_file = st.file_uploader(
+            "バックアップJSON・JSON Lines・CSV",
+            type=["json", "jsonl", "csv"],
+            help="CSVは game_id, player, score（跳び・跳ばし加減後の点数）, special, yakuman の列。同じ game_id の連続した行を1ゲームとして取り込みます"
+        )
+        if uploaded_file is not None and st.button("📥 取り込み", use_container_width=True):
+            with st.spinner("取り込み中..."):
+                try:
+                    result = import_file(uploaded_file, detect_format(uploaded_file.name))
+                except (OSError, ValueError) as e:
+                    result = None
+                    st.error(f"取り込みに失敗しました: {e}")
+            if result is not None:
+                st.success(f"✅ {result['imported']}件のゲームを取り込みました")
+                if result["rejected"]:
+                    st.warning(f"⚠️ {len(result['rejected'])}件のゲームは取り込めませんでした")
+                    st.dataframe(pd.DataFrame(result["rejected"][:100]), use_container_width=True, hide_index=True)
+                    st.download_button(
+                        "📥 取り込めなかった行（CSV）",
+                        "".join(iter_rejected_csv(result["rejected"])).encode('utf-8-sig'),
+                        file_name="mahjong_import_rejected.csv", mime="text/csv"
+                    )
+    
+    # 点数入力（点数・跳び/跳ばし・役満祝儀の入力ではこのセクションのみ再実行）
+    score_input_section()
+    
+    # 今回の戦績・取り消し・元に戻す・修正の操作
+    action_section()
+    
+    # 今回の戦績の条件付き表示
+    if st.session_state.get("show_current_session", False):
+        render_current_session_stats()
     
+    # 統計表示
+    show_statistics()
+    
+    # ルール比較
+    render_rule_simulator()
+
+@st.fragment
+def score_input_section():
+    """点数入力・プレビュー・記録ボタン（入力の変更では統計を描き直さない）"""
     # 点数入力セクション - スマホ特化2x2グリッド
     st.markdown("### 点数入力")
     
@@ -234,15 +319,6 @@ def show_mobile_score_entry():
                 label_visibility="collapsed"
             )
             
-            # 役満祝儀による点数調整（合計には影響しない）
-            yakuman_adjustment = 0
-            if yakuman_count > 0:
-                yakuman_bonus_value = st.session_state.get("yakuman_bonus", 40)
-                yakuman_adjustment = yakuman_count * yakuman_bonus_value * 1000 * st.session_state.rate
-            elif yakuman_count < 0:
-                yakuman_penalty_value = st.session_state.get("yakuman_penalty", -20)
-                yakuman_adjustment = yakuman_count * abs(yakuman_penalty_value) * 1000 * st.session_state.rate
-            
             # 最終スコア計算
             final_score = base_score
             if special_option == "跳び":
@@ -466,57 +542,34 @@ def show_mobile_score_entry():
     # グリッドコンテナ終了
     st.markdown('</div>', unsafe_allow_html=True)
     
+    # 計算ルール（プレビュー・記録とも同じルールで1回だけ計算する）
+    rules = current_rules()
+    
     # 合計点数表示 - スマホ特化カード
     total_score = sum(scores.values())
-    if len(st.session_state.players) == 4:
-        expected_total = 100000
-    else:  # 三麻
-        expected_total = 105000
+    expected_total = rules.expected_total
     
-    # ウマ・オカのプレビュー計算
+    # ウマ・オカのプレビュー計算（計算結果は記録にもそのまま使う）
+    scored_results = None
     if total_score == expected_total:
-        # 順位計算
-        sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        ranks = {}
-        for i, (player, score) in enumerate(sorted_scores):
-            ranks[player] = i + 1
+        scored_results = score_game(scores, special_flags, yakuman_counts, rules)
         
         # ウマ・オカの表示
         st.markdown("### 🏆 順位とウマ・オカ")
-        for rank, (player, score) in enumerate(sorted_scores, 1):
-            base_score = 25000 if len(st.session_state.players) == 4 else 35000
-            score_diff = score - base_score
-            
-            # ウマ計算
-            if len(st.session_state.players) == 4:
-                uma_1st = st.session_state.get("uma_1st", 10)
-                uma_2nd = st.session_state.get("uma_2nd", 5)
-                uma_3rd = st.session_state.get("uma_3rd", -5)
-                uma_4th = st.session_state.get("uma_4th", -10)
-                uma_values = {1: uma_1st, 2: uma_2nd, 3: uma_3rd, 4: uma_4th}
-            else:
-                uma_1st = st.session_state.get("uma_1st_sanma", 15)
-                uma_2nd = st.session_state.get("uma_2nd_sanma", -5)
-                uma_3rd = st.session_state.get("uma_3rd_sanma", -10)
-                uma_values = {1: uma_1st, 2: uma_2nd, 3: uma_3rd}
-            
-            uma_score = uma_values[rank] * 1000
-            final_score = score_diff + uma_score
+        for player, result in sorted(scored_results.items(), key=lambda item: item[1]["position"]):
+            rank = result["position"]
+            score_diff = result["score"] - rules.base_score
+            uma_score = rules.uma_points(rank)
+            final_score = result["score_diff"]
             
             # 役満祝儀による追加得点（合計には含まない）
-            yakuman_count = yakuman_counts.get(player, 0)
-            yakuman_bonus = 0
-            if yakuman_count > 0:
-                yakuman_bonus_value = st.session_state.get("yakuman_bonus", 40)
-                yakuman_bonus = yakuman_count * yakuman_bonus_value * 1000 * st.session_state.rate
-            elif yakuman_count < 0:
-                yakuman_penalty_value = st.session_state.get("yakuman_penalty", -20)
-                yakuman_bonus = yakuman_count * abs(yakuman_penalty_value) * 1000 * st.session_state.rate
+            yakuman_count = result["yakuman"]
+            yakuman_bonus = rules.yakuman_adjustment(yakuman_count)
             
             # 確定値（レート×点数÷10）
-            confirmed_value = (final_score + yakuman_bonus) * st.session_state.rate / 10
+            confirmed_value = result["confirmed_value"]
             
-            rank_emoji = ["🥇", "🥈", "🥉", "4️⃣"][rank-1] if len(st.session_state.players) == 4 else ["🥇", "🥈", "🥉"][rank-1]
+            rank_emoji = ["🥇", "🥈", "🥉", "4️⃣"][rank-1] if rules.player_count == 4 else ["🥇", "🥈", "🥉"][rank-1]
             
             st.markdown(f"""
             <div style="background: linear-gradient(90deg, #f8f9fa, #e9ecef); padding: 0.8rem; margin: 0.3rem 0; border-radius: 8px; border-left: 4px solid {'#28a745' if final_score >= 0 else '#dc3545'};">
@@ -560,13 +613,10 @@ def show_mobile_score_entry():
     
     for player, yakuman_count in yakuman_counts.items():
         if yakuman_count != 0:
+            adjustment = rules.yakuman_adjustment(yakuman_count)
             if yakuman_count > 0:
-                yakuman_bonus_value = st.session_state.get("yakuman_bonus", 40)
-                adjustment = yakuman_count * yakuman_bonus_value * 1000 * st.session_state.rate
                 yakuman_details.append(f"{player}: +{yakuman_count}役満 = +{adjustment:,.0f}pt")
             else:
-                yakuman_penalty_value = st.session_state.get("yakuman_penalty", -20)
-                adjustment = yakuman_count * abs(yakuman_penalty_value) * 1000 * st.session_state.rate
                 yakuman_details.append(f"{player}: {yakuman_count}役満 = {adjustment:,.0f}pt")
             total_yakuman_adjustment += adjustment
     
@@ -578,7 +628,7 @@ def show_mobile_score_entry():
             st.markdown(f"- {detail}")
         
         # 合計変動とレート反映
-        confirmed_adjustment = total_yakuman_adjustment * st.session_state.rate / 10  # 確定値用の計算
+        confirmed_adjustment = total_yakuman_adjustment * rules.rate / 10  # 確定値用の計算
         
         st.markdown(f"""
         <div style="background: linear-gradient(90deg, #fff3cd, #ffeaa7); padding: 0.8rem; margin: 0.5rem 0; border-radius: 8px; border-left: 4px solid #f39c12;">
@@ -586,7 +636,7 @@ def show_mobile_score_entry():
                 📊 役満祝儀合計: {total_yakuman_adjustment:+,.0f}pt
             </div>
             <div style="font-size: 0.9rem; color: #856404; margin-top: 0.3rem;">
-                レート {st.session_state.rate}倍 | 確定値への反映: {confirmed_adjustment:+.1f}
+                レート {rules.rate}倍 | 確定値への反映: {confirmed_adjustment:+.1f}
             </div>
         </div>
         """, unsafe_allow_html=True)
@@ -596,14 +646,17 @@ def show_mobile_score_entry():
     
     if not record_button_disabled:
         if st.button("📝 記録", type="primary", use_container_width=True):
-            record_game(scores, special_flags, yakuman_counts)
+            record_game(scores, special_flags, yakuman_counts, scored_results)
             st.success("✅ ゲーム結果を記録しました！")
             # ウィジェット値をリセット
             reset_widget_values()
             st.rerun()
     else:
         st.button("📝 記録（点数を確認してください）", disabled=True, use_container_width=True)
-    
+
+@st.fragment
+def action_section():
+    """今回の戦績の表示切り替え・取り消し・元に戻す・やり直す・修正のボタン"""
     # 今回の戦績ボタン
     if hasattr(st.session_state, 'current_session_stats') and st.session_state.current_session_stats:
         # セッション統計の確認
@@ -629,13 +682,39 @@ def show_mobile_score_entry():
                 st.warning(f"⚠️ {message}")
             st.rerun()
     
-    # 今回の戦績の条件付き表示
-    if st.session_state.get("show_current_session", False):
-        render_current_session_stats()
+    # 元に戻す・やり直すボタン（記録・修正・削除を1操作ずつ）
+    if st.session_state.get("history_undo") or st.session_state.get("history_redo"):
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("⏪ 元に戻す", disabled=not st.session_state.get("history_undo"), use_container_width=True, help="直前の記録・修正・削除を元に戻します"):
+                success, message = undo_operation()
+                if success:
+                    st.success(f"✅ {message}")
+                else:
+                    st.warning(f"⚠️ {message}")
+                st.rerun()
+        with col2:
+            if st.button("⏩ やり直す", disabled=not st.session_state.get("history_redo"), use_container_width=True, help="元に戻した操作をやり直します"):
+                success, message = redo_operation()
+                if success:
+                    st.success(f"✅ {message}")
+                else:
+                    st.warning(f"⚠️ {message}")
+                st.rerun()
     
-    # 統計表示
-    show_statistics()
+    # 記録済みのゲームの修正
+    render_game_editor()
 
+# 統計表の列の書式（表の値は数値のまま持ち、表示時に書式を指定する）
+STATS_COLUMN_CONFIG = {
+    "得点": st.column_config.NumberColumn(format="%+.1f"),
+    "確定値": st.column_config.NumberColumn(format="%+.1f"),
+    "1位率": st.column_config.NumberColumn(format="%.0f%%"),
+    "2位率": st.column_config.NumberColumn(format="%.0f%%"),
+    "3位率": st.column_config.NumberColumn(format="%.0f%%"),
+}
+
+@st.fragment
 def show_statistics():
     """統計表示"""
     st.markdown("### 📊 統計")
@@ -644,61 +723,42 @@ def show_statistics():
         st.info("まだ記録がありません。")
         return
     
-    # 統計データをDataFrameに変換
-    stats_data = []
-    for player, stats in st.session_state.stats.items():
-        total_games = stats["1位"] + stats["2位"] + stats["3位"] + stats["4位"]
-        if total_games > 0:
-            top_rate = stats["1位"] / total_games * 100  # 1位率
-            second_rate = stats["2位"] / total_games * 100  # 2位率
-            third_rate = stats["3位"] / total_games * 100  # 3位率
-        else:
-            top_rate = 0
-            second_rate = 0
-            third_rate = 0
-        
-        stats_data.append({
-            "プレイヤー": player,
-            "得点": f"{stats['総合勝ち得点']:+.1f}",
-            "確定値": f"{stats['確定値']:+.1f}",
-            "1位": stats["1位"],
-            "2位": stats["2位"],
-            "3位": stats["3位"],
-            "4位": stats["4位"],
-            "1位率": f"{top_rate:.0f}%",
-            "2位率": f"{second_rate:.0f}%",
-            "3位率": f"{third_rate:.0f}%",
-            "跳ばし": stats["跳ばし"],
-            "跳び": stats["跳び"],
-            "役満": stats["役満"],
-            "総合勝ち得点_数値": stats['総合勝ち得点'],
-            "確定値_数値": stats['確定値'],
-            "1位率_数値": top_rate,
-            "2位率_数値": second_rate,
-            "3位率_数値": third_rate,
-            "総ゲーム数": total_games
-        })
-    
-    if stats_data:
-        df = pd.DataFrame(stats_data)
-        # 得点でソート
-        df = df.sort_values("得点", key=lambda x: x.str.replace("+", "").astype(float), ascending=False)
-        
+    # 統計の表・グラフの系列（統計が変わっていなければ前回の表を使う）
+    tables = stats_tables()
+    
+    if not tables["frame"].empty:
         # タブで表示を切り替え
         tab1, tab2, tab3 = st.tabs(["📋 統計表", "📊 グラフ", "🏆 順位分析"])
         
         with tab1:
             # 従来の統計表
-            display_df = df[["プレイヤー", "得点", "確定値", "1位", "2位", "3位", "4位", "1位率", "2位率", "3位率", "跳ばし", "跳び", "役満"]].copy()
-            st.dataframe(display_df, use_container_width=True, hide_index=True)
+            st.dataframe(tables["display"], use_container_width=True, hide_index=True, column_config=STATS_COLUMN_CONFIG)
         
         with tab2:
             # グラフ表示
-            show_statistics_graphs(df)
+            show_statistics_graphs(tables)
         
         with tab3:
             # 順位分析
-            show_rank_analysis(df)
+            show_rank_analysis(tables)
+        
+        # エクスポート（履歴はボタンを押した時に逐次出力から生成）
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.download_button(
+                "📥 統計CSV", export_stats_to_csv(), file_name="mahjong_stats.csv",
+                mime="text/csv", use_container_width=True
+            )
+        with col2:
+            st.download_button(
+                "📥 履歴CSV", export_history_download("csv"), file_name="mahjong_history.csv",
+                mime="text/csv", use_container_width=True
+            )
+        with col3:
+            st.download_button(
+                "📥 履歴JSONL", export_history_download("jsonl"), file_name="mahjong_history.jsonl",
+                mime="application/x-ndjson", use_container_width=True
+            )
         
         # 統計リセットボタン（警告付き）
         if st.button("⚠️ 統計リセット", type="secondary"):
@@ -721,6 +781,9 @@ def show_statistics():
                             "総合勝ち得点": 0, "1位": 0, "2位": 0, "3位": 0, "4位": 0,
                             "跳ばし": 0, "跳び": 0, "役満": 0, "確定値": 0
                         }
+                    # リセット時点の統計を集計の基準値にする（以前のゲームは集計しない）
+                    rebase_stats(reset=True)
+                    mark_stats_changed()
                     st.session_state.reset_confirmation = False
                     # データを保存
                     save_current_state()
@@ -731,32 +794,34 @@ def show_statistics():
                     st.session_state.reset_confirmation = False
                     st.rerun()
 
-def show_statistics_graphs(df):
-    """統計データのグラフ表示"""
-    if df.empty:
+def show_statistics_graphs(tables):
+    """統計データのグラフ表示（tables は stats_tables の表・グラフの系列）"""
+    if tables["frame"].empty:
         st.info("表示するデータがありません。")
         return
     
-    # フィルタ：ゲーム数が0より多いプレイヤーのみ
-    active_df = df[df["総ゲーム数"] > 0].copy()
-    
-    if active_df.empty:
+    # ゲーム数が0より多いプレイヤーのみ
+    charts = tables["charts"]
+    if tables["active"].empty:
         st.info("ゲーム記録のあるプレイヤーがいません。")
         return
     
+    # まとめて表示：全グラフを1つの図で描画（統計が変わるまで図の内容を使い回す）
+    if st.toggle("グラフをまとめて表示", value=True, key="stats_chart_overview"):
+        st.plotly_chart(stats_overview_figure(tables), use_container_width=True)
+        return
+    
     # 1. 総合得点と確定値の比較バーチャート
     st.markdown("#### 💰 得点比較")
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("**総合勝ち得点**")
-        chart_data = active_df.set_index("プレイヤー")["総合勝ち得点_数値"]
-        st.bar_chart(chart_data, height=300)
+        st.bar_chart(charts["総合勝ち得点"], height=300)
     
     with col2:
         st.markdown("**確定値**")
-        chart_data = active_df.set_index("プレイヤー")["確定値_数値"]
-        st.bar_chart(chart_data, height=300)
+        st.bar_chart(charts["確定値"], height=300)
     
     # 3. 1位率・2位率・3位率
     st.markdown("#### 🎯 順位率")
@@ -764,32 +829,60 @@ def show_statistics_graphs(df):
     col1, col2, col3 = st.columns(3)
     with col1:
         st.markdown("**1位率**")
-        chart_data = active_df.set_index("プレイヤー")["1位率_数値"]
-        st.bar_chart(chart_data, height=300)
+        st.bar_chart(charts["1位率"], height=300)
     
     with col2:
         st.markdown("**2位率**")
-        chart_data = active_df.set_index("プレイヤー")["2位率_数値"]
-        st.bar_chart(chart_data, height=300)
+        st.bar_chart(charts["2位率"], height=300)
     
     with col3:
         st.markdown("**3位率**")
-        chart_data = active_df.set_index("プレイヤー")["3位率_数値"]
-        st.bar_chart(chart_data, height=300)
+        st.bar_chart(charts["3位率"], height=300)
     
     # 4. 順位分布の積み上げ棒グラフ
     st.markdown("#### 🏆 順位分布")
-    rank_data = active_df[["プレイヤー", "1位", "2位", "3位", "4位"]].set_index("プレイヤー")
-    st.bar_chart(rank_data, height=350)
+    st.bar_chart(charts["順位分布"], height=350)
+
+# まとめて表示するグラフ（項目名, 行, 列）
+OVERVIEW_PANELS = [
+    ("総合勝ち得点", 1, 1), ("確定値", 1, 2),
+    ("1位率", 2, 1), ("2位率", 2, 2),
+    ("3位率", 3, 1), ("順位分布", 3, 2),
+]
 
-def show_rank_analysis(df):
-    """順位分析の詳細表示"""
-    if df.empty:
+# 順位分布の色
+RANK_COLORS = {'1位': '#FFD700', '2位': '#C0C0C0', '3位': '#CD7F32', '4位': '#808080'}
+
+def stats_overview_figure(tables):
+    """得点・確定値・順位率・順位分布を1つにまとめた図の内容（stats_tables の表とともに保持）"""
+    if "overview_figure" not in tables:
+        charts = tables["charts"]
+        fig = make_subplots(
+            rows=3, cols=2, subplot_titles=[name for name, _, _ in OVERVIEW_PANELS],
+            vertical_spacing=0.12, horizontal_spacing=0.1
+        )
+        for name, row, col in OVERVIEW_PANELS:
+            if name == "順位分布":
+                # 順位ごとの積み上げ棒グラフ
+                for rank, values in charts[name].items():
+                    fig.add_trace(go.Bar(x=values.index, y=values, name=rank, marker_color=RANK_COLORS[rank], legendgroup="rank"), row=row, col=col)
+            else:
+                values = charts[name]
+                fig.add_trace(go.Bar(x=values.index, y=values, name=name, showlegend=False), row=row, col=col)
+            if name.endswith("率"):
+                fig.update_yaxes(ticksuffix="%", row=row, col=col)
+        fig.update_layout(barmode="stack", height=900, margin=dict(t=40, b=20, l=20, r=20), legend=dict(orientation="h"))
+        tables["overview_figure"] = fig.to_dict()
+    return tables["overview_figure"]
+
+def show_rank_analysis(tables):
+    """順位分析の詳細表示（tables は stats_tables の表・グラフの系列）"""
+    if tables["frame"].empty:
         st.info("表示するデータがありません。")
         return
     
-    # フィルタ：ゲーム数が0より多いプレイヤーのみ
-    active_df = df[df["総ゲーム数"] > 0].copy()
+    # ゲーム数が0より多いプレイヤーのみ
+    active_df = tables["active"]
     
     if active_df.empty:
         st.info("ゲーム記録のあるプレイヤーがいません。")
@@ -799,8 +892,8 @@ def show_rank_analysis(df):
     st.markdown("#### 🏅 順位分析サマリー")
     
     # 最高成績プレイヤー
-    best_player = active_df.loc[active_df["総合勝ち得点_数値"].idxmax()]
-    worst_player = active_df.loc[active_df["総合勝ち得点_数値"].idxmin()]
+    best_player = active_df.loc[active_df["総合勝ち得点"].idxmax()]
+    worst_player = active_df.loc[active_df["総合勝ち得点"].idxmin()]
     
     col1, col2, col3 = st.columns(3)
     
@@ -808,14 +901,14 @@ def show_rank_analysis(df):
         st.metric(
             label="🥇 最高得点",
             value=best_player["プレイヤー"],
-            delta=f"{best_player['総合勝ち得点_数値']:+.1f}pt"
+            delta=f"{best_player['総合勝ち得点']:+.1f}pt"
         )
     
     with col2:
         st.metric(
             label="🎯 最高1位率",
-            value=active_df.loc[active_df["1位率_数値"].idxmax(), "プレイヤー"],
-            delta=f"{active_df['1位率_数値'].max():.1f}%"
+            value=active_df.loc[active_df["1位率"].idxmax(), "プレイヤー"],
+            delta=f"{active_df['1位率'].max():.1f}%"
         )
     
     with col3:
@@ -825,186 +918,260 @@ def show_rank_analysis(df):
             delta=f"{active_df['総ゲーム数'].max()}ゲーム"
         )
     
-    # 詳細統計
+    # 詳細統計（選択したプレイヤーの分のみ作成）
     st.markdown("#### 📈 詳細分析")
     
-    # パフォーマンス指標
-    for idx, row in active_df.iterrows():
-        with st.expander(f"🎮 {row['プレイヤー']} の詳細"):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.markdown(f"""
-                **基本統計**
-                - 総ゲーム数: {row['総ゲーム数']}回
-                - 総合勝ち得点: {row['総合勝ち得点_数値']:+.1f}pt
-                - 確定値: {row['確定値_数値']:+.1f}
-                - 1位率: {row['1位率_数値']:.1f}%
-                - 2位率: {row['2位率_数値']:.1f}%
-                - 3位率: {row['3位率_数値']:.1f}%
-                """)
-            
-            with col2:
-                st.markdown(f"""
-                **特殊統計**
-                - 跳ばし回数: {row['跳ばし']}回
-                - 跳び回数: {row['跳び']}回
-                - 役満回数: {row['役満']}回
-                """)
-            
-            # 個人の順位分布円グラフ
-            if row['総ゲーム数'] > 0:
-                rank_values = [row['1位'], row['2位'], row['3位'], row['4位']]
-                rank_labels = ['1位', '2位', '3位', '4位']
-                
-                # 0でない値のみを表示
-                non_zero_values = [(label, value) for label, value in zip(rank_labels, rank_values) if value > 0]
-                
-                if non_zero_values:
-                    labels, values = zip(*non_zero_values)
-                    fig = px.pie(
-                        values=values, 
-                        names=labels, 
-                        title=f"{row['プレイヤー']} の順位分布",
-                        color_discrete_map={
-                            '1位': '#FFD700',  # ゴールド
-                            '2位': '#C0C0C0',  # シルバー
-                            '3位': '#CD7F32',  # ブロンズ
-                            '4位': '#808080'   # グレー
-                        }
-                    )
-                    fig.update_layout(height=300)
-                    st.plotly_chart(fig, use_container_width=True)
+    players = active_df["プレイヤー"].tolist()
+    if st.session_state.get("rank_detail_player") not in players:
+        # 記録のなくなったプレイヤー・名前を変更したプレイヤーの選択は先頭に戻す
+        st.session_state.pop("rank_detail_player", None)
+    player = st.selectbox("詳細を表示するプレイヤー", players, key="rank_detail_player")
+    row = active_df[active_df["プレイヤー"] == player].iloc[0]
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown(f"""
+        **基本統計**
+        - 総ゲーム数: {row['総ゲーム数']}回
+        - 総合勝ち得点: {row['総合勝ち得点']:+.1f}pt
+        - 確定値: {row['確定値']:+.1f}
+        - 1位率: {row['1位率']:.1f}%
+        - 2位率: {row['2位率']:.1f}%
+        - 3位率: {row['3位率']:.1f}%
+        """)
+    
+    with col2:
+        st.markdown(f"""
+        **特殊統計**
+        - 跳ばし回数: {row['跳ばし']}回
+        - 跳び回数: {row['跳び']}回
+        - 役満回数: {row['役満']}回
+        """)
+    
+    # 個人の順位分布円グラフ
+    rank_counts = tuple(int(row[label]) for label in ('1位', '2位', '3位', '4位'))
+    if any(rank_counts):
+        st.plotly_chart(rank_pie_figure(player, rank_counts), use_container_width=True)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def rank_pie_figure(player, rank_counts):
+    """順位分布円グラフの図の内容（プレイヤーと順位ごとの回数が同じなら作り直さない）"""
+    rank_labels = ['1位', '2位', '3位', '4位']
+    
+    # 0でない値のみを表示
+    non_zero_values = [(label, value) for label, value in zip(rank_labels, rank_counts) if value > 0]
+    labels, values = zip(*non_zero_values)
+    fig = px.pie(
+        values=values, 
+        names=labels, 
+        title=f"{player} の順位分布",
+        color_discrete_map={
+            '1位': '#FFD700',  # ゴールド
+            '2位': '#C0C0C0',  # シルバー
+            '3位': '#CD7F32',  # ブロンズ
+            '4位': '#808080'   # グレー
+        }
+    )
+    fig.update_layout(height=300)
+    return fig.to_dict()
 
 
+def render_game_editor():
+    """記録済みのゲームの修正・削除UIコンポーネント"""
+    history = st.session_state.get("history", [])
+    if not history:
+        return
+    
+    with st.expander("✏️ 記録済みのゲームの修正", expanded=False):
+        game_count = len(history)
+        # 初期値は直近のゲーム、取り消し・削除で件数が減った場合は範囲内に戻す
+        if st.session_state.get("edit_game_number", game_count) > game_count or "edit_game_number" not in st.session_state:
+            st.session_state.edit_game_number = game_count
+        number = st.number_input("ゲーム番号（1が最初のゲーム）", min_value=1, max_value=game_count, step=1, key="edit_game_number")
+        game_record = history[number - 1]
+        game_id = game_record["id"]
+        st.caption(f"{number}ゲーム目: {game_label(game_record)}")
+        
+        # 点数は記録画面と同じく跳び・跳ばしの加減前の点数で入力する
+        scores = {}
+        special_flags = {}
+        yakuman_counts = {}
+        results = game_record["results"]
+        for col, (player, game_data) in zip(st.columns(len(results)), results.items()):
+            with col:
+                st.markdown(f'<div class="player-name">{player}</div>', unsafe_allow_html=True)
+                special = game_data["special"]
+                adjustment = {"跳び": -10000, "跳ばし": 10000}.get(special, 0)
+                base_score = st.number_input(
+                    "点数", min_value=-100000, max_value=100000, value=int(game_data["score"] - adjustment),
+                    step=1000, key=f"edit_score_{game_id}_{player}", label_visibility="collapsed"
+                )
+                special_option = st.selectbox(
+                    "特殊", ["なし", "跳び", "跳ばし"], index=["なし", "跳び", "跳ばし"].index(special),
+                    key=f"edit_special_{game_id}_{player}", label_visibility="collapsed"
+                )
+                yakuman_count = st.number_input(
+                    "役満祝儀", min_value=-10, max_value=10, value=int(game_data["yakuman"]),
+                    step=1, key=f"edit_yakuman_{game_id}_{player}", label_visibility="collapsed"
+                )
+            scores[player] = base_score + {"跳び": -10000, "跳ばし": 10000}.get(special_option, 0)
+            special_flags[player] = special_option
+            yakuman_counts[player] = yakuman_count
+        
+        validation = validate_scores(scores)
+        expected_total = validation["expected"]
+        if validation["total"] != expected_total:
+            st.warning(f"⚠️ 合計点数: {validation['total']:,}点（期待値: {expected_total:,}点 | 差額: {validation['difference']:+,}点）")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("💾 修正を保存", type="primary", disabled=validation["total"] != expected_total, use_container_width=True, help="現在のルールで計算し直して保存します"):
+                success, message = edit_game(game_id, scores, special_flags, yakuman_counts)
+                if success:
+                    st.success(f"✅ {message}")
+                else:
+                    st.warning(f"⚠️ {message}")
+                st.rerun()
+        with col2:
+            if st.button("🗑️ このゲームを削除", use_container_width=True, help="このゲームの記録を削除します（元に戻せます）"):
+                success, message = delete_game(game_id)
+                if success:
+                    st.success(f"✅ {message}")
+                else:
+                    st.warning(f"⚠️ {message}")
+                st.rerun()
+
+# ルール候補の表の列（列名→設定のキー）
+RULE_SET_COLUMNS = {
+    "1位": "uma_1st", "2位": "uma_2nd", "3位": "uma_3rd", "4位": "uma_4th",
+    "三麻1位": "uma_1st_sanma", "三麻2位": "uma_2nd_sanma", "三麻3位": "uma_3rd_sanma",
+    "レート": "rate", "役満+1": "yakuman_bonus", "役満-1": "yakuman_penalty",
+}
+
+def default_rule_sets():
+    """ルール候補の表の初期値（現在のルールと、ウマを変えた例）"""
+    current = {column: st.session_state.get(key) for column, key in RULE_SET_COLUMNS.items()}
+    current = {column: value for column, value in current.items() if value is not None}
+    rows = [
+        {"名前": "現在のルール", **current, "跳び/跳ばし": SPECIAL_POINTS},
+        {"名前": "ウマ10-20", **current, "1位": 20, "2位": 10, "3位": -10, "4位": -20, "跳び/跳ばし": SPECIAL_POINTS},
+        {"名前": "ウマ10-30", **current, "1位": 30, "2位": 10, "3位": -10, "4位": -30, "跳び/跳ばし": SPECIAL_POINTS},
+    ]
+    return pd.DataFrame(rows, columns=["名前", *RULE_SET_COLUMNS, "跳び/跳ばし"])
+
+@st.fragment
+def render_rule_simulator():
+    """ルール比較UIコンポーネント（対戦履歴を複数のルール候補で計算し直した成績の比較）"""
+    history = st.session_state.get("history", [])
+    if not history:
+        return
+    
+    with st.expander("🧪 ルール比較シミュレーター", expanded=False):
+        st.caption("記録済みの全ゲームを、ウマ（千点単位）・レート・役満祝儀（千点単位）・跳び/跳ばしの加減点を変えたルールで計算し直した場合の成績を比較します。記録・統計は変更しません。")
+        if "rule_sets_table" not in st.session_state:
+            st.session_state.rule_sets_table = default_rule_sets()
+        table = st.data_editor(st.session_state.rule_sets_table, num_rows="dynamic", hide_index=True, use_container_width=True, key="rule_sets_editor")
+        
+        if st.button("▶️ 比較する", type="primary", use_container_width=True):
+            rule_sets = []
+            for number, row in enumerate(table.to_dict("records"), 1):
+                # 空欄はデフォルトのルールの値を使う
+                settings = {key: row[column] for column, key in RULE_SET_COLUMNS.items() if pd.notna(row.get(column))}
+                special_points = row.get("跳び/跳ばし")
+                name = row.get("名前") if pd.notna(row.get("名前")) else f"候補{number}"
+                rule_sets.append(rule_set_from_settings(
+                    str(name), settings, int(special_points) if pd.notna(special_points) else SPECIAL_POINTS
+                ))
+            try:
+                st.session_state.rule_simulation = simulate(history, rule_sets)
+            except ValueError as e:
+                st.warning(f"⚠️ {e}")
+        
+        results = st.session_state.get("rule_simulation")
+        if results:
+            column = st.radio("比較する項目", ["確定値", "総合勝ち得点", "順位"], horizontal=True, key="rule_simulation_column")
+            comparison = compare(results, column)
+            comparison.index.name = "プレイヤー"
+            formats = {"確定値": "{:+,.1f}", "総合勝ち得点": "{:+,.0f}", "順位": "{:.0f}"}
+            st.dataframe(comparison.style.format(formats[column]), use_container_width=True)
+
+@st.fragment
 def render_current_session_stats():
     """今回の戦績表示UIコンポーネント"""
     if not hasattr(st.session_state, 'current_session_stats') or not st.session_state.current_session_stats:
         return
     
-    # セッション統計の確認
-    has_session_data = False
-    for player_stats in st.session_state.current_session_stats.values():
-        total_games = player_stats.get('1位', 0) + player_stats.get('2位', 0) + player_stats.get('3位', 0) + player_stats.get('4位', 0)
-        if total_games > 0:
-            has_session_data = True
-            break
-    
-    if not has_session_data:
+    # セッション統計をDataFrameに変換（ゲーム記録のあるプレイヤーのみ）
+    session_df = create_current_session_dataframe()
+    session_df = session_df[session_df['総ゲーム数'] > 0]
+    if session_df.empty:
         return
     
     st.markdown("### 🎯 今回の戦績")
     
-    # セッション統計をDataFrameに変換
-    session_df = create_current_session_dataframe()
+    # 表示用データフレームを作成（率・平均順位は作成時に列単位で計算済み）
+    rate = st.session_state.get("rate", 1.0)
+    display_df = pd.DataFrame({
+        'プレイヤー': session_df.index,
+        'ゲーム数': session_df['総ゲーム数'],
+        '平均順位': session_df['平均順位'],
+        '1位率': session_df['1位率'],
+        '2位率': session_df['2位率'],
+        '3位率': session_df['3位率'],
+        '4位率': session_df['4位率'],
+        '累計得点': session_df['総合勝ち得点'],
+        'レート込み': session_df['総合勝ち得点'] * rate,
+        '役満': session_df['役満'],
+        '跳ばし': session_df['跳ばし'],
+        '跳び': session_df['跳び'],
+    })
     
-    if not session_df.empty:
-        # 表示用データフレームを作成
-        display_data = []
-        for _, row in session_df.iterrows():
-            player = row['プレイヤー']
-            total_games = row['1位'] + row['2位'] + row['3位'] + row['4位']
-            
-            if total_games > 0:
-                avg_rank = (row['1位'] * 1 + row['2位'] * 2 + row['3位'] * 3 + row['4位'] * 4) / total_games
-                rate = st.session_state.get("rate", 1.0)
-                
-                display_data.append({
-                    'プレイヤー': player,
-                    'ゲーム数': total_games,
-                    '平均順位': avg_rank,
-                    '1位率': row['1位'] / total_games,
-                    '2位率': row['2位'] / total_games,
-                    '3位率': row['3位'] / total_games,
-                    '4位率': row['4位'] / total_games,
-                    '累計得点': row['総合勝ち得点'],
-                    'レート込み': row['総合勝ち得点'] * rate,
-                    '役満': row['役満'],
-                    '跳ばし': row['跳ばし'],
-                    '跳び': row['跳び']
-                })
-        
-        if display_data:
-            display_df = pd.DataFrame(display_data)
-            
-            # スタイリングされたテーブル表示
-            styled_df = display_df.style.format({
-                "ゲーム数": "{:.0f}",
-                "平均順位": "{:.2f}",
-                "1位率": "{:.1%}",
-                "2位率": "{:.1%}",
-                "3位率": "{:.1%}",
-                "4位率": "{:.1%}",
-                "累計得点": "{:.1f}",
-                "レート込み": "{:.1f}",
-                "役満": "{:.0f}",
-                "跳ばし": "{:.0f}",
-                "跳び": "{:.0f}"
-            }).set_properties(**{
-                'text-align': 'center'
-            })
-            
-            st.dataframe(styled_df, use_container_width=True, hide_index=True)
-            
-            # 清算ボタン - 目立つスタイル
-            st.markdown("---")
-            st.markdown("""
-            <div style="text-align: center; margin: 1rem 0;">
-                <p style="color: #ff6b35; font-weight: bold; margin-bottom: 0.5rem;">
-                    💰 今回の戦績を確定値に反映しますか？
-                </p>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
-                if st.button("🧮 清算実行", type="primary", use_container_width=True, help="今回の戦績を確定値に反映し、今回の戦績をリセットします"):
-                    settle_current_session()
-                    st.success("✅ 今回の戦績を確定値に反映しました！")
-                    st.rerun()
+    # スタイリングされたテーブル表示
+    styled_df = display_df.style.format({
+        "ゲーム数": "{:.0f}",
+        "平均順位": "{:.2f}",
+        "1位率": "{:.1f}%",
+        "2位率": "{:.1f}%",
+        "3位率": "{:.1f}%",
+        "4位率": "{:.1f}%",
+        "累計得点": "{:.1f}",
+        "レート込み": "{:.1f}",
+        "役満": "{:.0f}",
+        "跳ばし": "{:.0f}",
+        "跳び": "{:.0f}"
+    }).set_properties(**{
+        'text-align': 'center'
+    })
+    
+    st.dataframe(styled_df, use_container_width=True, hide_index=True)
+    
+    # 清算ボタン - 目立つスタイル
+    st.markdown("---")
+    st.markdown("""
+    <div style="text-align: center; margin: 1rem 0;">
+        <p style="color: #ff6b35; font-weight: bold; margin-bottom: 0.5rem;">
+            💰 今回の戦績を確定値に反映しますか？
+        </p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        if st.button("🧮 清算実行", type="primary", use_container_width=True, help="今回の戦績を確定値に反映し、今回の戦績をリセットします"):
+            settle_current_session()
+            st.success("✅ 今回の戦績を確定値に反映しました！")
+            st.rerun()
 
 
 def create_current_session_dataframe():
-    """今回のセッション統計をDataFrameに変換"""
-    if not hasattr(st.session_state, 'current_session_stats'):
-        return pd.DataFrame()
-    
-    session_data = []
-    for player, stats in st.session_state.current_session_stats.items():
-        session_data.append({
-            'プレイヤー': player,
-            '1位': stats.get('1位', 0),
-            '2位': stats.get('2位', 0), 
-            '3位': stats.get('3位', 0),
-            '4位': stats.get('4位', 0),
-            '総合勝ち得点': stats.get('総合勝ち得点', 0),
-            '役満': stats.get('役満', 0),
-            '跳ばし': stats.get('跳ばし', 0),
-            '跳び': stats.get('跳び', 0)
-        })
-    
-    return pd.DataFrame(session_data)
+    """今回のセッション統計をDataFrameに変換（行はプレイヤー名、stats_frame の列）"""
+    return stats_frame(st.session_state.get('current_session_stats', {}))
 
 
 def settle_current_session():
-    """今回の戦績を確定値に反映"""
-    if not hasattr(st.session_state, 'current_session_stats'):
-        return
-    
-    # 現在の統計に今回の戦績を加算
-    for player, session_stats in st.session_state.current_session_stats.items():
-        if player not in st.session_state.stats:
-            st.session_state.stats[player] = {
-                '1位': 0, '2位': 0, '3位': 0, '4位': 0,
-                '総合勝ち得点': 0, '役満': 0, '跳ばし': 0, '跳び': 0, '確定値': 0
-            }
-        
-        # 統計を加算
-        for key, value in session_stats.items():
-            st.session_state.stats[player][key] = st.session_state.stats[player].get(key, 0) + value
-    
-    # 今回の戦績をリセット
-    st.session_state.current_session_stats = {}
+    """未清算の全ゲーム（他のセッションで記録したゲームを含む）を確定値に反映"""
+    settle_session()
     
     # データを保存
     save_current_state()
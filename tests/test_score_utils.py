@@ -0,0 +1,104 @@
+"""
+集計台帳を引き継いだ保存データ（台帳のない以前のバージョン）での修正・削除・元に戻すのテスト
+
+python -m pytest でリポジトリのルートから実行する。
+"""
+import logging
+import pytest
+import streamlit as st
+from modules.aggregation import apply_game
+from modules.records import make_game_record
+from modules.scoring import rules_from_settings, score_game
+from modules.score_utils import (
+    stats_ledger, edit_game, delete_game, undo_operation, redo_operation, rebase_stats, verify_stats,
+)
+
+PLAYERS = ["A", "B", "C", "D"]
+
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+def make_game(scores):
+    """点数からゲーム記録を作成（デフォルトのルール）"""
+    results = score_game(dict(zip(PLAYERS, scores)), None, None, rules_from_settings({}, 4))
+    return make_game_record(results, timestamp="2024-01-01T10:00:00")
+
+@pytest.fixture
+def legacy_data(tmp_path, monkeypatch):
+    """清算済みの2ゲームと、その統計だけがある保存データ（集計台帳なし）"""
+    monkeypatch.chdir(tmp_path)
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    
+    history = [make_game([45000, 25000, 20000, 10000]), make_game([10000, 45000, 25000, 20000])]
+    stats = {}
+    for game_record in history:
+        apply_game(stats, game_record)
+    st.session_state.players = list(PLAYERS)
+    st.session_state.history = history
+    st.session_state.stats = stats
+    st.session_state.current_session_stats = {}
+    stats_ledger()
+    return history
+
+def positions(player):
+    """プレイヤーの順位の回数"""
+    player_stats = st.session_state.stats[player]
+    return [player_stats[f"{position}位"] for position in range(1, 5)]
+
+def assert_consistent():
+    """保存済みの統計が対戦履歴からの集計と一致すること"""
+    assert verify_stats() == {"stats": [], "current_session_stats": []}
+
+def test_adopted_ledger_counts_settled_games_in_baseline(legacy_data):
+    ledger = stats_ledger()
+    assert ledger["baseline_through"] == legacy_data[-1]["id"]
+    assert ledger["baseline_after"] is None
+    assert positions("A") == [1, 0, 0, 1]
+
+def test_edit_baseline_game_updates_stats(legacy_data):
+    success, _ = edit_game(legacy_data[0]["id"], {"A": 10000, "B": 45000, "C": 25000, "D": 20000})
+    assert success
+    assert positions("A") == [0, 0, 0, 2]
+    assert_consistent()
+    
+    undo_operation()
+    assert positions("A") == [1, 0, 0, 1]
+    assert_consistent()
+    
+    redo_operation()
+    assert positions("A") == [0, 0, 0, 2]
+    assert_consistent()
+
+def test_delete_baseline_game_updates_stats(legacy_data):
+    success, message = delete_game(legacy_data[0]["id"])
+    assert success
+    assert "統計リセット前" not in message
+    assert positions("A") == [0, 0, 0, 1]
+    assert_consistent()
+    
+    undo_operation()
+    assert positions("A") == [1, 0, 0, 1]
+    assert_consistent()
+
+def test_delete_last_baseline_game_moves_baseline_through(legacy_data):
+    delete_game(legacy_data[-1]["id"])
+    assert stats_ledger()["baseline_through"] == legacy_data[0]["id"]
+    assert positions("B") == [0, 1, 0, 0]
+    assert_consistent()
+    
+    undo_operation()
+    assert stats_ledger()["baseline_through"] == legacy_data[-1]["id"]
+    assert positions("B") == [1, 1, 0, 0]
+    assert_consistent()
+
+def test_games_before_reset_do_not_change_stats(legacy_data):
+    for player_stats in st.session_state.stats.values():
+        for key in player_stats:
+            player_stats[key] = 0
+    rebase_stats(reset=True)
+    
+    success, message = delete_game(legacy_data[0]["id"])
+    assert success
+    assert "統計リセット前" in message
+    assert positions("A") == [0, 0, 0, 0]
+    assert_consistent()